@@ -0,0 +1,129 @@
+import heapq
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+_MAX_GRAM = 3
+
+# Match ranks, the lower the better
+RANK_EXACT = 0
+RANK_SEGMENT = 1
+RANK_PREFIX = 2
+RANK_SUBSTRING = 3
+
+
+def _grams(text, size):
+    return {text[i:i+size] for i in range(len(text) - size + 1)}
+
+
+def match_rank(account, account_str) -> Optional[int]:
+    """
+    Rank how the given string matches the account.
+
+    Returns:
+        int or None: RANK_EXACT if it is the whole account, RANK_SEGMENT if it matches
+            complete segments, RANK_PREFIX if it is the prefix of a segment,
+            RANK_SUBSTRING if it is only a substring, and None if it does not match.
+    """
+    if account == account_str:
+        return RANK_EXACT
+    if f":{account_str}:" in f":{account}:":
+        return RANK_SEGMENT
+    if f":{account_str}" in f":{account}":
+        return RANK_PREFIX
+    if account_str in account:
+        return RANK_SUBSTRING
+    return None
+
+
+class AccountIndex:
+    """
+    An n-gram index over account names, which returns deterministic ranked matches.
+
+    The matches are ranked by the match rank (exact > segment > prefix > substring),
+    then by the recency of usage (recently used first), then by the account name.
+    """
+    def __init__(self, accounts: Iterable[str], recent: Iterable[str] = ()):
+        """
+        Args:
+            accounts (Iterable[str]): The accounts to be indexed.
+            recent (Iterable[str]): The used accounts, ordered from the oldest to the latest.
+        """
+        self._accounts = sorted(set(accounts))
+        grams: Dict[str, Set[int]] = {}
+        for id_, account in enumerate(self._accounts):
+            for size in range(1, _MAX_GRAM + 1):
+                for gram in _grams(account, size):
+                    grams.setdefault(gram, set()).add(id_)
+        # Tuples are more compact than sets, the index is never changed once built
+        self._grams: Dict[str, Tuple[int, ...]] = {gram: tuple(ids) for gram, ids in grams.items()}
+        self._last_used: Dict[str, int] = {}
+        self._usage_count = 0
+        self._update_usage(recent)
+
+    def __len__(self):
+        return len(self._accounts)
+
+    def _update_usage(self, accounts):
+        for account in accounts:
+            self._usage_count += 1
+            self._last_used[account] = self._usage_count
+
+    def with_usage(self, accounts: Iterable[str]) -> "AccountIndex":
+        """
+        Return a copy of the index with the given accounts marked as the latest used.
+        The n-gram index is shared, since the account set is not changed.
+        """
+        index = self.__class__.__new__(self.__class__)
+        index._accounts = self._accounts  # noqa: SLF001
+        index._grams = self._grams  # noqa: SLF001
+        index._last_used = dict(self._last_used)  # noqa: SLF001
+        index._usage_count = self._usage_count  # noqa: SLF001
+        index._update_usage(accounts)  # noqa: SLF001
+        return index
+
+    def _candidates(self, account_str):
+        if not account_str:
+            return range(len(self._accounts))
+        size = min(len(account_str), _MAX_GRAM)
+        ids = None
+        for gram in _grams(account_str, size):
+            posting = self._grams.get(gram)
+            if not posting:
+                return ()
+            ids = set(posting) if ids is None else ids.intersection(posting)
+            if not ids:
+                return ()
+        return ids
+
+    def search(self, account_str, limit=None) -> List[str]:
+        """
+        Find the accounts that contain the given string, ordered by rank.
+
+        Args:
+            account_str (str): A substring to search for in the account string.
+            limit (int): The max amount of results, no limit if None.
+
+        Returns:
+            List[str]: The matched accounts.
+        """
+        matches = []
+        for id_ in self._candidates(account_str):
+            account = self._accounts[id_]
+            rank = match_rank(account, account_str)
+            if rank is not None:
+                matches.append((rank, -self._last_used.get(account, 0), account))
+        if limit is None:
+            matches.sort()
+        else:
+            matches = heapq.nsmallest(limit, matches)
+        return [account for *_, account in matches]
+
+    def find(self, account_str) -> Optional[str]:
+        """
+        Find the best matched account that contains the given string.
+
+        Returns:
+            str or None: The best matched account, or None if no such account is found.
+        """
+        matches = self.search(account_str, limit=1)
+        return matches[0] if matches else None
@@ -0,0 +1,58 @@
+import pytest
+from bean_utils.account_index import AccountIndex, match_rank, RANK_EXACT, RANK_SEGMENT, RANK_PREFIX, RANK_SUBSTRING
+
+
+@pytest.mark.parametrize(
+    ("account", "account_str", "exp"),
+    [
+        ("Assets:US:BofA:Checking", "Assets:US:BofA:Checking", RANK_EXACT),
+        ("Assets:US:BofA:Checking", "BofA:Checking", RANK_SEGMENT),
+        ("Assets:US:BofA:Checking", "BofA", RANK_SEGMENT),
+        ("Assets:US:BofA:Checking", "Check", RANK_PREFIX),
+        ("Assets:US:BofA:Checking", "US:Bo", RANK_PREFIX),
+        ("Assets:US:BofA:Checking", "ecking", RANK_SUBSTRING),
+        ("Assets:US:BofA:Checking", "Savings", None),
+    ],
+)
+def test_match_rank(account, account_str, exp):
+    assert match_rank(account, account_str) == exp
+
+
+def test_account_index():
+    accounts = [
+        "Expenses:Food:Restaurant",
+        "Expenses:Food:Groceries",
+        "Assets:US:BofA:Checking",
+        "Assets:US:Chase:Checking",
+        "Assets:US:Checkings",
+        "Liabilities:US:CheckingCard",
+    ]
+    index = AccountIndex(accounts)
+    assert len(index) == 6
+    # Rank first, then name
+    assert index.search("Checking") == [
+        "Assets:US:BofA:Checking",
+        "Assets:US:Chase:Checking",
+        "Assets:US:Checkings",
+        "Liabilities:US:CheckingCard",
+    ]
+    assert index.search("hecking", limit=2) == ["Assets:US:BofA:Checking", "Assets:US:Chase:Checking"]
+    assert index.find("Food") == "Expenses:Food:Groceries"
+    assert index.find("Fo") == "Expenses:Food:Groceries"
+    assert index.find("Travel") is None
+    assert index.find("Food:Restaurant:Dinner") is None
+    assert index.search("") == sorted(accounts)
+
+    # Recently used first within the same rank
+    used = index.with_usage(["Expenses:Food:Restaurant", "Assets:US:Chase:Checking"])
+    assert used.find("Food") == "Expenses:Food:Restaurant"
+    assert used.search("Checking")[:2] == ["Assets:US:Chase:Checking", "Assets:US:BofA:Checking"]
+    # Exact segment match is still preferred to a recently used prefix match
+    used = used.with_usage(["Assets:US:Checkings"])
+    assert used.find("Checking") == "Assets:US:Chase:Checking"
+    # The original index is not changed
+    assert index.find("Food") == "Expenses:Food:Groceries"
+
+    # Initialize with recently used accounts
+    index = AccountIndex(accounts, ["Expenses:Food:Restaurant", "Expenses:Food:Groceries"])
+    assert index.find("Food") == "Expenses:Food:Groceries"
@@ -0,0 +1,114 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import conf
+
+
+# Status codes of the responses worth retrying
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+
+class RequestError(Exception):
+    """A request to a remote service (e.g. embedding, RAG) failed."""
+
+
+class RetryableError(RequestError):
+    """The request failed temporarily (e.g. rate limited), and it may succeed if retried."""
+    def __init__(self, message, retry_after=None):
+        """
+        Args:
+            message (str): The error message.
+            retry_after (float): The seconds to wait suggested by the server, if any.
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    """Parse the seconds of the `Retry-After` header, None if it is absent or an HTTP date."""
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Space the requests evenly, so that at most `requests_per_minute` requests are started
+    in a minute. It is shared by the threads of an executor.
+    """
+    def __init__(self, requests_per_minute):
+        self.interval = 60 / requests_per_minute
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until the next request is allowed."""
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def call_with_retry(func, *args, limiter=None, max_retries=5, backoff=1.0, max_delay=None):
+    """
+    Call the function, and retry with exponential backoff if it raises `RetryableError`.
+
+    Args:
+        func (Callable): The function to call.
+        limiter (RateLimiter): The limiter to acquire before each attempt, if any.
+        max_retries (int): The max amount of retries, the last error is raised after that.
+        backoff (float): The seconds to wait before the first retry, doubled for each retry.
+            The `retry_after` of the error takes precedence.
+        max_delay (float): The max seconds to wait before a retry, unlimited if None.
+    """
+    attempt = 0
+    while True:
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return func(*args)
+        except RetryableError as e:
+            if attempt >= max_retries:
+                raise
+            delay = e.retry_after
+            if delay is None:
+                # Jitter, so that the concurrent requests are not retried at the same time
+                delay = backoff * 2 ** attempt * (0.5 + random.random() / 2)  # noqa: S311
+            if max_delay is not None:
+                delay = min(delay, max_delay)
+            attempt += 1
+            conf.logger.warning("%s, retry in %.2fs (%d/%d)", e, delay, attempt, max_retries)
+            time.sleep(delay)
+
+
+def run_batches(func, batches, max_workers=4, requests_per_minute=None, max_retries=5, backoff=1.0):
+    """
+    Call the function on each batch concurrently, with a limit of the concurrency and the
+    request rate. Failed batches are retried, see `call_with_retry`.
+
+    Args:
+        func (Callable): The function to call with each batch.
+        batches (list): The batches.
+        max_workers (int): The max amount of concurrent calls.
+        requests_per_minute (int): The max amount of calls started in a minute, unlimited if None.
+        max_retries (int): The max amount of retries of each batch.
+        backoff (float): The seconds to wait before the first retry of a batch.
+
+    Returns:
+        list: The results in the order of the batches.
+
+    Raises:
+        Exception: The error of the first failed batch, after the retries.
+    """
+    limiter = RateLimiter(requests_per_minute) if requests_per_minute else None
+    def _call(batch):
+        return call_with_retry(func, batch, limiter=limiter, max_retries=max_retries, backoff=backoff)
+
+    if len(batches) <= 1 or max_workers <= 1:
+        return [_call(batch) for batch in batches]
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="beanbot-batch") as executor:
+        return list(executor.map(_call, batches))
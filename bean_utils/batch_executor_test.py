@@ -0,0 +1,105 @@
+import threading
+import time
+import pytest
+import requests
+from bean_utils import batch_executor, bean, vec_query
+from bean_utils.batch_executor import RateLimiter, RetryableError, parse_retry_after, run_batches
+from bean_utils.bean_test import MockResponse, mock_config, mock_embedding
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Record the sleeps instead of sleeping."""
+    result = []
+    monkeypatch.setattr(batch_executor.time, "sleep", result.append)
+    return result
+
+
+def test_run_batches_in_order():
+    barrier = threading.Barrier(3)
+    def _square(batch):
+        # All of the first 3 batches have to be running at the same time
+        if batch[0] < 3:
+            barrier.wait(timeout=5)
+        time.sleep(0.01 * (5 - batch[0]))
+        return [x * x for x in batch]
+
+    batches = [[i, i] for i in range(5)]
+    assert run_batches(_square, batches, max_workers=3) == [[i * i, i * i] for i in range(5)]
+    assert run_batches(_square, [], max_workers=3) == []
+
+
+def test_run_batches_retry(sleeps):
+    attempts = {}
+    def _flaky(batch):
+        attempts[batch] = attempts.get(batch, 0) + 1
+        if batch == "retry-after" and attempts[batch] == 1:
+            raise RetryableError(msg, retry_after=7)
+        if (batch == "flaky" and attempts[batch] <= 2) or batch == "broken":
+            raise RetryableError(msg)
+        return batch
+    msg = "Server error"
+
+    assert run_batches(_flaky, ["retry-after", "flaky", "ok"], max_workers=1, backoff=1.0) == [
+        "retry-after", "flaky", "ok"]
+    # Retry-After is respected, otherwise the backoff is doubled with jitter
+    assert sleeps[0] == 7
+    assert 0.5 <= sleeps[1] <= 1.0
+    assert 1.0 <= sleeps[2] <= 2.0
+
+    with pytest.raises(RetryableError, match="Server error"):
+        run_batches(_flaky, ["broken"], max_retries=2)
+    assert attempts["broken"] == 3
+
+    # The delay is capped, including Retry-After
+    sleeps.clear()
+    attempts.clear()
+    assert batch_executor.call_with_retry(_flaky, "retry-after", max_delay=1.5) == "retry-after"
+    with pytest.raises(RetryableError):
+        batch_executor.call_with_retry(_flaky, "broken", max_retries=3, max_delay=1.5)
+    assert sleeps[0] == 1.5
+    assert len(sleeps) == 4
+    assert all(delay <= 1.5 for delay in sleeps)
+
+    # Other errors are not retried
+    def _fail(batch):
+        attempts["fail"] = attempts.get("fail", 0) + 1
+        raise ValueError(batch)
+    with pytest.raises(ValueError, match="bad"):
+        run_batches(_fail, ["bad"])
+    assert attempts["fail"] == 1
+
+
+def test_rate_limiter(sleeps, monkeypatch):
+    monkeypatch.setattr(batch_executor.time, "monotonic", lambda: 100.0)
+    limiter = RateLimiter(120)
+    for _ in range(3):
+        limiter.acquire()
+    # The first request is started immediately, the others are spaced by 0.5s
+    assert sleeps == [0.5, 1.0]
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") is None
+
+
+def test_build_tx_db_retry(mock_config, monkeypatch, sleeps):
+    mock_config["embedding"] = {
+        "enable": True,
+        "db_store_folder": mock_config.embedding.db_store_folder,
+        "transaction_amount": 100,
+        "build_workers": 2,
+    }
+    statuses = [429, 503]
+    def _mock_embedding_post(*args, json, **kwargs):
+        if statuses:
+            return MockResponse({"error": "busy"}, status_code=statuses.pop(0), headers={"Retry-After": "1"})
+        result, tokens = mock_embedding(json["input"])
+        return MockResponse({"data": result, "usage": {"total_tokens": tokens}})
+    monkeypatch.setattr(requests.Session, "post", _mock_embedding_post)
+
+    manager = bean.BeanManager(mock_config.beancount.filename)
+    assert vec_query.build_tx_db(manager.entries) == {"tokens": 100, "reused": 0, "embedded": 100}
+    assert sleeps == [1.0, 1.0]
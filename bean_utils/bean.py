@@ -1,21 +1,35 @@
 import contextlib
-from pathlib import Path
+import dataclasses
+import os
+import threading
+import time
+from concurrent.futures import Future
 from datetime import datetime
 from decimal import Decimal
+from pathlib import Path
 from conf.i18n import gettext as _
 import re
-import shlex
-import subprocess
-from beancount import loader
 from beancount.parser import parser
-from beancount.query import query
-from beancount.core.data import Open, Close, Transaction
-from beancount.core.number import MISSING
-from typing import List
-from bean_utils.vec_query import query_txs
+from beancount.core.data import Transaction
+from typing import List, Union
+from bean_utils.batch_executor import RequestError
+from bean_utils.vec_query import query_txs, query_txs_batch
 from bean_utils.rag import complete_rag
+from bean_utils import ledger_cache
+from bean_utils.snapshot import LedgerSnapshot
+from bean_utils.lru_cache import LRUCache
+from bean_utils.cube import match_aggregate_query
+from bean_utils.watcher import FileWatcher
+from bean_utils.formatter import IncrementalFormatter, format_file
+from bean_utils.timing import span, trace
 import conf
 
+try:
+    import fcntl
+except ImportError:
+    # Advisory file locks are not available on Windows
+    fcntl = None
+
 
 NoTransactionError = ValueError("No transaction found")
 transaction_tmpl = """
@@ -25,77 +39,280 @@ transaction_tmpl = """
 
 
 TXS_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}(.*)")
+_WHITESPACES_RE = re.compile(r"\s+")
+_QUERY_STRING_RE = re.compile(r"""("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')""")
+
+
+def normalize_query(q):
+    """
+    Normalize a BQL query by collapsing whitespaces outside string literals, and
+    stripping the trailing semicolon.
+    """
+    segments = _QUERY_STRING_RE.split(q.strip().rstrip(";"))
+    # String literals are at odd positions
+    for i in range(0, len(segments), 2):
+        segments[i] = _WHITESPACES_RE.sub(" ", segments[i])
+    return "".join(segments).strip()
+
+
+def _rolling_include_path():
+    """Get the rolling file of the current period relative to the entrypoint, None if not configured."""
+    rolling_file = conf.config.beancount.get("rolling_file")
+    if not rolling_file:
+        return None
+    return datetime.now().astimezone().strftime(rolling_file)
+
+
+@contextlib.contextmanager
+def _file_lock(fname):
+    """
+    Hold an exclusive advisory lock of the file, which is shared by bot processes.
+    The lock is taken on `{fname}.lock`, since the file itself may be replaced by a
+    new inode (e.g. when it is realigned), which would not be locked by others.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(f"{fname}.lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class CommitQueue:
+    """
+    Queue of submitted transactions. Submissions arrived within the window are written
+    in one batch by a worker thread, and each submission is acknowledged through its
+    future once the batch is durable.
+    """
+    def __init__(self, commit_batch, window=0.0):
+        """
+        Args:
+            commit_batch (Callable[[List[str]], None]): Write a batch of transactions.
+            window (float): Seconds to wait for more submissions before writing.
+        """
+        self._commit_batch = commit_batch
+        self.window = window
+        self._pending = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, data) -> Future:
+        future = Future()
+        with self._lock:
+            self._pending.append((data, future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="beanbot-commit",
+                                                daemon=True)
+                self._thread.start()
+        return future
+
+    def join(self):
+        """Wait until all pending submissions are written."""
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        while True:
+            time.sleep(self.window)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                if not batch:
+                    self._thread = None
+                    return
+            try:
+                self._commit_batch([data for data, _ in batch])
+            except Exception as e:  # noqa: BLE001
+                # Failures are delivered to each submitter
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for _, future in batch:
+                    future.set_result(None)
 
 
 class BeanManager:
-    def __init__(self, fname=None) -> None:
+    def __init__(self, fname=None, currency=None, db_store_folder=None) -> None:
+        """
+        Args:
+            fname (str): The entrypoint of the ledger, `beancount.filename` if None.
+            currency (str): The default currency, `beancount.currency` if None.
+            db_store_folder (str): The folder of the vector database of the ledger,
+                `embedding.db_store_folder` if None.
+        """
         self.fname = fname or conf.config.beancount.filename
-        self.currency = conf.config.beancount.currency
+        self.currency = currency or conf.config.beancount.currency
+        self.db_store_folder = db_store_folder
+        self.background_reload = conf.config.beancount.get("background_reload", False)
+        self.slim = conf.config.beancount.get("slim", False)
+        self.fast_load = conf.config.beancount.get("fast_load", False)
+        self._snapshot = None
+        # Guards snapshot swapping and committing
+        self._lock = threading.RLock()
+        self._reload_thread = None
+        self._dirty = False
+        self._watcher = None
+        self.query_cache = LRUCache(conf.config.beancount.get("query_cache_size", 32))
+        self._formatter = IncrementalFormatter()
+        self.commit_queue = CommitQueue(self._commit_batch,
+                                        conf.config.beancount.get("commit_window", 0.05))
         self._load()
+        if conf.config.beancount.get("watch_files", False):
+            self._watcher = FileWatcher(self._snapshot.mtimes.keys(), self._mark_dirty)
+            self._watcher.start()
+
+    def close(self):
+        """Wait for pending commits, and stop watching the ledger files."""
+        self.commit_queue.join()
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+    @span("reload")
+    def _build_snapshot(self, booked=None):
+        """
+        Args:
+            booked (bool): Whether to load the ledger fully. If None, the ledger is only
+                parsed when `beancount.fast_load` is enabled.
+        """
+        self._dirty = False
+        cache_folder = conf.config.beancount.get("cache_folder")
+        normalize_payee = conf.config.beancount.get("normalize_payee", False)
+        if booked is None:
+            booked = not self.fast_load
+        return LedgerSnapshot.load(self.fname, cache_folder, normalize_payee=normalize_payee,
+                                   slim=self.slim, booked=booked,
+                                   workers=conf.config.beancount.get("load_workers", 0))
+
+    def _swap(self, snapshot):
+        """
+        Publish a new snapshot, the version is increased on every swap.
+        """
+        with self._lock:
+            version = self._snapshot.version + 1 if self._snapshot is not None else 1
+            self._snapshot = dataclasses.replace(snapshot, version=version)
+        if self._watcher is not None:
+            self._watcher.update_files(snapshot.mtimes.keys())
 
     def _load(self):
         """
-        Load the beancount file and initialize the internal state.
-
-        This function loads the beancount file specified by `self.fname` and
-        initializes the internal state. The internal state includes the entries
-        (transactions and metadata), options, accounts, modification times of
-        included files, and account files.
-
-        This function does not return anything. It updates the following instance
-        variables:
-        - `_entries`: a list of parsed entries.
-        - `_options`: a dictionary of options.
-        - `_accounts`: a set of accounts.
-        - `mtimes`: a dictionary mapping filenames to modification times.
-        - `account_files`: a set of filenames.
-        """
-        self._entries, errors, self._options = loader.load_file(self.fname)
-        self._accounts = set()
-        self.mtimes = {}
-        self.account_files = set()
-        for ent in self._entries:
-            if isinstance(ent, Open):
-                self._accounts.add(ent.account)
-                self.account_files.add(ent.meta["filename"])
-            elif isinstance(ent, Close):
-                self._accounts.remove(ent.account)
-                self.account_files.add(ent.meta["filename"])
-
-        # Fill mtime
-        for f in self._options["include"]:
-            self.mtimes[f] = Path(f).stat().st_mtime
+        Load the beancount file and swap in the new snapshot synchronously.
+
+        If `beancount.cache_folder` is configured, the parsed ledger is deserialized
+        from the on-disk cache when no included file is modified.
+        """
+        self._swap(self._build_snapshot())
+
+    def _background_load(self):
+        try:
+            while True:
+                snapshot = self._build_snapshot()
+                with self._lock:
+                    # Files may be modified (e.g. committed) during loading, then the
+                    # snapshot is already outdated.
+                    if not snapshot.is_modified():
+                        self._swap(snapshot)
+                        return
+        except OSError:
+            conf.logger.exception("Failed to reload ledger %s", self.fname)
+        finally:
+            with self._lock:
+                self._reload_thread = None
+
+    def _reload_in_background(self):
+        """
+        Build a new snapshot in a worker thread. Requests keep being served with the
+        current snapshot until the new one is swapped in.
+        """
+        with self._lock:
+            if self._reload_thread is not None:
+                return
+            self._reload_thread = threading.Thread(target=self._background_load,
+                                                   name="beanbot-reload", daemon=True)
+            self._reload_thread.start()
+
+    def _mark_dirty(self, fname):
+        self._dirty = True
+
+    def _is_modified(self, accounts_only=False):
+        return self._snapshot.is_modified(accounts_only)
 
     def _auto_reload(self, accounts_only=False):
         """
         Check and reload if any of the files have been modified.
 
+        If the file watcher is enabled, the files are only checked after the watcher
+        reports a change, so that no syscall is made on the hot path.
+        If background reload is enabled, the reload happens in a worker thread.
+
         Args:
             accounts_only (bool): If True, only check the files that contains account
                 transactions. Defaults to False.
         """
-        files_to_check = self.mtimes.keys()
-        if accounts_only:
-            files_to_check = self.account_files
-        for fname in files_to_check:
-            if self.mtimes[fname] != Path(fname).stat().st_mtime:
-                self._load()
+        if self._watcher is not None:
+            if not self._dirty:
                 return
+            # The change may be made by commit_trx, which is already spliced
+            self._dirty = False
+            accounts_only = False
+        if not self._is_modified(accounts_only):
+            return
+        if self.background_reload:
+            self._reload_in_background()
+        else:
+            self._load()
 
     @property
-    def entries(self):
+    def snapshot(self) -> LedgerSnapshot:
         self._auto_reload()
-        return self._entries
+        return self._snapshot
+
+    def _booked_snapshot(self) -> LedgerSnapshot:
+        """
+        Get the current snapshot with booked positions. In fast-load mode, the ledger is
+        fully loaded here on demand, and parsed only again on the next reload.
+        """
+        snapshot = self.snapshot
+        if snapshot.booked:
+            return snapshot
+        with self._lock:
+            if not self._snapshot.booked:
+                conf.logger.info("Fully load %s for booked positions", self.fname)
+                self._swap(self._build_snapshot(booked=True))
+            return self._snapshot
+
+    @property
+    def version(self):
+        """The version of the ledger snapshot currently serving requests."""
+        return self.snapshot.version
+
+    @property
+    def entries(self):
+        """
+        All the loaded entries. In slim mode, they are loaded from the files on every
+        access, and dropped once the caller releases them.
+        """
+        return self._load_entries(self._booked_snapshot())
+
+    def _load_entries(self, snapshot):
+        if snapshot.entries is not None:
+            return snapshot.entries
+        conf.logger.info("Load full entries of %s", self.fname)
+        entries, _, _ = ledger_cache.load_file(self.fname, conf.config.beancount.get("cache_folder"),
+                                               conf.config.beancount.get("load_workers", 0))
+        return entries
 
     @property
     def options(self):
-        self._auto_reload()
-        return self._options
+        return self.snapshot.options
 
     @property
     def accounts(self):
         self._auto_reload(accounts_only=True)
-        return self._accounts
+        return self._snapshot.accounts
 
     def find_account(self, account_str):
         """
@@ -105,13 +322,13 @@ class BeanManager:
             account_str (str): A substring to search for in the account string.
 
         Returns:
-            str or None: The account that contains the given substring, or None
-                if no such account is found.
+            str or None: The best matched account that contains the given substring,
+                or None if no such account is found. Exact match is preferred to
+                complete segment match, then segment prefix match, then substring match.
+                Recently used accounts are preferred within the same rank.
         """
-        for account in self.accounts:
-            if account_str in account:
-                return account
-        return None
+        self._auto_reload(accounts_only=True)
+        return self._snapshot.account_index.find(account_str)
 
     def find_account_by_payee(self, payee):
         """
@@ -126,30 +343,38 @@ class BeanManager:
                 returned. If no expense account is found, the first expense account in
                 the transaction is returned.
         """
-        target = None
-        for trx in reversed(self._entries):
-            if not isinstance(trx, Transaction):
-                continue
-            if trx.payee == payee:
-                target = trx
-                break
-        else:
-            return None
-        expense_account = None
-        # Find the posting with missing units
-        # If not found, return the first expense account
-        for posting in target.postings:
-            if posting.units is MISSING or posting.meta.get("__automatic__"):
-                return posting.account
-            if posting.account.startswith("Expenses:") and expense_account is None:
-                expense_account = posting.account
-        return expense_account
+        return self.snapshot.payee_index.find_account(payee)
 
     def run_query(self, q):
         """
         A procedural interface to the `beancount.query` module.
+
+        The result is cached by the normalized query and the snapshot version, so the
+        same query is not run again until the ledger changes. In slim mode, results of
+        entries loaded after the files are modified are not cached. The cached result is
+        shared between callers and should not be modified.
+        Range reports in the shape of `/bill` and `/expense` are answered by the
+        pre-aggregated cube without scanning the entries.
         """
-        return query.run_query(self.entries, self.options, q)
+        snapshot = self._booked_snapshot()
+        key = (normalize_query(q), snapshot.version)
+        result = self.query_cache.get(key)
+        if result is not None:
+            return result
+        aggregate_query = match_aggregate_query(q)
+        if aggregate_query is not None:
+            result = snapshot.cube.run_query(aggregate_query)
+        else:
+            # The query engine is only needed by queries which the cube cannot answer
+            from beancount.query import query
+            entries = self._load_entries(snapshot)
+            result = query.run_query(entries, snapshot.options, q)
+            # In slim mode the entries are loaded from the files, which may be modified
+            # after the snapshot is built, then the result doesn't belong to its version
+            if snapshot.entries is None and snapshot.is_modified():
+                return result
+        self.query_cache.put(key, result)
+        return result
 
     def modify_args_via_vec(self, args) -> List[List[str]]:
         """
@@ -168,17 +393,8 @@ class BeanManager:
         returned.
         """
         # Query from vector db
-        matched_txs = query_txs(" ".join(args[1:]))
-        candidate_args = []
-        for tx in matched_txs:
-            # Rebuild narrations
-            sentence = parse_args(tx["sentence"])
-            # The tx may contains more than one accounts, so we need to distinguish them by prefix
-            tags = [seg for seg in sentence[4:] if seg.startswith("#")]
-            #           price     both accounts  payee & narration  tags
-            new_args = [args[0]] + sentence[2:4] + sentence[:2] + tags
-            candidate_args.append(new_args)
-        return candidate_args
+        matched_txs = query_txs(" ".join(args[1:]), self.db_store_folder)
+        return _rebuild_args(args, matched_txs)
 
     def build_trx(self, args):
         """
@@ -254,30 +470,87 @@ class BeanManager:
 
         Raises:
             ValueError: If all attempts to generate a transaction fail.
+            RequestError: If the request to match the line fails.
+        """
+        result = self.generate_trx_batch([line])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    @span("generate_trx")
+    def generate_trx_batch(self, lines) -> List[Union[List[str], Exception]]:
+        """
+        Generate transactions of several lines at once. Lines that cannot be directly
+        converted are resolved together, with one embedding request and one batch of
+        vector database queries.
+
+        Args:
+            lines (List[str]): The lines to generate transactions from.
+
+        Returns:
+            List[Union[List[str], Exception]]: The transactions generated from each line,
+                or the error if all attempts to generate a transaction of the line fail.
+                If a request fails, the error is returned for the lines depending on it,
+                and the other lines are still converted.
         """
-        args = parse_args(line)
+        import requests
+
+        results = []
+        pending = []
+        with span("account_matching"):
+            for i, line in enumerate(lines):
+                try:
+                    args = parse_args(line)
+                except ValueError as e:
+                    results.append(e)
+                    continue
+                try:
+                    results.append([self.build_trx(args)])
+                except ValueError as e:
+                    results.append(e)
+                    pending.append((i, args))
+        if not pending:
+            return results
+
+        vec_enabled = conf.config.embedding.get("enable", True)
+        rag_enabled = conf.config.rag.get("enable", False)
+        # Remove the numeric value at first
+        queries = [" ".join(args[1:]) for _, args in pending]
         try:
-            return [self.build_trx(args)]
-        except ValueError as e:
-            vec_enabled = conf.config.embedding.get("enable", True)
-            rag_enabled = conf.config.rag.get("enable", False)
             if rag_enabled:
-                today = str(datetime.now().astimezone().date())
+                candidates = conf.config.embedding.candidates or 3
+                matches = query_txs_batch(queries, self.db_store_folder, amount=candidates)
+            elif vec_enabled:
+                # Query from vector db
+                matches = query_txs_batch(queries, self.db_store_folder)
+            else:
+                return results
+        except (RequestError, requests.exceptions.RequestException) as e:
+            # Only the lines waiting for the failed request fail
+            for i, _ in pending:
+                results[i] = e
+            return results
+        if rag_enabled:
+            today = str(datetime.now().astimezone().date())
+            for (i, args), match in zip(pending, matches):
                 accounts = map(self.find_account, args[1:])
                 accounts = list(filter(bool, accounts))
-                completion = complete_rag(args, today, accounts)
-                return [self.clone_trx(completion)]
-            if vec_enabled:
-                # Query from vector db
+                try:
+                    completion = complete_rag(args, today, accounts, self.db_store_folder, match)
+                    results[i] = [self.clone_trx(completion)]
+                except (ValueError, RequestError, requests.exceptions.RequestException) as e:
+                    results[i] = e
+        elif vec_enabled:
+            for (i, args), match in zip(pending, matches):
                 candidate_txs = []
-                for new_args in self.modify_args_via_vec(args):
+                for new_args in _rebuild_args(args, match):
                     with contextlib.suppress(ValueError):
                         candidate_txs.append(self.build_trx(new_args))
-                if candidate_txs:
-                    return candidate_txs
-                # If no match, raise original error,
+                # If no match, keep original error,
                 # however it may not be happen if vecdb is built.
-            raise e
+                if candidate_txs:
+                    results[i] = candidate_txs
+        return results
 
     def clone_trx(self, text) -> str:
         """
@@ -303,26 +576,141 @@ class BeanManager:
         segments[0] = TXS_DATE_RE.sub(rf"{today}\1", segments[0])
         return "\n".join(segments)
 
+    def submit_trx(self, data) -> Future:
+        """
+        Submit a transaction to be committed. Submissions within a short window are
+        written together, see `_commit_batch`.
+
+        Args:
+            data (str): The transaction data in beancount format.
+
+        Returns:
+            Future: Resolved once the transaction is durable in the file, or failed
+                with the exception raised while writing.
+        """
+        return self.commit_queue.submit(data)
+
+    @span("commit_trx")
     def commit_trx(self, data):
         """
-        Commit a transaction to beancount file, and format.
+        Commit a transaction to beancount file, and wait until it is durable.
 
         Args:
             data (str): The transaction data in beancount format.
+        """
+        self.submit_trx(data).result()
+
+    @trace("commit")
+    def _commit_batch(self, batch):
+        """
+        Append a batch of transactions to beancount file in one write, with an advisory
+        lock of the file held, so that writes from other processes are not interleaved.
+
+        Only the committed block is aligned with the columns of the file, the full
+        `bean-format` pass is left to `format_ledger`.
+
+        If `beancount.rolling_file` is configured, transactions are appended to the
+        rolling file instead of the entrypoint, so that only a small file is written.
+
+        The committed transactions are parsed and spliced into the loaded entries.
+        The whole ledger is reloaded only if the files are modified externally, or
+        the transactions cannot be validated against the loaded state.
+
+        Args:
+            batch (List[str]): The transactions data in beancount format.
+        """
+        # Keep the same path normalization with beancount loader, which does not resolve symlinks
+        entrypoint = os.path.normpath(os.path.abspath(self.fname))  # noqa: PTH100
+        # The entrypoint is locked for the whole ledger
+        with self._lock, _file_lock(entrypoint):
+            fname = self._append_target(entrypoint)
+            snapshot = self._snapshot
+            # The loaded state is outdated, so splicing is meaningless
+            externally_modified = fname not in snapshot.mtimes or snapshot.is_modified()
+
+            with span("write"):
+                block, lineno = self._formatter.append(fname, *batch)
+            conf.logger.info("Committed %d transactions to %s", len(batch), fname)
+
+            new_snapshot = None
+            if not externally_modified:
+                with span("append_block"):
+                    new_snapshot = snapshot.append_block(block, fname, lineno)
+            if new_snapshot is None:
+                self._load()
+            else:
+                self._swap(new_snapshot)
+
+    def _append_target(self, entrypoint):
+        """
+        Get the file to append transactions to. If `beancount.rolling_file` is set, it is
+        a `strftime` template relative to the entrypoint (e.g. "txs/%Y-%m.bean"), and the
+        file is created and included by the entrypoint when the period starts.
+
+        Returns:
+            str: The absolute path of the file.
+        """
+        include_path = _rolling_include_path()
+        if include_path is None:
+            return entrypoint
+        fname = os.path.normpath(Path(entrypoint).parent / include_path)
+        if fname in self._snapshot.mtimes:
+            return fname
+        if self._snapshot.is_modified():
+            # It may be included by other processes already
+            self._load()
+            if fname in self._snapshot.mtimes:
+                return fname
+
+        conf.logger.info("Include new file %s in %s", fname, entrypoint)
+        Path(fname).parent.mkdir(parents=True, exist_ok=True)
+        Path(fname).touch()
+        with open(entrypoint, "a") as f:
+            f.write(f'\ninclude "{include_path}"\n')
+            f.flush()
+            os.fsync(f.fileno())
+        return fname
+
+    def format_ledger(self):
+        """
+        Format the whole beancount file and the current rolling file with `bean-format`.
+        This is a maintenance operation, which is not needed for every commit. The rolling
+        file is not created if the period has no transactions yet.
 
         Raises:
             SubprocessError: If the bean-format command fails to execute.
         """
-        fname = self.fname
-        with open(fname, 'a') as f:
-            f.write("\n" + data + "\n")
-        subprocess.run(["bean-format", "-o", shlex.quote(str(fname)), shlex.quote(str(fname))],   # noqa: S607,S603
-                       shell=False)
+        entrypoint = os.path.normpath(os.path.abspath(self.fname))  # noqa: PTH100
+        with self._lock, _file_lock(entrypoint):
+            fnames = [entrypoint]
+            include_path = _rolling_include_path()
+            if include_path is not None:
+                rolling_file = os.path.normpath(Path(entrypoint).parent / include_path)
+                if Path(rolling_file).exists():
+                    fnames.append(rolling_file)
+            for fname in fnames:
+                format_file(fname)
+            self._formatter.invalidate()
+            self._load()
 
 
 ArgsError = ValueError("Quote not closed")
 
 
+def _rebuild_args(args, matched_txs):
+    """Rebuild the arguments with the narrations of the matched transactions."""
+    candidate_args = []
+    for tx in matched_txs:
+        # Rebuild narrations
+        sentence = parse_args(tx["sentence"])
+        # The tx may contains more than one accounts, so we need to distinguish them by prefix
+        tags = [seg for seg in sentence[4:] if seg.startswith("#")]
+        #           price     both accounts  payee & narration  tags
+        new_args = [args[0]] + sentence[2:4] + sentence[:2] + tags
+        candidate_args.append(new_args)
+    return candidate_args
+
+
 def parse_args(line):
     args = []
     quotes = {
@@ -1,22 +1,34 @@
+import concurrent.futures
 from datetime import datetime
+import json
+import os
 import shutil
 from pathlib import Path
 import requests
 import pytest
 from conf.conf_test import load_config_from_dict, clear_config
+from beancount.core.data import Price
 from beancount.parser import parser
+from beancount.query import query
 from bean_utils import bean, vec_query
+import vec_db
 
 
 today = str(datetime.now().astimezone().date())
 
 class MockResponse:
-    def __init__(self, data):
+    def __init__(self, data, status_code=200, headers=None):
         self._data = data
+        self.status_code = status_code
+        self.headers = headers or {}
 
     def json(self):
         return self._data
 
+    @property
+    def text(self):
+        return json.dumps(self._data)
+
 
 def mock_post(data):
     def _wrapped(*args, **kwargs):
@@ -167,6 +179,7 @@ def test_generate_trx_with_vector_db(mock_config, monkeypatch):
     # Test vector DB fallback
     mock_config["embedding"] = {
         "enable": True,
+        "db_store_folder": mock_config.embedding.db_store_folder,
         "transaction_amount": 100,
         "candidates": 3,
         "output_amount": 2,
@@ -177,7 +190,7 @@ def test_generate_trx_with_vector_db(mock_config, monkeypatch):
             "data": result,
             "usage": {"total_tokens": tokens},
         })
-    monkeypatch.setattr(requests, "post", _mock_embedding_post)
+    monkeypatch.setattr(requests.Session, "post", _mock_embedding_post)
 
     manager = bean.BeanManager(mock_config.beancount.filename)
     vec_query.build_tx_db(manager.entries)
@@ -198,6 +211,69 @@ def test_generate_trx_with_vector_db(mock_config, monkeypatch):
     assert_txs_equal(trx[1], exp)
 
 
+def test_build_tx_db_incremental(mock_config, monkeypatch):
+    mock_config["embedding"] = {
+        "enable": True,
+        "db_store_folder": mock_config.embedding.db_store_folder,
+        "transaction_amount": 50,
+        "model": "bge",
+    }
+    embedded = []
+    def _mock_embedding(texts):
+        embedded.extend(texts)
+        return mock_embedding(texts)
+    monkeypatch.setattr(vec_query, "embedding", _mock_embedding)
+
+    manager = bean.BeanManager(mock_config.beancount.filename)
+    assert vec_query.build_tx_db(manager.entries) == {"tokens": 50, "reused": 0, "embedded": 50}
+    # Only the sentences out of the previous window are embedded
+    mock_config["embedding"] = {**mock_config.embedding._config, "transaction_amount": 60}
+    embedded.clear()
+    assert vec_query.build_tx_db(manager.entries) == {"tokens": 10, "reused": 50, "embedded": 10}
+    assert len(set(embedded)) == 10
+    # Rows out of the window are dropped
+    mock_config["embedding"] = {**mock_config.embedding._config, "transaction_amount": 20}
+    assert vec_query.build_tx_db(manager.entries) == {"tokens": 0, "reused": 20, "embedded": 0}
+    assert len(vec_db.load_embeddings("bge")) == 20
+    # Embeddings of another model are not reused
+    mock_config["embedding"] = {**mock_config.embedding._config, "model": "other"}
+    assert vec_query.build_tx_db(manager.entries) == {"tokens": 20, "reused": 0, "embedded": 20}
+
+
+def test_generate_trx_batch(mock_config, monkeypatch):
+    mock_config["embedding"] = {
+        "enable": True,
+        "db_store_folder": mock_config.embedding.db_store_folder,
+        "transaction_amount": 100,
+        "candidates": 3,
+        "output_amount": 2,
+    }
+    requests_count = 0
+    def _mock_embedding(texts):
+        nonlocal requests_count
+        requests_count += 1
+        return mock_embedding(texts)
+    monkeypatch.setattr(vec_query, "embedding", _mock_embedding)
+
+    manager = bean.BeanManager(mock_config.beancount.filename)
+    vec_query.build_tx_db(manager.entries)
+    requests_count = 0
+    results = manager.generate_trx_batch([
+        '23.4 BofA:Checking "Kin Soy" Eating',
+        '10.00 "Kin Soy", "Eating"',
+        "10.00 ICBC:Checking NotFound McDonalds 'Big Mac'",
+        "5 'unclosed",
+    ])
+    # Lines need matching are resolved with one embedding request
+    assert requests_count == 1
+    assert len(results[0]) == 1
+    assert_txs_equal(results[0][0], manager.generate_trx('23.4 BofA:Checking "Kin Soy" Eating')[0])
+    # The same as generated one by one
+    assert results[1] == manager.generate_trx('10.00 "Kin Soy", "Eating"')
+    assert results[2] == manager.generate_trx("10.00 ICBC:Checking NotFound McDonalds 'Big Mac'")
+    assert results[3] is bean.ArgsError
+
+
 def test_generate_trx_with_rag(mock_config, monkeypatch):
     exp_trx = f"""
     {today} * "Kin Soy" "Eating" #tag1 #tag2
@@ -207,6 +283,7 @@ def test_generate_trx_with_rag(mock_config, monkeypatch):
     mock_config.update({
         "embedding": {
             "enable": True,
+            "db_store_folder": mock_config.embedding.db_store_folder,
             "transaction_amount": 100,
             "candidates": 3,
             "output_amount": 2,
@@ -216,7 +293,7 @@ def test_generate_trx_with_rag(mock_config, monkeypatch):
             }
         })
     monkeypatch.setattr(vec_query, "embedding", mock_embedding)
-    monkeypatch.setattr(requests, "post", mock_post({"message": {"content": exp_trx}}))
+    monkeypatch.setattr(requests.Session, "post", mock_post({"message": {"content": exp_trx}}))
 
     # Test RAG fallback
     manager = bean.BeanManager(mock_config.beancount.filename)
@@ -306,3 +383,338 @@ def test_manager_commmit(mock_config, copied_bean):
     manager.commit_trx(txs)
     assert len(manager.entries) == 2038
     assert_txs_equal(manager.entries[-1], txs)
+
+
+def test_manager_commit_incremental(mock_config, copied_bean, monkeypatch):
+    manager = bean.BeanManager(copied_bean)
+    assert len(manager.entries) == 2037
+
+    def _fail_load():
+        pytest.fail("Ledger should not be fully reloaded")
+    monkeypatch.setattr(manager, "_load", _fail_load)
+    txs = f"""{today} * "Test Payee" "Test Narration"
+  Liabilities:US:Chase:Slate                       -12.30 USD
+  Expenses:Food:Restaurant"""
+    manager.commit_trx(txs)
+    assert len(manager.entries) == 2038
+    # Automatic posting is interpolated and metadata points to the ledger file
+    entry = manager.entries[-1]
+    assert entry.postings[1].units.to_string() == "12.30 USD"
+    with open(copied_bean) as f:
+        lines = f.readlines()
+    assert lines[entry.meta["lineno"] - 1].startswith(f'{today} * "Test Payee"')
+    assert manager.find_account_by_payee("Test Payee") == "Expenses:Food:Restaurant"
+
+
+def test_manager_commit_plugins(mock_config, copied_bean):
+    contents = copied_bean.read_text()
+    copied_bean.write_text('plugin "beancount.plugins.implicit_prices"\n' + contents)
+    manager = bean.BeanManager(copied_bean)
+    price_count = sum(isinstance(e, Price) for e in manager.entries)
+    manager.commit_trx(f"""{today} * "Test Payee" "Buy stock"
+  Assets:US:ETrade:ITOT  1 ITOT {{100.00 USD}}
+  Assets:US:ETrade:Cash  -100.00 USD""")
+    # Fully reloaded, so the price entry is added by the plugin
+    assert sum(isinstance(e, Price) for e in manager.entries) == price_count + 1
+
+
+def test_manager_commit_fallback(mock_config, copied_bean):
+    manager = bean.BeanManager(copied_bean)
+    # Modify the ledger externally before commit
+    with open(copied_bean, "a") as f:
+        f.write(f"{today} close Assets:US:BofA:Checking\n")
+    txs = f"""
+    {today} * "Test Payee" "Test Narration"
+        Liabilities:US:Chase:Slate                       -12.30 USD
+        Expenses:Food:Restaurant                          12.30 USD
+    """
+    manager.commit_trx(txs)
+    assert len(manager.entries) == 2039
+    # Unknown account cannot be spliced and triggers a full reload
+    manager.commit_trx(f"""
+    {today} * "Test Payee" "Test Narration"
+        Liabilities:US:Chase:Slate                       -12.30 USD
+        Expenses:NotExist
+    """)
+    assert len(manager.entries) == 2040
+
+
+def test_manager_background_reload(mock_config, copied_bean):
+    mock_config["beancount"] = {
+        "filename": "testdata/example.bean",
+        "currency": "USD",
+        "account_distinguation_range": [2, 3],
+        "background_reload": True,
+    }
+    manager = bean.BeanManager(copied_bean)
+    snapshot = manager.snapshot
+    assert manager.version == 1
+    assert len(snapshot.entries) == 2037
+
+    with open(copied_bean, "a") as f:
+        f.write(f"{today} close Assets:US:BofA:Checking\n")
+    # The reload is not finished, the previous snapshot keeps serving
+    entries = manager.entries
+    reload_thread = manager._reload_thread
+    assert reload_thread is not None
+    assert len(entries) == 2037
+    reload_thread.join()
+
+    new_snapshot = manager.snapshot
+    assert new_snapshot.version == 2
+    assert len(new_snapshot.entries) == 2038
+    assert "Assets:US:BofA:Checking" not in manager.accounts
+    # The previous snapshot is not affected
+    assert len(snapshot.entries) == 2037
+    assert "Assets:US:BofA:Checking" in snapshot.accounts
+
+    # Commit creates a new snapshot
+    manager.commit_trx(f"""
+    {today} * "Test Payee" "Test Narration"
+        Liabilities:US:Chase:Slate                       -12.30 USD
+        Expenses:Food:Restaurant                          12.30 USD
+    """)
+    assert manager.version == 3
+    assert len(manager.entries) == 2039
+    assert len(new_snapshot.entries) == 2038
+
+
+def test_manager_commit_batched(mock_config, copied_bean, monkeypatch):
+    mock_config["beancount"] = {
+        "filename": "testdata/example.bean",
+        "currency": "USD",
+        "account_distinguation_range": [2, 3],
+        "commit_window": 0.2,
+    }
+    manager = bean.BeanManager(copied_bean)
+    batches = []
+    commit_batch = manager.commit_queue._commit_batch
+    monkeypatch.setattr(manager.commit_queue, "_commit_batch",
+                        lambda batch: (batches.append(batch), commit_batch(batch)))
+
+    futures = [manager.submit_trx(f"""
+    {today} * "Test Payee {i}" "Test Narration"
+        Liabilities:US:Chase:Slate                       -1{i}.30 USD
+        Expenses:Food:Restaurant""") for i in range(3)]
+    for future in futures:
+        assert future.result(timeout=5) is None
+    # Submissions within the window are written together
+    assert len(batches) == 1
+    assert len(manager.entries) == 2040
+    assert [entry.payee for entry in manager.entries[-3:]] == [f"Test Payee {i}" for i in range(3)]
+
+    # Failures are delivered to the submitter
+    def _fail_append(*args):
+        raise OSError(28, "No space left on device")
+    monkeypatch.setattr(manager._formatter, "append", _fail_append)
+    with pytest.raises(OSError, match="No space left"):
+        manager.commit_trx(f'{today} * "Test Payee"')
+
+
+def test_manager_commit_locked(mock_config, copied_bean):
+    fcntl = pytest.importorskip("fcntl")
+    manager = bean.BeanManager(copied_bean)
+    with open(f"{copied_bean}.lock", "a") as f:
+        # Another process is writing the ledger
+        fcntl.flock(f, fcntl.LOCK_EX)
+        future = manager.submit_trx(f"""
+        {today} * "Test Payee" "Test Narration"
+            Liabilities:US:Chase:Slate                       -12.30 USD
+            Expenses:Food:Restaurant""")
+        with pytest.raises(concurrent.futures.TimeoutError):
+            future.result(timeout=0.5)
+        fcntl.flock(f, fcntl.LOCK_UN)
+    future.result(timeout=5)
+    assert len(manager.entries) == 2038
+
+
+def test_manager_commit_rolling_file(mock_config, copied_bean, monkeypatch):
+    mock_config["beancount"] = {
+        "filename": "testdata/example.bean",
+        "currency": "USD",
+        "account_distinguation_range": [2, 3],
+        "rolling_file": "txs/%Y-%m.bean",
+    }
+    manager = bean.BeanManager(copied_bean)
+    rolling_file = copied_bean.parent / datetime.now().astimezone().strftime("txs/%Y-%m.bean")
+    txs = f"""
+    {today} * "Test Payee" "Test Narration"
+        Liabilities:US:Chase:Slate                       -12.30 USD
+        Expenses:Food:Restaurant"""
+    manager.commit_trx(txs)
+    # The rolling file is created and included
+    assert rolling_file.exists()
+    main_contents = copied_bean.read_text()
+    assert main_contents.endswith(f'include "{rolling_file.relative_to(copied_bean.parent)}"\n')
+    assert len(manager.entries) == 2038
+    assert manager.entries[-1].meta["filename"] == str(rolling_file)
+
+    # Later commits only touch the rolling file, without reloading
+    monkeypatch.setattr(manager, "_load", lambda: pytest.fail("Ledger should not be fully reloaded"))
+    manager.commit_trx(txs)
+    assert len(manager.entries) == 2039
+    assert copied_bean.read_text() == main_contents
+    assert rolling_file.read_text().count("Test Payee") == 2
+
+
+def test_manager_format_rolling_file(mock_config, copied_bean, monkeypatch):
+    mock_config["beancount"] = {
+        "filename": "testdata/example.bean",
+        "currency": "USD",
+        "rolling_file": "txs/%Y-%m.bean",
+    }
+    manager = bean.BeanManager(copied_bean)
+    formatted = []
+    monkeypatch.setattr(bean, "format_file", formatted.append)
+    main_contents = copied_bean.read_text()
+    # A new period starts, the rolling file is not created by formatting
+    manager.format_ledger()
+    rolling_file = copied_bean.parent / datetime.now().astimezone().strftime("txs/%Y-%m.bean")
+    assert formatted == [str(copied_bean)]
+    assert not rolling_file.exists()
+    assert copied_bean.read_text() == main_contents
+
+    manager.commit_trx(f"""
+    {today} * "Test Payee" "Test Narration"
+        Liabilities:US:Chase:Slate                       -12.30 USD
+        Expenses:Food:Restaurant""")
+    formatted.clear()
+    manager.format_ledger()
+    assert formatted == [str(copied_bean), str(rolling_file)]
+
+
+def test_manager_slim(mock_config, copied_bean, monkeypatch):
+    mock_config["beancount"] = {
+        "filename": "testdata/example.bean",
+        "currency": "USD",
+        "account_distinguation_range": [2, 3],
+        "slim": True,
+    }
+    manager = bean.BeanManager(copied_bean)
+    assert manager.snapshot.entries is None
+    assert manager.snapshot.entry_count == 2037
+
+    # Indexes and range reports do not need the full entries
+    with monkeypatch.context() as m:
+        m.setattr(bean.ledger_cache, "load_file", lambda *args: pytest.fail("Entries should not be loaded"))
+        assert manager.find_account("Chase") == "Liabilities:US:Chase:Slate"
+        assert manager.find_account_by_payee("Kin Soy") == "Expenses:Food:Restaurant"
+        manager.run_query('SELECT ROOT(account, 2) as acc, cost(sum(position)) AS cost '
+                          'WHERE date>=2023-06-01 AND date<2023-07-01 GROUP BY acc;')
+        manager.commit_trx(f"""
+        {today} * "Test Payee" "Test Narration"
+            Liabilities:US:Chase:Slate                       -12.30 USD
+            Expenses:Food:Restaurant""")
+    assert manager.snapshot.entries is None
+    assert manager.snapshot.entry_count == 2038
+    assert manager.find_account_by_payee("Test Payee") == "Expenses:Food:Restaurant"
+
+    # Full entries are loaded on demand
+    assert len(manager.entries) == 2038
+    result = manager.run_query('SELECT SUM(position) WHERE account="Liabilities:US:Chase:Slate"')
+    mock_config["beancount"] = {
+        "filename": "testdata/example.bean",
+        "currency": "USD",
+        "account_distinguation_range": [2, 3],
+    }
+    full_manager = bean.BeanManager(copied_bean)
+    assert result == full_manager.run_query('SELECT SUM(position) WHERE account="Liabilities:US:Chase:Slate"')
+
+
+def test_manager_slim_query_outdated(mock_config, copied_bean, monkeypatch):
+    mock_config["beancount"] = {
+        "filename": "testdata/example.bean",
+        "currency": "USD",
+        "account_distinguation_range": [2, 3],
+        "slim": True,
+    }
+    manager = bean.BeanManager(copied_bean)
+    q = 'SELECT COUNT(position) WHERE account="Liabilities:US:Chase:Slate"'
+    _, rows = manager.run_query(q)
+    # The modification is not noticed yet, e.g. not reported by the file watcher
+    monkeypatch.setattr(manager, "_auto_reload", lambda *args: None)
+    manager.query_cache.clear()
+    with open(copied_bean, "a") as f:
+        f.write(f"""
+{today} * "Test Payee" "Test Narration"
+    Liabilities:US:Chase:Slate                       -12.30 USD
+    Expenses:Food:Restaurant
+""")
+    stat = Path(copied_bean).stat()
+    os.utime(copied_bean, (stat.st_atime, stat.st_mtime + 1))
+
+    version = manager.version
+    _, new_rows = manager.run_query(q)
+    assert new_rows[0][0] == rows[0][0] + 1
+    # The newer entries are not cached as the outdated snapshot
+    assert manager.query_cache.get((bean.normalize_query(q), version)) is None
+
+def test_manager_fast_load(mock_config, copied_bean, monkeypatch):
+    mock_config["beancount"] = {
+        "filename": "testdata/example.bean",
+        "currency": "USD",
+        "account_distinguation_range": [2, 3],
+        "fast_load": True,
+    }
+    with monkeypatch.context() as m:
+        m.setattr(bean.ledger_cache, "load_file", lambda *args: pytest.fail("Ledger should not be booked"))
+        manager = bean.BeanManager(copied_bean)
+        assert not manager.snapshot.booked
+        assert manager.snapshot.cube is None
+        assert manager.find_account("Chase") == "Liabilities:US:Chase:Slate"
+        assert manager.find_account_by_payee("Kin Soy") == "Expenses:Food:Restaurant"
+        manager.commit_trx(f"""
+        {today} * "Test Payee" "Test Narration"
+            Liabilities:US:Chase:Slate                       -12.30 USD
+            Expenses:Food:Restaurant""")
+        assert manager.find_account_by_payee("Test Payee") == "Expenses:Food:Restaurant"
+
+    # Reports load the ledger fully
+    q = 'SELECT SUM(position) WHERE account="Liabilities:US:Chase:Slate"'
+    result = manager.run_query(q)
+    assert manager.snapshot.booked
+    assert len(manager.entries) == 2038
+    mock_config["beancount"] = {
+        "filename": "testdata/example.bean",
+        "currency": "USD",
+        "account_distinguation_range": [2, 3],
+    }
+    assert result == bean.BeanManager(copied_bean).run_query(q)
+
+    # Reloads only parse the ledger again
+    with open(copied_bean, "a") as f:
+        f.write(f"{today} close Assets:US:BofA:Checking\n")
+    with monkeypatch.context() as m:
+        m.setattr(bean.ledger_cache, "load_file", lambda *args: pytest.fail("Ledger should not be booked"))
+        assert "Assets:US:BofA:Checking" not in manager.accounts
+        assert not manager.snapshot.booked
+
+
+def test_normalize_query():
+    assert bean.normalize_query(' SELECT  account\n  WHERE payee = "Kin  Soy" ; ') == \
+        'SELECT account WHERE payee = "Kin  Soy"'
+    assert bean.normalize_query("SELECT 'a \\' b'  ") == "SELECT 'a \\' b'"
+
+
+def test_run_query_cache(mock_config, copied_bean, monkeypatch):
+    manager = bean.BeanManager(copied_bean)
+    q = 'SELECT SUM(position) WHERE account="Assets:US:BofA:Checking"'
+    result = manager.run_query(q)
+    assert manager.query_cache.stats() == {"size": 1, "hits": 0, "misses": 1}
+
+    # Same query after normalization is served from cache
+    with monkeypatch.context() as m:
+        m.setattr(query, "run_query", lambda *args: pytest.fail("Query should be cached"))
+        assert manager.run_query(q + ";") is result
+        assert manager.run_query(q.replace(" ", "  ")) is result
+    assert manager.query_cache.hits == 2
+
+    # Ledger changes invalidate the cache
+    manager.commit_trx(f"""
+    {today} * "Test Payee" "Test Narration"
+        Assets:US:BofA:Checking                          -12.30 USD
+        Expenses:Food:Restaurant                          12.30 USD
+    """)
+    new_result = manager.run_query(q)
+    assert new_result is not result
+    assert new_result[1][0].sum_position.to_string() == "(3063.87 USD)"
@@ -0,0 +1,203 @@
+import re
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from beancount.core import account as account_lib
+from beancount.core import convert
+from beancount.core.amount import Amount
+from beancount.core.data import Transaction
+from beancount.core.inventory import Inventory
+
+
+# The query shape used by `/bill` and `/expense`, which can be answered by the cube:
+# SELECT ROOT(account, {level}) as acc, cost(sum(position)) AS cost
+# WHERE date>={start} AND date<{end} [AND ROOT(account, 1)="{root}"] GROUP BY acc [ORDER BY acc];
+_AGGREGATE_QUERY_RE = re.compile(
+    r"""^\s*SELECT\s+ROOT\(\s*account\s*,\s*(?P<level>\d+)\s*\)\s+AS\s+acc\s*,
+    \s*COST\(\s*SUM\(\s*position\s*\)\s*\)\s+AS\s+cost
+    \s+WHERE\s+date\s*>=\s*(?P<start>\d{4}-\d{2}-\d{2})\s+AND\s+date\s*<\s*(?P<end>\d{4}-\d{2}-\d{2})
+    (?:\s+AND\s+ROOT\(\s*account\s*,\s*1\s*\)\s*=\s*"(?P<root>[^"]*)")?
+    \s+GROUP\s+BY\s+acc(?P<order>\s+ORDER\s+BY\s+acc(?:\s+ASC)?)?\s*;?\s*$""",
+    re.IGNORECASE | re.VERBOSE,
+)
+
+
+class AggregateQuery(NamedTuple):
+    start: date
+    end: date
+    root_level: int
+    root: Optional[str]
+    ordered: bool
+
+
+class ResultRow(NamedTuple):
+    acc: str
+    cost: Inventory
+
+
+RESULT_TYPES = [("acc", str), ("cost", Inventory)]
+
+
+def match_aggregate_query(q) -> Optional[AggregateQuery]:
+    """
+    Match a BQL query against the shape which can be answered by the cube.
+
+    Returns:
+        AggregateQuery or None: The parsed parameters, or None if the shape does not match.
+    """
+    match = _AGGREGATE_QUERY_RE.match(q)
+    if match is None:
+        return None
+    return AggregateQuery(
+        start=date.fromisoformat(match["start"]),
+        end=date.fromisoformat(match["end"]),
+        root_level=int(match["level"]),
+        root=match["root"],
+        ordered=match["order"] is not None,
+    )
+
+
+@dataclass
+class _Series:
+    """
+    Daily sums of one account in one (cost) currency. Integers are kept in arrays,
+    which are much more compact than lists.
+    """
+    # Date ordinals with postings, in ascending order
+    dates: array = field(default_factory=lambda: array("l"))
+    # The sequence number of the first posting on each date
+    first_seq: array = field(default_factory=lambda: array("q"))
+    # prefix[i] is the sum of the first i dates
+    prefix: List[Decimal] = field(default_factory=lambda: [Decimal(0)])
+    # Prefix counts of postings by the exponent of their numbers, which keeps the
+    # precision of the result the same as summing postings directly.
+    exp_prefix: Dict[int, array] = field(default_factory=dict)
+
+    def copy(self):
+        return _Series(array("l", self.dates), array("q", self.first_seq), list(self.prefix),
+                       {exp: array("q", counts) for exp, counts in self.exp_prefix.items()})
+
+    def add(self, day, seq, number):
+        exp = number.as_tuple().exponent
+        pos = bisect_left(self.dates, day)
+        if pos < len(self.dates) and self.dates[pos] == day:
+            self.first_seq[pos] = min(self.first_seq[pos], seq)
+        else:
+            self.dates.insert(pos, day)
+            self.first_seq.insert(pos, seq)
+            self.prefix.insert(pos + 1, self.prefix[pos])
+            for counts in self.exp_prefix.values():
+                counts.insert(pos + 1, counts[pos])
+        if exp not in self.exp_prefix:
+            self.exp_prefix[exp] = array("q", [0]) * len(self.prefix)
+        # Postings are usually appended, so only the tail is updated
+        for i in range(pos + 1, len(self.prefix)):
+            self.prefix[i] += number
+            self.exp_prefix[exp][i] += 1
+
+    def range_sum(self, start, end) -> Optional[Tuple[int, Decimal]]:
+        """
+        Sum the postings in the date range [start, end).
+
+        Returns:
+            Tuple[int, Decimal] or None: The sequence number of the first posting and the
+                sum, or None if there is no posting in the range.
+        """
+        i0 = bisect_left(self.dates, start)
+        i1 = bisect_left(self.dates, end)
+        if i0 == i1:
+            return None
+        total = self.prefix[i1] - self.prefix[i0]
+        exp = min(exp for exp, counts in self.exp_prefix.items() if counts[i1] > counts[i0])
+        return self.first_seq[i0], total.quantize(Decimal(1).scaleb(exp))
+
+
+class AccountDayCube:
+    """
+    Pre-aggregated daily sums of postings cost, per account and per currency, with
+    prefix sums over dates. The sum of any date range is answered by two lookups per
+    account and currency, instead of scanning all postings.
+    """
+    def __init__(self, entries=()):
+        self._series: Dict[Tuple[str, str], _Series] = {}
+        self._next_seq = 0
+        self._add_entries(entries)
+
+    def _add_entries(self, entries, copied=None):
+        for entry in entries:
+            if not isinstance(entry, Transaction):
+                continue
+            day = entry.date.toordinal()
+            for posting in entry.postings:
+                cost = convert.get_cost(posting)
+                key = (posting.account, cost.currency)
+                series = self._series.get(key)
+                if series is None:
+                    series = self._series[key] = _Series()
+                elif copied is not None and key not in copied:
+                    # Copy on write, the series may be shared with other cubes
+                    series = self._series[key] = series.copy()
+                if copied is not None:
+                    copied.add(key)
+                series.add(day, self._next_seq, cost.number)
+                self._next_seq += 1
+
+    def with_entries(self, entries) -> "AccountDayCube":
+        """
+        Return a new cube with the given entries added. Only the series of the affected
+        accounts are copied, the others are shared with this cube.
+        """
+        cube = self.__class__()
+        cube._series = dict(self._series)  # noqa: SLF001
+        cube._next_seq = self._next_seq  # noqa: SLF001
+        cube._add_entries(entries, copied=set())  # noqa: SLF001
+        return cube
+
+    def aggregate(self, start: date, end: date, root_level: int,
+                  root: Optional[str] = None, ordered: bool = False) -> List[ResultRow]:
+        """
+        Sum the cost of postings in the date range [start, end), grouped by the root
+        account of the given level.
+
+        Args:
+            start (date): The start date, inclusive.
+            end (date): The end date, exclusive.
+            root_level (int): The level of the root account to group by.
+            root (str): If set, only accounts under this top-level account are included.
+            ordered (bool): If True, rows are ordered by account, otherwise by the order
+                of the first posting in the range, the same as BQL does.
+
+        Returns:
+            List[ResultRow]: Rows of the root account and its cost inventory.
+        """
+        start, end = start.toordinal(), end.toordinal()
+        groups = {}
+        for (account, currency), series in self._series.items():
+            if root is not None and account_lib.root(1, account) != root:
+                continue
+            result = series.range_sum(start, end)
+            if result is None:
+                continue
+            seq, total = result
+            acc = account_lib.root(root_level, account)
+            group = groups.setdefault(acc, [seq, {}])
+            group[0] = min(group[0], seq)
+            group[1][currency] = group[1].get(currency, Decimal(0)) + total
+
+        rows = []
+        for acc, (seq, totals) in groups.items():
+            inventory = Inventory()
+            for currency, total in totals.items():
+                if total != 0:
+                    inventory.add_amount(Amount(total, currency))
+            rows.append((acc if ordered else seq, ResultRow(acc, inventory)))
+        rows.sort(key=lambda row: row[0])
+        return [row for _, row in rows]
+
+    def run_query(self, aggregate_query: AggregateQuery):
+        """Answer a matched query, returns the same structure as `beancount.query`."""
+        return RESULT_TYPES, self.aggregate(**aggregate_query._asdict())
+
@@ -0,0 +1,77 @@
+import random
+from datetime import date, timedelta
+import pytest
+from beancount import loader
+from beancount.query import query
+from bean_utils.cube import AccountDayCube, match_aggregate_query
+
+
+_BILL_QUERY = ('SELECT ROOT(account, {level}) as acc, cost(sum(position)) AS cost '
+               'WHERE date>={start} AND date<{end} GROUP BY acc ORDER BY acc;')
+_EXPENSE_QUERY = ('SELECT ROOT(account, {level}) as acc, cost(sum(position)) AS cost '
+                  'WHERE date>={start} AND date<{end} AND ROOT(account, 1)="Expenses" GROUP BY acc;')
+
+
+@pytest.fixture(scope="module")
+def ledger():
+    entries, _, options = loader.load_file("testdata/example.bean")
+    return entries, options
+
+
+def _to_strings(rows):
+    return [(row.acc, row.cost.to_string()) for row in rows]
+
+
+def test_match_aggregate_query():
+    q = _BILL_QUERY.format(level=2, start="2023-06-01", end="2023-07-01")
+    matched = match_aggregate_query(q)
+    assert matched.start == date(2023, 6, 1)
+    assert matched.end == date(2023, 7, 1)
+    assert matched.root_level == 2
+    assert matched.root is None
+    assert matched.ordered
+
+    matched = match_aggregate_query(_EXPENSE_QUERY.format(level=1, start="2023-06-01", end="2023-07-01"))
+    assert matched.root == "Expenses"
+    assert not matched.ordered
+
+    assert match_aggregate_query('SELECT SUM(position) WHERE account="Assets:US:BofA:Checking"') is None
+    assert match_aggregate_query(q.replace("GROUP BY acc", "GROUP BY acc LIMIT 1")) is None
+
+
+@pytest.mark.parametrize("template", [_BILL_QUERY, _EXPENSE_QUERY])
+def test_cube_same_as_query(ledger, template):
+    entries, options = ledger
+    cube = AccountDayCube(entries)
+    rand = random.Random(42)
+    first, last = entries[0].date, entries[-1].date
+    ranges = [(first, last + timedelta(days=1)), (date(2023, 6, 29), date(2023, 6, 30))]
+    for _ in range(6):
+        start = first + timedelta(days=rand.randint(0, (last - first).days))
+        ranges.append((start, start + timedelta(days=rand.randint(1, 400))))
+
+    for start, end in ranges:
+        for level in (1, 2, 3):
+            q = template.format(level=level, start=start, end=end)
+            _, exp_rows = query.run_query(entries, options, q)
+            _, rows = cube.run_query(match_aggregate_query(q))
+            assert _to_strings(rows) == _to_strings(exp_rows), q
+
+
+def test_cube_with_entries(ledger):
+    entries, options = ledger
+    split = len(entries) * 2 // 3
+    base = AccountDayCube(entries[:split])
+    cube = base.with_entries(entries[split:])
+    full_cube = AccountDayCube(entries)
+    start, end = entries[0].date, entries[-1].date + timedelta(days=1)
+    assert _to_strings(cube.aggregate(start, end, 2, ordered=True)) == \
+        _to_strings(full_cube.aggregate(start, end, 2, ordered=True))
+    # The base cube is not modified
+    assert _to_strings(base.aggregate(start, end, 2, ordered=True)) == \
+        _to_strings(AccountDayCube(entries[:split]).aggregate(start, end, 2, ordered=True))
+
+    # Backdated entries are inserted in place
+    cube = AccountDayCube(entries[split:]).with_entries(entries[:split])
+    assert _to_strings(cube.aggregate(start, end, 2, ordered=True)) == \
+        _to_strings(full_cube.aggregate(start, end, 2, ordered=True))
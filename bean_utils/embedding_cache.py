@@ -0,0 +1,133 @@
+import pathlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from bean_utils.lru_cache import LRUCache
+import conf
+
+
+_DB_NAME = "embedding_cache.sqlite"
+_WHITESPACES_RE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Normalize the text so that trivial differences (e.g. spaces, full-width letters) share one embedding."""
+    return _WHITESPACES_RE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def cache_key(model, text):
+    return f"{model}\0{normalize_text(text)}"
+
+
+class EmbeddingCache:
+    """
+    Embeddings of the queried texts, in an in-memory LRU tier backed by a persistent
+    sqlite tier. The persistent tier keeps at most `max_entries` embeddings, and the
+    least recently used ones are evicted.
+    """
+    def __init__(self, path, memory_size=1024, max_entries=10000):
+        """
+        Args:
+            path (str): The sqlite file of the persistent tier.
+            memory_size (int): The max amount of embeddings in memory.
+            max_entries (int): The max amount of embeddings in the sqlite file.
+        """
+        self.max_entries = max_entries
+        self.disk_hits = 0
+        self._memory = LRUCache(memory_size)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""
+                         CREATE TABLE IF NOT EXISTS embeddings (
+                         key text primary key,
+                         embedding blob,
+                         last_used real)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._db.commit()
+
+    def get_many(self, keys):
+        """
+        Get the cached embeddings.
+
+        Returns:
+            Dict[str, List[float]]: The embeddings of the found keys.
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            embedding = self._memory.get(key)
+            if embedding is None:
+                missing.append(key)
+            else:
+                found[key] = embedding
+        if not missing:
+            return found
+        placeholder = ",".join(["?"] * len(missing))
+        with self._lock:
+            rows = self._db.execute(f"SELECT key, embedding FROM embeddings WHERE key in ({placeholder})",
+                                    missing).fetchall()
+            if rows:
+                self._db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                     [(time.time(), key) for key, _ in rows])
+                self._db.commit()
+                self.disk_hits += len(rows)
+        for key, blob in rows:
+            embedding = array("d", blob).tolist()
+            self._memory.put(key, embedding)
+            found[key] = embedding
+        return found
+
+    def put_many(self, items):
+        """
+        Args:
+            items (Dict[str, List[float]]): The embeddings by the keys.
+        """
+        for key, embedding in items.items():
+            self._memory.put(key, embedding)
+        now = time.time()
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO embeddings (key, embedding, last_used) VALUES (?, ?, ?)",
+                                 [(key, array("d", embedding).tobytes(), now) for key, embedding in items.items()])
+            self._db.execute("""
+                             DELETE FROM embeddings WHERE key NOT IN (
+                             SELECT key FROM embeddings ORDER BY last_used DESC LIMIT ?)""",
+                             (self.max_entries,))
+            self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM embeddings").fetchone()[0]
+
+    def stats(self):
+        """
+        Returns:
+            dict: The amount of hits of each tier, and the amount of misses of both.
+        """
+        memory_stats = self._memory.stats()
+        return {
+            "memory_hits": memory_stats["hits"],
+            "disk_hits": self.disk_hits,
+            "misses": memory_stats["misses"] - self.disk_hits,
+        }
+
+
+# Caches by the folder of the vector database
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(db_dir=None):
+    """Get the embedding cache stored next to the vector database, None if it is disabled."""
+    config = conf.config.embedding
+    if not config.get("cache", True):
+        return None
+    path = pathlib.Path(db_dir or config.get("db_store_folder", ".")) / _DB_NAME
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = EmbeddingCache(path, config.get("cache_memory_size", 1024),
+                                                   config.get("cache_max_entries", 10000))
+        return cache
@@ -0,0 +1,52 @@
+from bean_utils import vec_query
+from bean_utils.embedding_cache import EmbeddingCache, cache_key, get_cache
+from bean_utils.bean_test import mock_config, mock_embedding
+
+
+def test_cache_key():
+    assert cache_key("bge", "  lunch   麦当劳 ") == cache_key("bge", "lunch 麦当劳")
+    # Full width characters are normalized
+    assert cache_key("bge", "ｃｏｆｆｅｅ") == cache_key("bge", "coffee")
+    assert cache_key("bge", "coffee") != cache_key("other", "coffee")
+
+
+def test_cache_tiers(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    cache = EmbeddingCache(path, memory_size=1, max_entries=2)
+    assert cache.get_many(["a"]) == {}
+    cache.put_many({"a": [0.1, 0.2], "b": [0.3, 0.4]})
+    # "a" is evicted from memory, but found on disk
+    assert cache.get_many(["a", "b"]) == {"a": [0.1, 0.2], "b": [0.3, 0.4]}
+    assert cache.stats() == {"memory_hits": 1, "disk_hits": 1, "misses": 1}
+
+    # Persisted across instances, and the least recently used one is evicted
+    cache.put_many({"c": [0.5, 0.6]})
+    assert len(cache) == 2
+    cache = EmbeddingCache(path, memory_size=1, max_entries=2)
+    assert cache.get_many(["a", "b", "c"]) == {"a": [0.1, 0.2], "c": [0.5, 0.6]}
+
+
+def test_cached_embedding(mock_config, monkeypatch):
+    mock_config["embedding"] = {
+        "enable": True,
+        "db_store_folder": mock_config.embedding.db_store_folder,
+        "model": "bge",
+    }
+    requests = []
+    def _mock_embedding(texts):
+        requests.append(texts)
+        return mock_embedding(texts)
+    monkeypatch.setattr(vec_query, "embedding", _mock_embedding)
+
+    expected = [e["embedding"] for e in mock_embedding(["coffee", "lunch"])[0]]
+    assert vec_query.cached_embedding(["coffee", "lunch", " coffee"]) == [expected[0], expected[1], expected[0]]
+    assert requests == [["coffee", "lunch"]]
+    # Only the missing texts are requested
+    assert vec_query.cached_embedding(["lunch", "dinner"])[0] == expected[1]
+    assert requests[1:] == [["dinner"]]
+    assert get_cache().stats() == {"memory_hits": 1, "disk_hits": 0, "misses": 4}
+
+    # Requested every time if the cache is disabled
+    mock_config["embedding"] = {**mock_config.embedding._config, "cache": False}
+    vec_query.cached_embedding(["coffee"])
+    assert requests[2:] == [["coffee"]]
@@ -0,0 +1,127 @@
+import re
+import threading
+import time
+from bean_utils.batch_executor import RateLimiter, RequestError, call_with_retry, run_batches
+import conf
+
+
+# CJK characters (kana, ideographs, hangul) are about one token each
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+_LIMIT_ERROR_RE = re.compile(r"too (many|large|long)|exceed|maximum|limit", re.IGNORECASE)
+_NUMBER_RE = re.compile(r"\d+")
+
+
+class RequestRejectedError(RequestError):
+    """The provider rejected the request, e.g. the batch exceeds its limits."""
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+    def is_limit_error(self):
+        return self.status_code == 413 or _LIMIT_ERROR_RE.search(str(self)) is not None
+
+
+def estimate_tokens(text):
+    """Roughly estimate the tokens of the text, about 4 non-CJK characters are one token."""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + -(-(len(text) - cjk) // 4) + 1
+
+
+def pack_batches(texts, max_tokens, max_size):
+    """
+    Split the texts into batches in order, each batch has at most `max_size` texts and
+    `max_tokens` estimated tokens. A text exceeding `max_tokens` is a batch by itself.
+
+    Returns:
+        List[List[str]]: The batches.
+    """
+    batches = []
+    batch, tokens = [], 0
+    for text in texts:
+        text_tokens = estimate_tokens(text)
+        if batch and (tokens + text_tokens > max_tokens or len(batch) >= max_size):
+            batches.append(batch)
+            batch, tokens = [], 0
+        batch.append(text)
+        tokens += text_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class EmbeddingClient:
+    """
+    Embed texts in batches packed by the estimated tokens. When the provider rejects a
+    batch for its limits, the limits are lowered and kept for the following requests.
+    """
+    def __init__(self, embed_func, max_tokens=8192, max_size=128):
+        """
+        Args:
+            embed_func (Callable): Embed a batch of texts, in the form of `vec_query.embedding`.
+            max_tokens (int): The max estimated tokens of a request.
+            max_size (int): The max amount of texts of a request.
+        """
+        self.embed_func = embed_func
+        self.max_tokens = max_tokens
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+    def _learn_limits(self, batch, error):
+        message = str(error)
+        tokens = sum(estimate_tokens(text) for text in batch)
+        numbers = [int(n) for n in _NUMBER_RE.findall(message)]
+        with self._lock:
+            # Prefer the limit in the error message, which is lower than the rejected batch
+            if "token" in message.lower():
+                limits = [n for n in numbers if 1 < n < tokens]
+                self.max_tokens = min(self.max_tokens, min(limits) if limits else max(tokens // 2, 1))
+            else:
+                limits = [n for n in numbers if 1 < n < len(batch)]
+                self.max_size = min(self.max_size, min(limits) if limits else max(len(batch) // 2, 1))
+        conf.logger.warning("Embedding request of %d texts (~%d tokens) rejected: %s. "
+                            "Limit requests to %d texts and %d tokens",
+                            len(batch), tokens, message, self.max_size, self.max_tokens)
+
+    def embed(self, texts, max_workers=4, requests_per_minute=None, max_retries=5):
+        """
+        Embed the texts with concurrent requests, see `batch_executor.run_batches`.
+
+        Returns:
+            Tuple[List[dict], int]: The embeddings in the order of the texts, and the total token usage.
+        """
+        limiter = RateLimiter(requests_per_minute) if requests_per_minute else None
+        requests = 0
+        requests_lock = threading.Lock()
+
+        def _embed_batch(batch):
+            nonlocal requests
+            # The limits may be lowered by other batches
+            batches = pack_batches(batch, self.max_tokens, self.max_size)
+            if len(batches) > 1:
+                return _merge([_embed_batch(b) for b in batches])
+            try:
+                with requests_lock:
+                    requests += 1
+                return call_with_retry(self.embed_func, batch, limiter=limiter, max_retries=max_retries)
+            except RequestRejectedError as e:
+                if len(batch) <= 1 or not e.is_limit_error():
+                    raise
+                self._learn_limits(batch, e)
+                return _embed_batch(batch)
+
+        start = time.monotonic()
+        batches = pack_batches(texts, self.max_tokens, self.max_size)
+        data, tokens = _merge(run_batches(_embed_batch, batches, max_workers=max_workers, max_retries=0))
+        if texts:
+            elapsed = time.monotonic() - start
+            conf.logger.info("Embedded %d texts in %d requests, %.1f texts per request, %.0f tokens/s",
+                             len(texts), requests, len(texts) / max(requests, 1), tokens / max(elapsed, 1e-6))
+        return data, tokens
+
+
+def _merge(results):
+    data, tokens = [], 0
+    for batch_data, batch_tokens in results:
+        data.extend(batch_data)
+        tokens += batch_tokens
+    return data, tokens
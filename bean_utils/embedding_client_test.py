@@ -0,0 +1,91 @@
+import pytest
+import requests
+from bean_utils import bean, vec_query
+from bean_utils.embedding_client import EmbeddingClient, RequestRejectedError, estimate_tokens, pack_batches
+from bean_utils.bean_test import MockResponse, mock_config, mock_embedding
+
+
+def test_estimate_tokens():
+    # CJK characters are counted one by one
+    assert estimate_tokens("午餐麦当劳") == 6
+    assert estimate_tokens("lunch at McDonalds") == 6
+    assert estimate_tokens("") == 1
+
+
+def test_pack_batches():
+    texts = ["午餐麦当劳", "lunch", "a" * 40, "coffee"]
+    assert pack_batches(texts, max_tokens=100, max_size=2) == [texts[:2], texts[2:]]
+    # A text exceeding the budget is a batch by itself
+    assert pack_batches(texts, max_tokens=10, max_size=10) == [texts[:2], texts[2:3], texts[3:]]
+    assert pack_batches([], max_tokens=10, max_size=10) == []
+
+
+def _limited_embedding(max_size=None, max_tokens=None):
+    batches = []
+    def _embed(texts):
+        batches.append(texts)
+        if max_size and len(texts) > max_size:
+            msg = f"input batch size {len(texts)} > maximum allowed batch size {max_size}"
+            raise RequestRejectedError(msg, 400)
+        if max_tokens and sum(estimate_tokens(t) for t in texts) > max_tokens:
+            msg = f"Requested too many tokens, the limit is {max_tokens} tokens"
+            raise RequestRejectedError(msg, 413)
+        return mock_embedding(texts)
+    return _embed, batches
+
+
+def test_learn_batch_size():
+    texts = [f"text {i}" for i in range(10)]
+    embed, batches = _limited_embedding(max_size=4)
+    client = EmbeddingClient(embed, max_tokens=1000, max_size=10)
+    data, tokens = client.embed(texts, max_workers=1)
+    assert data == mock_embedding(texts)[0]
+    assert tokens == 10
+    assert client.max_size == 4
+    # The learned limit is used by the following requests
+    batches.clear()
+    client.embed(texts, max_workers=2)
+    assert sorted(len(b) for b in batches) == [2, 4, 4]
+
+
+def test_learn_token_limit():
+    texts = ["a" * 20] * 6
+    embed, batches = _limited_embedding(max_tokens=14)
+    client = EmbeddingClient(embed, max_tokens=1000, max_size=100)
+    data, _ = client.embed(texts, max_workers=1)
+    assert len(data) == 6
+    assert client.max_tokens == 14
+    assert all(len(b) <= 2 for b in batches[1:])
+
+
+def test_rejected_error():
+    def _embed(texts):
+        msg = "Invalid api key"
+        raise RequestRejectedError(msg, 401)
+    client = EmbeddingClient(_embed, max_tokens=1000, max_size=10)
+    with pytest.raises(RequestRejectedError, match="Invalid api key"):
+        client.embed(["a", "b"])
+    assert client.max_size == 10
+
+
+def test_build_tx_db_learns_limits(mock_config, monkeypatch):
+    mock_config["embedding"] = {
+        "enable": True,
+        "db_store_folder": mock_config.embedding.db_store_folder,
+        "transaction_amount": 100,
+        "batch_max_size": 64,
+    }
+    monkeypatch.setattr(vec_query, "_clients", {})
+    sizes = []
+    def _mock_embedding_post(*args, json, **kwargs):
+        sizes.append(len(json["input"]))
+        if len(json["input"]) > 16:
+            return MockResponse({"message": "batch size exceeds the maximum 16"}, status_code=400)
+        result, tokens = mock_embedding(json["input"])
+        return MockResponse({"data": result, "usage": {"total_tokens": tokens}})
+    monkeypatch.setattr(requests.Session, "post", _mock_embedding_post)
+
+    manager = bean.BeanManager(mock_config.beancount.filename)
+    assert vec_query.build_tx_db(manager.entries)["embedded"] == 100
+    assert vec_query.get_embedding_client().max_size == 16
+    assert sum(size for size in sizes if size <= 16) == 100
@@ -0,0 +1,161 @@
+import functools
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+import textwrap
+from collections import Counter
+from pathlib import Path
+from beancount.core import account, amount
+from beancount.scripts.format import align_beancount
+import conf
+
+
+@functools.lru_cache(maxsize=None)
+def _patterns():
+    """
+    Compile the patterns on the first use, since compiling the account pattern is slow.
+
+    Returns:
+        Tuple[re.Pattern, re.Pattern]: The same pattern as `bean-format` uses to find
+            lines with numbers, and the pattern of posting indents.
+    """
+    number_line_re = re.compile(
+        r'(^\d[^";]*?|\s+{})\s+([-+]?\s*[\d,]+(?:\.\d*)?)\s+({}\b.*)'.format(
+            account.ACCOUNT_RE, amount.CURRENCY_RE))
+    posting_indent_re = re.compile(r"^[ \t]+(?={})".format(account.ACCOUNT_RE), re.MULTILINE)
+    return number_line_re, posting_indent_re
+
+
+class _FileLayout:
+    __slots__ = ("mtime", "prefix_width", "num_width", "indent", "newlines")
+
+    def __init__(self, mtime, contents):
+        self.mtime = mtime
+        self.prefix_width, self.num_width, self.indent = _measure(contents)
+        self.newlines = contents.count("\n")
+
+
+def _measure(contents):
+    """
+    Measure the column widths and the posting indent of the beancount content.
+
+    Returns:
+        Tuple[int, int, str]: The width of the prefix (date or account), the width of
+            the number, and the most frequent indent of postings.
+    """
+    number_line_re, posting_indent_re = _patterns()
+    prefix_width = num_width = 0
+    for line in contents.splitlines():
+        match = number_line_re.match(line)
+        if match:
+            prefix, number, _ = match.groups()
+            prefix_width = max(prefix_width, len(prefix))
+            num_width = max(num_width, len(number))
+    indents = Counter(posting_indent_re.findall(contents))
+    indent = indents.most_common(1)[0][0] if indents else "  "
+    return prefix_width, num_width, indent
+
+
+def _write(fname, mode, text):
+    """Write the text and flush it to disk, so that it is durable once returned."""
+    with open(fname, mode) as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _replace(fname, text):
+    """
+    Replace the contents of the file atomically: the text is written and flushed to a
+    temporary file in the same folder, which then replaces the file. The file is never
+    left truncated if the write fails.
+    """
+    path = Path(fname)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        shutil.copymode(path, tmp_name)
+        os.replace(tmp_name, path)  # noqa: PTH105
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def format_file(fname):
+    """
+    Format the whole file with `bean-format`, which is a maintenance operation.
+
+    Raises:
+        SubprocessError: If the bean-format command fails to execute.
+    """
+    subprocess.run(["bean-format", "-o", shlex.quote(str(fname)), shlex.quote(str(fname))],   # noqa: S607,S603
+                   shell=False, check=True)
+
+
+class IncrementalFormatter:
+    """
+    Align appended blocks with the columns already used in the file, so the file
+    stays formatted without running `bean-format` over the whole file on every commit.
+
+    The column widths of each file are measured once and cached. They are measured
+    again only if the file is modified by others.
+    """
+    def __init__(self):
+        self._layouts = {}
+
+    def _get_layout(self, fname):
+        mtime = Path(fname).stat().st_mtime
+        layout = self._layouts.get(fname)
+        if layout is None or layout.mtime != mtime:
+            with open(fname) as f:
+                layout = _FileLayout(mtime, f.read())
+            self._layouts[fname] = layout
+        return layout
+
+    def invalidate(self, fname=None):
+        if fname is None:
+            self._layouts.clear()
+        else:
+            self._layouts.pop(fname, None)
+
+    def append(self, fname, *data):
+        """
+        Format the transactions and append them to the file in one write.
+
+        The block is aligned to the existing columns of the file. If the block is wider
+        than the existing columns, the whole file is aligned in-process once.
+
+        Args:
+            fname (str): The file to append to.
+            *data (str): The transactions data in beancount format.
+
+        Returns:
+            Tuple[str, int]: The appended block and the line number of its first line.
+        """
+        layout = self._get_layout(fname)
+        block = "\n\n".join(textwrap.dedent(trx).strip("\n") for trx in data)
+        block = _patterns()[1].sub(layout.indent, block)
+        prefix_width, num_width, _ = _measure(block)
+        widened = prefix_width > layout.prefix_width or num_width > layout.num_width
+        block = "\n" + align_beancount(block, prefix_width=layout.prefix_width or None,
+                                       num_width=layout.num_width or None)
+
+        lineno = layout.newlines + 1
+        if widened:
+            # Alignment of the whole file is changed, and line numbers are kept
+            conf.logger.info("Realign %s for wider columns", fname)
+            with open(fname) as f:
+                contents = align_beancount(f.read() + block)
+            _replace(fname, contents)
+            self._layouts[fname] = _FileLayout(Path(fname).stat().st_mtime, contents)
+        else:
+            _write(fname, "a", block)
+            layout.mtime = Path(fname).stat().st_mtime
+            layout.newlines += block.count("\n")
+        return block, lineno
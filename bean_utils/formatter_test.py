@@ -0,0 +1,89 @@
+import errno
+import subprocess
+import pytest
+from beancount.parser import parser
+from bean_utils import formatter
+from bean_utils.formatter import IncrementalFormatter, format_file
+from bean_utils.bean_test import mock_config
+
+
+LEDGER = """2023-01-01 open Assets:Cash
+2023-01-01 open Expenses:Food
+
+2023-01-02 * "Shop" "Lunch"
+    Assets:Cash    -12.30 USD
+    Expenses:Food   12.30 USD
+"""
+
+
+def test_append_aligned(mock_config, tmp_path):
+    fname = tmp_path / "main.bean"
+    fname.write_text(LEDGER)
+    formatter = IncrementalFormatter()
+    block, lineno = formatter.append(str(fname), """
+        2023-01-03 * "Shop" "Dinner"
+          Expenses:Food  5.00 USD
+          Assets:Cash""")
+    assert lineno == 7
+    contents = fname.read_text()
+    assert contents == LEDGER + block
+    lines = contents.splitlines()
+    # Postings use the indent and columns of the file
+    assert lines[lineno - 1] == ""
+    assert lines[lineno + 1] == "    Expenses:Food    5.00 USD"
+    assert lines[lineno + 2] == "    Assets:Cash"
+
+    # The result is the same as bean-format
+    expected = tmp_path / "expected.bean"
+    subprocess.run(["bean-format", "-o", str(expected), str(fname)], check=True)  # noqa: S607,S603
+    assert expected.read_text() == contents
+
+    # Line numbers of parsed entries point to the appended block
+    entries, errors, _ = parser.parse_string(block, str(fname), report_firstline=lineno)
+    assert not errors
+    assert lines[entries[0].meta["lineno"] - 1].startswith('2023-01-03 * "Shop" "Dinner"')
+
+
+def test_append_widened(mock_config, tmp_path):
+    fname = tmp_path / "main.bean"
+    fname.write_text(LEDGER)
+    formatter = IncrementalFormatter()
+    block, lineno = formatter.append(str(fname), """
+2023-01-03 * "Shop" "Dinner"
+  Expenses:Food:Restaurant:Expensive  12345.00 USD
+  Assets:Cash""")
+    lines = fname.read_text().splitlines()
+    # The whole file is realigned, without changing the line numbers
+    assert len(lines) == LEDGER.count("\n") + block.count("\n")
+    assert lines[lineno + 1] == "    Expenses:Food:Restaurant:Expensive  12345.00 USD"
+    assert lines[4] == "    Assets:Cash                           -12.30 USD"
+
+
+def test_append_widened_failure(mock_config, tmp_path, monkeypatch):
+    fname = tmp_path / "main.bean"
+    fname.write_text(LEDGER)
+    def _fail_fsync(fd):
+        raise OSError(errno.ENOSPC, "No space left on device")
+    monkeypatch.setattr(formatter.os, "fsync", _fail_fsync)
+    with pytest.raises(OSError, match="No space left"):
+        IncrementalFormatter().append(str(fname), """
+2023-01-03 * "Shop" "Dinner"
+  Expenses:Food:Restaurant:Expensive  12345.00 USD
+  Assets:Cash""")
+    # The ledger is kept intact, and the temporary file is removed
+    assert fname.read_text() == LEDGER
+    assert [p.name for p in tmp_path.iterdir()] == ["main.bean"]
+
+
+def test_layout_refreshed(mock_config, tmp_path):
+    fname = tmp_path / "main.bean"
+    fname.write_text(LEDGER)
+    formatter = IncrementalFormatter()
+    formatter.append(str(fname), '2023-01-03 * "Shop" "Dinner"\n  Expenses:Food  5.00 USD\n  Assets:Cash')
+    # Modified by others, the layout should be measured again
+    with open(fname, "a") as f:
+        f.write('\n2023-01-04 * "Shop"\n  Expenses:Food  1.00 USD\n  Assets:Cash\n')
+    format_file(fname)
+    _, lineno = formatter.append(str(fname), '2023-01-05 * "Shop"\n  Expenses:Food  1.00 USD\n  Assets:Cash')
+    lines = fname.read_text().splitlines()
+    assert lines[lineno].startswith('2023-01-05 * "Shop"')
@@ -0,0 +1,55 @@
+import threading
+from urllib.parse import urlsplit
+
+
+_DEFAULT_POOL_SIZE = 4
+_DEFAULT_CONNECT_TIMEOUT = 5
+_DEFAULT_READ_TIMEOUT = 30
+
+# Sessions by the endpoint (scheme and host) and the pool size
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(url, pool_size=_DEFAULT_POOL_SIZE):
+    """
+    Get the session shared by the requests to the endpoint of the url, whose connections
+    are kept alive and reused.
+
+    Args:
+        url (str): The url to request.
+        pool_size (int): The max amount of connections kept for the endpoint.
+
+    Returns:
+        requests.Session: The session.
+    """
+    # requests is imported on the first use to speed up the startup
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc, pool_size)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount(f"{parts.scheme}://{parts.netloc}", adapter)
+            _sessions[key] = session
+        return session
+
+
+def post(config, **kwargs):
+    """
+    Post to the `api_url` of the config section (e.g. `conf.config.embedding`) with the
+    pooled session. The `pool_size`, `connect_timeout` and `read_timeout` of the section
+    are used.
+
+    Returns:
+        requests.Response: The response.
+    """
+    session = get_session(config.api_url, config.get("pool_size", _DEFAULT_POOL_SIZE))
+    timeout = (config.get("connect_timeout", _DEFAULT_CONNECT_TIMEOUT),
+               config.get("read_timeout", _DEFAULT_READ_TIMEOUT))
+    return session.post(config.api_url, timeout=timeout, **kwargs)
+
@@ -0,0 +1,31 @@
+import requests
+from bean_utils import http_client
+from bean_utils.bean_test import MockResponse
+from conf.config_data import Config
+
+
+def test_get_session(monkeypatch):
+    monkeypatch.setattr(http_client, "_sessions", {})
+    session = http_client.get_session("https://api.example.com/v1/embeddings", pool_size=8)
+    # Shared by the same endpoint
+    assert http_client.get_session("https://api.example.com/v1/chat/completions", pool_size=8) is session
+    assert http_client.get_session("https://other.example.com/v1/embeddings", pool_size=8) is not session
+    adapter = session.get_adapter("https://api.example.com/v1/embeddings")
+    assert adapter._pool_maxsize == 8  # noqa: SLF001
+
+
+def test_post(monkeypatch):
+    monkeypatch.setattr(http_client, "_sessions", {})
+    calls = []
+    def _mock_post(session, url, **kwargs):
+        calls.append((session, url, kwargs))
+        return MockResponse({})
+    monkeypatch.setattr(requests.Session, "post", _mock_post)
+
+    config = Config.from_dict({"api_url": "https://api.example.com/v1/embeddings", "read_timeout": 10})
+    http_client.post(config, json={"input": []})
+    http_client.post(config, json={"input": ["a"]})
+    assert calls[0][0] is calls[1][0]
+    assert calls[0][1] == "https://api.example.com/v1/embeddings"
+    # Separate connect and read timeouts
+    assert calls[1][2] == {"timeout": (5, 10), "json": {"input": ["a"]}}
@@ -0,0 +1,70 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Tuple
+from bean_utils.bean import BeanManager
+import conf
+
+
+@dataclass
+class ImportResult:
+    transactions: List[str] = field(default_factory=list)
+    # Line numbers in the input and errors of the failed lines
+    errors: List[Tuple[int, Exception]] = field(default_factory=list)
+    lines: int = 0
+    seconds: float = 0.0
+
+    @property
+    def throughput(self):
+        """Lines converted per second."""
+        return self.lines / max(self.seconds, 1e-6)
+
+
+def read_lines(stream):
+    """
+    Read the shorthand lines to import, blank lines and comments starting with `#` are skipped.
+
+    Returns:
+        List[Tuple[int, str]]: The line numbers and contents of the lines.
+    """
+    lines = []
+    for lineno, line in enumerate(stream, 1):
+        line = line.strip()
+        if line and not line.startswith("#"):
+            lines.append((lineno, line))
+    return lines
+
+
+def import_lines(manager: BeanManager, lines, workers=4, batch_size=32) -> ImportResult:
+    """
+    Convert shorthand lines into transactions in bulk. The lines are split into batches,
+    each batch is generated by `BeanManager.generate_trx_batch` with one embedding
+    request, and at most `workers` batches are generated concurrently.
+
+    Args:
+        manager (BeanManager): The manager of the ledger to match accounts from.
+        lines (List[Tuple[int, str]]): The line numbers and contents, see `read_lines`.
+        workers (int): The max amount of batches generated concurrently.
+        batch_size (int): The amount of lines of each batch.
+
+    Returns:
+        ImportResult: The best candidate of each converted line in the input order,
+            and the errors of the lines that cannot be converted.
+    """
+    def _generate(batch):
+        return manager.generate_trx_batch([line for _, line in batch])
+
+    start = time.monotonic()
+    batches = [lines[i:i+batch_size] for i in range(0, len(lines), batch_size)]
+    result = ImportResult(lines=len(lines))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="beanbot-import") as executor:
+        for batch, trxs in zip(batches, executor.map(_generate, batches)):
+            for (lineno, _), trx in zip(batch, trxs):
+                if isinstance(trx, Exception):
+                    result.errors.append((lineno, trx))
+                else:
+                    result.transactions.append(trx[0].strip("\n"))
+    result.seconds = time.monotonic() - start
+    conf.logger.info("Converted %d lines in %.3fs, %.1f lines/s", result.lines, result.seconds,
+                     result.throughput)
+    return result
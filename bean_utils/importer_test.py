@@ -0,0 +1,101 @@
+import io
+import threading
+import pytest
+import vec_db
+from bean_utils import bean, vec_query
+from bean_utils.batch_executor import RetryableError
+from bean_utils.importer import import_lines, read_lines
+from bean_utils.bean_test import mock_config, mock_embedding, assert_txs_equal
+
+
+NOTES = """# Exported notes
+23.4 BofA:Checking "Kin Soy" Eating
+
+10.00 "Kin Soy", "Eating"
+10.00 ICBC:Checking NotFound McDonalds 'Big Mac'
+5 'unclosed
+5 BofA:Checking "Kin Soy" Lunch #tag1
+"""
+
+
+def test_read_lines():
+    lines = read_lines(io.StringIO(NOTES))
+    assert [lineno for lineno, _ in lines] == [2, 4, 5, 6, 7]
+    assert lines[0][1] == '23.4 BofA:Checking "Kin Soy" Eating'
+
+
+def test_import_lines(mock_config, monkeypatch):
+    mock_config["embedding"] = {
+        "enable": True,
+        "db_store_folder": mock_config.embedding.db_store_folder,
+        "transaction_amount": 100,
+        "candidates": 3,
+        "output_amount": 2,
+    }
+    requests = []
+    lock = threading.Lock()
+    def _mock_embedding(texts):
+        with lock:
+            requests.append(texts)
+        return mock_embedding(texts)
+    monkeypatch.setattr(vec_query, "embedding", _mock_embedding)
+    manager = bean.BeanManager(mock_config.beancount.filename)
+    vec_query.build_tx_db(manager.entries)
+    requests.clear()
+
+    lines = read_lines(io.StringIO(NOTES))
+    result = import_lines(manager, lines, workers=2, batch_size=2)
+    # Unmatched lines of each batch are embedded in one request
+    assert len(requests) == 2
+    assert sorted(requests)[0] == ["ICBC:Checking NotFound McDonalds Big Mac"]
+    assert result.lines == 5
+    assert [lineno for lineno, _ in result.errors] == [6]
+    # Transactions are in the input order
+    assert len(result.transactions) == 4
+    assert_txs_equal(result.transactions[0], manager.generate_trx(lines[0][1])[0])
+    assert_txs_equal(result.transactions[3], manager.generate_trx(lines[4][1])[0])
+    assert result.throughput > 0
+
+
+def test_import_lines_sqlite(mock_config, monkeypatch):
+    pytest.importorskip("sqlite_vec")
+    from vec_db import sqlite_vec_db
+    monkeypatch.setattr(vec_db, "_backend", sqlite_vec_db)
+    monkeypatch.setattr(sqlite_vec_db, "_dbs", {})
+    mock_config["embedding"] = {
+        "enable": True,
+        "db_store_folder": mock_config.embedding.db_store_folder,
+        "transaction_amount": 100,
+        "candidates": 3,
+        "output_amount": 2,
+    }
+    monkeypatch.setattr(vec_query, "embedding", mock_embedding)
+    manager = bean.BeanManager(mock_config.beancount.filename)
+    # Built in this thread, and queried in the workers
+    vec_query.build_tx_db(manager.entries)
+
+    lines = read_lines(io.StringIO(NOTES))
+    result = import_lines(manager, lines, workers=4, batch_size=1)
+    assert [lineno for lineno, _ in result.errors] == [6]
+    assert len(result.transactions) == 4
+
+
+def test_import_lines_request_error(mock_config, monkeypatch):
+    mock_config["embedding"] = {
+        "enable": True,
+        "db_store_folder": mock_config.embedding.db_store_folder,
+        "max_retries": 0,
+    }
+    def _mock_embedding(texts):
+        msg = "Embedding request failed with status 503"
+        raise RetryableError(msg)
+    monkeypatch.setattr(vec_query, "embedding", _mock_embedding)
+    manager = bean.BeanManager(mock_config.beancount.filename)
+
+    lines = read_lines(io.StringIO(NOTES))
+    result = import_lines(manager, lines, workers=2, batch_size=2)
+    # Only the lines needing the failed requests are reported, the others are converted
+    assert [lineno for lineno, _ in result.errors] == [4, 5, 6]
+    assert isinstance(result.errors[0][1], RetryableError)
+    assert isinstance(result.errors[1][1], RetryableError)
+    assert len(result.transactions) == 2
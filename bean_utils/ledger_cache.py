@@ -0,0 +1,134 @@
+import glob
+import hashlib
+import os
+import pickle
+import re
+import struct
+import time
+from pathlib import Path
+from beancount import loader
+from bean_utils import parallel_loader
+import conf
+
+
+_INCLUDE_RE = re.compile(r'^include\s+"([^"]*)"', re.MULTILINE)
+
+
+def _cache_path(cache_folder, fname):
+    # Different ledgers with the same name may share one cache folder
+    digest = hashlib.md5(str(Path(fname).absolute()).encode()).hexdigest()[:8]  # noqa: S324
+    return Path(cache_folder) / f"{Path(fname).name}.{digest}.pickle"
+
+
+def include_patterns(filenames):
+    """
+    Find the patterns of the `include` directives in the included files, which are
+    resolved against the folder of the including file like beancount does.
+
+    Returns:
+        List[str]: The absolute glob patterns, sorted.
+    """
+    patterns = set()
+    for fname in filenames:
+        try:
+            with open(fname, encoding="utf8") as f:
+                contents = f.read()
+        except FileNotFoundError:
+            continue
+        for pattern in _INCLUDE_RE.findall(contents):
+            patterns.add(os.path.normpath(os.path.join(os.path.dirname(fname), pattern)))  # noqa: PTH118,PTH120
+    return sorted(patterns)
+
+
+def compute_key(filenames, patterns=()):
+    """
+    Compute the cache key of the ledger from the size and mtime of every included file,
+    and the files matching the include patterns, so that new matching files invalidate it.
+
+    Args:
+        filenames (List[str]): The included files, order is not relevant.
+        patterns (List[str]): The include patterns, see `include_patterns`.
+
+    Returns:
+        str: The hex digest of the cache key.
+    """
+    md5 = hashlib.md5()  # noqa: S324
+    for fname in sorted(filenames):
+        md5.update(fname.encode("utf8"))
+        try:
+            stat = os.stat(fname)  # noqa: PTH116
+        except FileNotFoundError:
+            continue
+        md5.update(struct.pack("qq", stat.st_mtime_ns, stat.st_size))
+    for pattern in patterns:
+        md5.update(b"\0" + pattern.encode("utf8"))
+        for fname in sorted(glob.glob(pattern, recursive=True)):  # noqa: PTH207
+            md5.update(b"\0" + fname.encode("utf8"))
+    return md5.hexdigest()
+
+
+def _read_cache(cache_path):
+    try:
+        with open(cache_path, "rb") as f:
+            # The cache is written by the bot itself
+            key, patterns, result = pickle.load(f)  # noqa: S301
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, ValueError, AttributeError, pickle.UnpicklingError) as e:
+        conf.logger.warning("Ledger cache %s is corrupted: %s", cache_path, e)
+        return None
+    _, _, options = result
+    if key != compute_key(options["include"], patterns):
+        return None
+    return result
+
+
+def _write_cache(cache_path, result):
+    _, _, options = result
+    patterns = include_patterns(options["include"])
+    key = compute_key(options["include"], patterns)
+    tmp_path = cache_path.with_suffix(".tmp")
+    try:
+        Path(cache_path.parent).mkdir(parents=True, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            pickle.dump((key, patterns, result), f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_path.replace(cache_path)
+    except OSError as e:
+        conf.logger.warning("Failed to write ledger cache %s: %s", cache_path, e)
+
+
+def _load_file(fname, workers):
+    if workers:
+        return parallel_loader.load_file(fname, workers)
+    return loader.load_file(fname)
+
+
+def load_file(fname, cache_folder=None, workers=0):
+    """
+    Load the beancount file, and deserialize it from the on-disk cache if none of the
+    included files is modified since the cache is written.
+
+    Args:
+        fname (str): The entrypoint of the ledger.
+        cache_folder (str): The folder to store the cache. The cache is disabled if None.
+        workers (int): If positive, included files are parsed in this amount of worker
+            processes. Otherwise, the ledger is loaded serially.
+
+    Returns:
+        Tuple[list, list, dict]: The entries, errors and options, same as `loader.load_file`.
+    """
+    start = time.monotonic()
+    if cache_folder is None:
+        result = _load_file(fname, workers)
+        conf.logger.info("Ledger %s loaded in %.3fs", fname, time.monotonic() - start)
+        return result
+
+    cache_path = _cache_path(cache_folder, fname)
+    result = _read_cache(cache_path)
+    if result is not None:
+        conf.logger.info("Ledger cache hit, %s loaded in %.3fs", fname, time.monotonic() - start)
+        return result
+    result = _load_file(fname, workers)
+    _write_cache(cache_path, result)
+    conf.logger.info("Ledger cache miss, %s loaded in %.3fs", fname, time.monotonic() - start)
+    return result
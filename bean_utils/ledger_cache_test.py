@@ -0,0 +1,52 @@
+import pytest
+from beancount import loader
+from bean_utils import ledger_cache
+from bean_utils.bean_test import mock_config, copied_bean
+
+
+def test_load_without_cache(mock_config, copied_bean, tmp_path):
+    entries, _, options = ledger_cache.load_file(str(copied_bean))
+    assert len(entries) == 2037
+    assert not list(tmp_path.glob("*.pickle"))
+
+
+def test_load_with_cache(mock_config, copied_bean, tmp_path, monkeypatch):
+    cache_folder = tmp_path / "cache"
+    entries, _, options = ledger_cache.load_file(str(copied_bean), cache_folder)
+    assert len(entries) == 2037
+    assert len(list(cache_folder.glob("*.pickle"))) == 1
+
+    # Cache hit, the ledger should not be parsed
+    def _fail_load(*args, **kwargs):
+        pytest.fail("Ledger should be loaded from cache")
+    with monkeypatch.context() as m:
+        m.setattr(loader, "load_file", _fail_load)
+        cached_entries, _, cached_options = ledger_cache.load_file(str(copied_bean), cache_folder)
+    assert cached_entries == entries
+    assert cached_options["include"] == options["include"]
+
+    # Cache miss after the ledger is modified
+    with open(copied_bean, "a") as f:
+        f.write("2023-01-01 open Assets:Cache:Test\n")
+    entries, _, _ = ledger_cache.load_file(str(copied_bean), cache_folder)
+    assert len(entries) == 2038
+
+    # Corrupted cache is ignored
+    next(cache_folder.glob("*.pickle")).write_bytes(b"corrupted")
+    entries, _, _ = ledger_cache.load_file(str(copied_bean), cache_folder)
+    assert len(entries) == 2038
+
+
+def test_cache_include_glob(mock_config, tmp_path):
+    fname = tmp_path / "main.bean"
+    fname.write_text('2023-01-01 open Assets:Cash\ninclude "months/*.bean"\n')
+    (tmp_path / "months").mkdir()
+    (tmp_path / "months" / "01.bean").write_text('2023-01-02 * "Shop"\n  Assets:Cash  -1 USD\n  Assets:Cash  1 USD\n')
+    cache_folder = tmp_path / "cache"
+    entries, _, _ = ledger_cache.load_file(str(fname), cache_folder)
+    assert len(entries) == 2
+
+    # A new file matching the include pattern invalidates the cache
+    (tmp_path / "months" / "02.bean").write_text('2023-02-02 * "Shop"\n  Assets:Cash  -1 USD\n  Assets:Cash  1 USD\n')
+    entries, _, _ = ledger_cache.load_file(str(fname), cache_folder)
+    assert len(entries) == 3
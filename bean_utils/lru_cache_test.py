@@ -0,0 +1,28 @@
+from bean_utils.lru_cache import LRUCache
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+    assert cache.get("a") is None
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    # "b" is the least recently used one
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("b", "default") == "default"
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+    assert cache.stats() == {"size": 2, "hits": 3, "misses": 2}
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.stats() == {"size": 0, "hits": 0, "misses": 0}
+
+
+def test_disabled_lru_cache():
+    cache = LRUCache(maxsize=0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
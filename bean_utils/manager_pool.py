@@ -0,0 +1,135 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from bean_utils.bean import BeanManager
+import conf
+
+
+class BeanManagerPool:
+    """
+    Managers of the ledgers served by one bot, each ledger is owned by a Telegram chat
+    or a Mattermost user.
+
+    Managers are loaded lazily on the first request. The least recently used managers
+    are unloaded when more than `max_size` ledgers are loaded, or the loaded entries
+    exceed `max_entries`, and are loaded again on the next request.
+    """
+    def __init__(self, ledgers, max_size=4, max_entries=None):
+        """
+        Args:
+            ledgers (List[dict]): The ledgers with keys `name`, `filename`, and optional
+                `currency`, `db_store_folder`, `chat_id` (Telegram), `owner_user` (Mattermost).
+            max_size (int): The max amount of loaded ledgers.
+            max_entries (int): The max amount of loaded entries of all ledgers, no limit if None.
+        """
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self._ledgers = {}
+        self._owners = {}
+        for ledger in ledgers:
+            name = ledger["name"]
+            if name in self._ledgers:
+                err_msg = f"Duplicated ledger name: {name}"
+                raise ValueError(err_msg)
+            self._ledgers[name] = ledger
+            for key in ("chat_id", "owner_user"):
+                if ledger.get(key) is not None:
+                    self._owners[ledger[key]] = name
+        self._managers = OrderedDict()
+        self._lock = threading.Lock()
+        # Ledgers are loaded without holding the pool lock, one load of each ledger at a time
+        self._load_locks = {name: threading.Lock() for name in self._ledgers}
+
+    def __contains__(self, owner):
+        return owner in self._owners
+
+    def owners(self, key):
+        """Get the owners of the given kind (`chat_id` or `owner_user`) of all ledgers."""
+        return [ledger[key] for ledger in self._ledgers.values() if ledger.get(key) is not None]
+
+    def loaded(self):
+        """Get the names of the loaded ledgers, from the least recently used."""
+        with self._lock:
+            return list(self._managers.keys())
+
+    def _create_manager(self, name):
+        ledger = self._ledgers[name]
+        db_store_folder = ledger.get("db_store_folder")
+        if db_store_folder is None:
+            # Transactions of different ledgers should not be suggested to each other
+            db_store_folder = Path(conf.config.embedding.get("db_store_folder", ".")) / name
+            db_store_folder.mkdir(parents=True, exist_ok=True)
+        conf.logger.info("Load ledger %s from %s", name, ledger["filename"])
+        return BeanManager(ledger["filename"], ledger.get("currency"), str(db_store_folder))
+
+    def _evict(self):
+        """Remove the least recently used managers over the budget, and return them to be closed."""
+        def _over_budget():
+            if len(self._managers) > self.max_size:
+                return True
+            if self.max_entries is None:
+                return False
+            # The published snapshots, which are not reloaded for the check
+            return sum(m._snapshot.entry_count for m in self._managers.values()) > self.max_entries  # noqa: SLF001
+
+        evicted = []
+        # The latest one is always kept
+        while len(self._managers) > 1 and _over_budget():
+            name, manager = self._managers.popitem(last=False)
+            conf.logger.info("Unload ledger %s", name)
+            evicted.append(manager)
+        return evicted
+
+    def get(self, owner) -> BeanManager:
+        """
+        Get the manager of the ledger owned by the given chat or user, and load it
+        if it is not loaded.
+
+        Raises:
+            KeyError: If the owner has no ledger.
+        """
+        name = self._owners[owner]
+        manager = self._get_loaded(name)
+        if manager is not None:
+            return manager
+        with self._load_locks[name]:
+            # It may be loaded by another thread while waiting
+            manager = self._get_loaded(name)
+            if manager is not None:
+                return manager
+            manager = self._create_manager(name)
+            with self._lock:
+                self._managers[name] = manager
+                evicted = self._evict()
+        # Closing waits for the pending commits, which should not block the other ledgers
+        for evicted_manager in evicted:
+            evicted_manager.close()
+        return manager
+
+    def _get_loaded(self, name):
+        with self._lock:
+            manager = self._managers.get(name)
+            if manager is not None:
+                self._managers.move_to_end(name)
+            return manager
+
+    def close(self):
+        with self._lock:
+            managers = list(self._managers.values())
+            self._managers.clear()
+        for manager in managers:
+            manager.close()
+
+
+manager_pool = None
+
+
+def init_manager_pool():
+    """Create the pool of the ledgers configured in `ledgers`, in addition to the default one."""
+    global manager_pool
+    manager_pool = BeanManagerPool(
+        conf.config.get("ledgers") or [],
+        max_size=conf.config.beancount.get("pool_size", 4),
+        max_entries=conf.config.beancount.get("pool_max_entries"),
+    )
+    return manager_pool
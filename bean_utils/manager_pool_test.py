@@ -0,0 +1,121 @@
+import shutil
+import threading
+import pytest
+from bean_utils.manager_pool import BeanManagerPool
+from bean_utils.bean_test import mock_config
+
+
+@pytest.fixture
+def ledgers(tmp_path):
+    result = []
+    for i, name in enumerate(["alice", "bob", "carol"]):
+        fname = tmp_path / f"{name}.bean"
+        shutil.copyfile("testdata/example.bean", fname)
+        result.append({"name": name, "filename": str(fname), "chat_id": i, "owner_user": name})
+    return result
+
+
+def test_pool_lazy_load(mock_config, ledgers, tmp_path):
+    pool = BeanManagerPool(ledgers, max_size=2)
+    assert pool.loaded() == []
+    assert 0 in pool
+    assert "bob" in pool
+    assert 42 not in pool
+    assert pool.owners("chat_id") == [0, 1, 2]
+    with pytest.raises(KeyError):
+        pool.get(42)
+
+    # Chat and user of the same owner share the manager
+    manager = pool.get(0)
+    assert pool.get("alice") is manager
+    assert manager.fname == ledgers[0]["filename"]
+    assert manager.currency == "USD"
+    # Vector databases are separated
+    assert manager.db_store_folder == str(tmp_path / "alice")
+    assert (tmp_path / "alice").is_dir()
+    pool.close()
+
+
+def test_pool_evict_by_size(mock_config, ledgers):
+    pool = BeanManagerPool(ledgers, max_size=2)
+    alice = pool.get("alice")
+    pool.get("bob")
+    # Recently used ledgers are kept
+    assert pool.get("alice") is alice
+    pool.get("carol")
+    assert pool.loaded() == ["alice", "carol"]
+
+    # Unloaded ledgers are loaded again on demand
+    bob = pool.get("bob")
+    assert len(bob.entries) == 2037
+    assert pool.loaded() == ["carol", "bob"]
+    pool.close()
+    assert pool.loaded() == []
+
+
+def test_pool_evict_by_entries(mock_config, ledgers):
+    pool = BeanManagerPool(ledgers, max_size=3, max_entries=3000)
+    pool.get("alice")
+    pool.get("bob")
+    assert pool.loaded() == ["bob"]
+    # The latest one is kept even if it exceeds the budget
+    pool = BeanManagerPool(ledgers, max_size=3, max_entries=1000)
+    pool.get("alice")
+    assert pool.loaded() == ["alice"]
+
+
+def test_pool_load_concurrently(mock_config, ledgers, monkeypatch):
+    pool = BeanManagerPool(ledgers, max_size=3)
+    alice = pool.get("alice")
+    loading = threading.Event()
+    release = threading.Event()
+    create_manager = pool._create_manager
+    def _slow_create(name):
+        loading.set()
+        release.wait(timeout=5)
+        return create_manager(name)
+    monkeypatch.setattr(pool, "_create_manager", _slow_create)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(pool.get("bob"))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    assert loading.wait(timeout=5)
+    # Loaded ledgers are served while another one is loading
+    assert pool.get("alice") is alice
+    release.set()
+    for thread in threads:
+        thread.join()
+    # The ledger is loaded only once
+    assert results[0] is results[1]
+    assert pool.loaded() == ["alice", "bob"]
+
+    # Checking the budget doesn't reload the ledgers
+    pool.max_entries = 10000
+    monkeypatch.setattr(alice, "_auto_reload", lambda *args: pytest.fail("Reloaded"))
+    pool.get("carol")
+    pool.close()
+
+
+def test_pool_close_evicted_unlocked(mock_config, ledgers, monkeypatch):
+    pool = BeanManagerPool(ledgers, max_size=1)
+    alice = pool.get("alice")
+    closing = threading.Event()
+    release = threading.Event()
+    close = alice.close
+    def _slow_close():
+        closing.set()
+        release.wait(timeout=5)
+        close()
+    monkeypatch.setattr(alice, "close", _slow_close)
+
+    thread = threading.Thread(target=pool.get, args=("bob",))
+    thread.start()
+    assert closing.wait(timeout=5)
+    # The pool is not locked while the evicted ledger is waiting for its commits
+    assert pool._lock.acquire(timeout=1)  # noqa: SLF001
+    pool._lock.release()  # noqa: SLF001
+    release.set()
+    thread.join()
+    assert pool.loaded() == ["bob"]
+    pool.close()
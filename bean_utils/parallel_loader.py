@@ -0,0 +1,131 @@
+import glob
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from beancount import loader
+from beancount.core import data
+from beancount.ops import validation
+from beancount.parser import booking, parser
+from beancount.utils import encryption
+import conf
+
+
+# The pool is shared by all reloads, since starting worker processes is expensive
+_executor = None
+_executor_workers = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(max_workers):
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != max_workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            # Forking a process with running threads (e.g. the file watcher) is unsafe
+            _executor = ProcessPoolExecutor(max_workers,
+                                            mp_context=multiprocessing.get_context("spawn"))
+            _executor_workers = max_workers
+        return _executor
+
+
+def _parse_one(filename):
+    """
+    Parse a single file in a worker process.
+
+    Returns:
+        Tuple[list, list, dict, float]: The entries, errors and options of the file,
+            and the CPU seconds spent on parsing.
+    """
+    # CPU time is not inflated when workers are more than cores
+    start = time.process_time()
+    if encryption.is_encrypted_file(filename):
+        contents = encryption.read_encrypted_file(filename)
+        entries, errors, options = parser.parse_string(contents, filename)
+    else:
+        entries, errors, options = parser.parse_file(filename)
+    return entries, errors, options, time.process_time() - start
+
+
+def _expand_includes(cwd, includes, errors):
+    filenames = []
+    for include in includes:
+        matched = glob.glob(os.path.join(cwd, include), recursive=True)  # noqa: PTH118,PTH207
+        if not matched:
+            errors.append(loader.LoadError(data.new_metadata("<load>", 0),
+                                           f'File glob "{include}" does not match any files', None))
+        filenames.extend(os.path.normpath(f) for f in matched)
+    return filenames
+
+
+def load_file(fname, max_workers=None):
+    """
+    Load the beancount file the same as `loader.load_file`, except that the included
+    files are parsed concurrently in worker processes. The parsed files are merged in
+    the same order as the serial loader, then booked, transformed and validated here.
+
+    Args:
+        fname (str): The entrypoint of the ledger.
+        max_workers (int): The amount of worker processes, the CPU count if None.
+
+    Returns:
+        Tuple[list, list, dict]: The entries, errors and options, same as `loader.load_file`.
+    """
+    # Keep the same path normalization with beancount loader, which does not resolve symlinks
+    fname = os.path.normpath(os.path.abspath(os.path.expanduser(fname)))  # noqa: PTH100,PTH111
+    start = time.monotonic()
+    executor = None
+    entries, errors = [], []
+    options = None
+    serial_seconds = 0.0
+    # Files are visited in the same breadth first order as the serial loader, while
+    # the included files of each visited file are submitted to be parsed in advance.
+    queue = [fname]
+    seen = set()
+    futures = {}
+    for filename in queue:
+        if filename in seen:
+            errors.append(loader.LoadError(data.new_metadata("<load>", 0),
+                                           f'Duplicate filename parsed: "{filename}"', None))
+            continue
+        if not os.path.exists(filename):  # noqa: PTH110
+            errors.append(loader.LoadError(data.new_metadata("<load>", 0),
+                                           f'File "{filename}" does not exist', None))
+            continue
+        seen.add(filename)
+        if filename in futures:
+            src_entries, src_errors, src_options, seconds = futures.pop(filename).result()
+        else:
+            src_entries, src_errors, src_options, seconds = _parse_one(filename)
+        serial_seconds += seconds
+        entries.extend(src_entries)
+        errors.extend(src_errors)
+        if options is None:
+            options = src_options
+        else:
+            loader.aggregate_options_map(options, src_options)
+
+        included = _expand_includes(os.path.dirname(filename), src_options["include"], errors)  # noqa: PTH120
+        for include in included:
+            if include not in seen and include not in futures and os.path.exists(include):  # noqa: PTH110
+                if executor is None:
+                    executor = _get_executor(max_workers)
+                futures[include] = executor.submit(_parse_one, include)
+        queue.extend(included)
+    parse_seconds = time.monotonic() - start
+    options["include"] = sorted(seen)
+
+    entries.sort(key=data.entry_sortkey)
+    entries, booking_errors = booking.book(entries, options)
+    errors.extend(booking_errors)
+    entries, errors = loader.run_transformations(entries, errors, options, None)
+    errors.extend(validation.validate(entries, options, None, None))
+    options["input_hash"] = loader.compute_input_hash(options["include"])
+
+    conf.logger.info("Parsed %d files in %.3fs, speedup %.2fx over %.3fs of serial parsing",
+                     len(seen), parse_seconds, serial_seconds / max(parse_seconds, 1e-6),
+                     serial_seconds)
+    conf.logger.info("Ledger %s loaded in parallel in %.3fs", fname, time.monotonic() - start)
+    return entries, errors, options
@@ -0,0 +1,75 @@
+import re
+import pytest
+from beancount import loader
+from bean_utils import bean, parallel_loader
+from bean_utils.bean_test import mock_config
+
+
+_DIRECTIVE_RE = re.compile(r"^\d{4}-\d{2}-\d{2} ")
+
+
+@pytest.fixture
+def split_bean(tmp_path):
+    """Split the example ledger into a main file including several parts."""
+    with open("testdata/example.bean") as f:
+        lines = f.readlines()
+    header_end = next(i for i, line in enumerate(lines) if _DIRECTIVE_RE.match(line))
+    body = lines[header_end:]
+    parts_folder = tmp_path / "parts"
+    parts_folder.mkdir()
+    main_lines = lines[:header_end]
+    start = 0
+    for i in range(1, 7):
+        end = len(body) * i // 6
+        # Split only at the beginning of a directive
+        while end < len(body) and not _DIRECTIVE_RE.match(body[end]):
+            end += 1
+        (parts_folder / f"part{i}.bean").write_text("".join(body[start:end]))
+        main_lines.append(f'include "parts/part{i}.bean"\n')
+        start = end
+    main_file = tmp_path / "main.bean"
+    main_file.write_text("".join(main_lines))
+    return main_file
+
+
+def test_parallel_load(mock_config, split_bean):
+    entries, errors, options = loader.load_file(str(split_bean))
+    parallel_entries, parallel_errors, parallel_options = parallel_loader.load_file(
+        str(split_bean), max_workers=2)
+    assert len(entries) == 2037
+    assert parallel_entries == entries
+    assert parallel_errors == errors
+    assert len(options["include"]) == 7
+    dcontext = options.pop("dcontext")
+    assert str(parallel_options.pop("dcontext")) == str(dcontext)
+    assert parallel_options == options
+
+
+def test_parallel_load_single_file(mock_config):
+    entries, errors, options = loader.load_file("testdata/example.bean")
+    parallel_entries, parallel_errors, parallel_options = parallel_loader.load_file(
+        "testdata/example.bean")
+    assert parallel_entries == entries
+    assert parallel_options["include"] == options["include"]
+
+
+def test_parallel_load_errors(mock_config, tmp_path):
+    main_file = tmp_path / "main.bean"
+    main_file.write_text('include "missing/*.bean"\ninclude "part.bean"\ninclude "part.bean"\n')
+    (tmp_path / "part.bean").write_text("2023-01-01 open Assets:Cash\n")
+    entries, errors, _ = loader.load_file(str(main_file))
+    parallel_entries, parallel_errors, _ = parallel_loader.load_file(str(main_file))
+    assert parallel_entries == entries
+    assert [e.message for e in parallel_errors] == [e.message for e in errors]
+
+
+def test_manager_parallel_load(mock_config, split_bean):
+    mock_config["beancount"] = {
+        "filename": "testdata/example.bean",
+        "currency": "USD",
+        "account_distinguation_range": [2, 3],
+        "load_workers": 2,
+    }
+    manager = bean.BeanManager(str(split_bean))
+    assert len(manager.entries) == 2037
+    assert len(manager.snapshot.mtimes) == 7
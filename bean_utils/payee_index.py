@@ -0,0 +1,82 @@
+import re
+from typing import Dict, Optional, Tuple
+from beancount.core.data import Transaction, entry_sortkey
+from beancount.core.number import MISSING
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_payee(payee):
+    return _WHITESPACE_RE.sub(" ", payee.strip()).casefold()
+
+
+def resolve_target_account(trx: Transaction) -> Optional[str]:
+    """
+    Resolve the target account of a transaction.
+
+    Returns:
+        str or None: The account of the first posting with missing units. If not
+            found, the first expense account is returned.
+    """
+    expense_account = None
+    for posting in trx.postings:
+        if posting.units is MISSING or posting.meta.get("__automatic__"):
+            return posting.account
+        if posting.account.startswith("Expenses:") and expense_account is None:
+            expense_account = posting.account
+    return expense_account
+
+
+class PayeeIndex:
+    """
+    A mapping from payee to its latest transaction and the resolved target account.
+    Only the sort key of the latest transaction is kept, not the transaction itself.
+    """
+    def __init__(self, normalize=False):
+        """
+        Args:
+            normalize (bool): If True, payees are also matched ignoring case and
+                redundant whitespaces when there is no exact match.
+        """
+        self.normalize = normalize
+        self._latest: Dict[str, Tuple] = {}
+        self._accounts: Dict[str, Optional[str]] = {}
+        self._normalized: Dict[str, Optional[str]] = {}
+
+    def __len__(self):
+        return len(self._latest)
+
+    def add(self, trx: Transaction):
+        """Add a transaction, which should be later than the transactions already added."""
+        if trx.payee is None:
+            return
+        account = resolve_target_account(trx)
+        self._latest[trx.payee] = entry_sortkey(trx)
+        self._accounts[trx.payee] = account
+        if self.normalize:
+            self._normalized[normalize_payee(trx.payee)] = account
+
+    def copy(self) -> "PayeeIndex":
+        index = self.__class__(self.normalize)
+        index._latest = dict(self._latest)  # noqa: SLF001
+        index._accounts = dict(self._accounts)  # noqa: SLF001
+        index._normalized = dict(self._normalized)  # noqa: SLF001
+        return index
+
+    def latest_sortkey(self, payee) -> Optional[Tuple]:
+        """Get the `entry_sortkey` of the latest transaction with the given payee."""
+        return self._latest.get(payee)
+
+    def find_account(self, payee) -> Optional[str]:
+        """
+        Find the target account of the latest transaction with the given payee.
+
+        Returns:
+            str or None: The resolved account, or None if not found.
+        """
+        if payee in self._accounts:
+            return self._accounts[payee]
+        if self.normalize:
+            return self._normalized.get(normalize_payee(payee))
+        return None
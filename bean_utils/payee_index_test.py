@@ -0,0 +1,60 @@
+from beancount.parser import parser
+from beancount.core.data import entry_sortkey
+from bean_utils.payee_index import PayeeIndex, normalize_payee
+
+
+_TXS = """
+2023-01-01 * "Kin Soy" "Eating"
+  Assets:US:BofA:Checking  -23.40 USD
+  Expenses:Food:Restaurant
+
+2023-01-02 * "Verizon  Wireless" ""
+  Assets:US:BofA:Checking  -50.00 USD
+  Expenses:Home:Phone       50.00 USD
+
+2023-01-03 * "Kin Soy" "Eating"
+  Assets:US:BofA:Checking  -23.40 USD
+  Expenses:Food:Takeaway
+
+2023-01-04 * "Transfer" ""
+  Assets:US:BofA:Checking  -23.40 USD
+  Assets:US:BofA:Savings    23.40 USD
+"""
+
+
+def test_normalize_payee():
+    assert normalize_payee("  Verizon   Wireless ") == "verizon wireless"
+
+
+def test_payee_index():
+    entries, _, _ = parser.parse_string(_TXS)
+    index = PayeeIndex()
+    for entry in entries:
+        index.add(entry)
+
+    assert len(index) == 3
+    # The latest transaction wins
+    assert index.find_account("Kin Soy") == "Expenses:Food:Takeaway"
+    assert index.latest_sortkey("Kin Soy") == entry_sortkey(entries[2])
+    # Fallback to the expense account
+    assert index.find_account("Verizon  Wireless") == "Expenses:Home:Phone"
+    # No account can be resolved
+    assert index.find_account("Transfer") is None
+    assert index.find_account("Unknown") is None
+    # Not normalized
+    assert index.find_account("verizon wireless") is None
+
+    # Copy is independent
+    copied = index.copy()
+    copied.add(entries[0])
+    assert copied.find_account("Kin Soy") == "Expenses:Food:Restaurant"
+    assert index.find_account("Kin Soy") == "Expenses:Food:Takeaway"
+
+
+def test_payee_index_normalized():
+    entries, _, _ = parser.parse_string(_TXS)
+    index = PayeeIndex(normalize=True)
+    for entry in entries:
+        index.add(entry)
+    assert index.find_account("verizon wireless") == "Expenses:Home:Phone"
+    assert index.find_account(" KIN  SOY ") == "Expenses:Food:Takeaway"
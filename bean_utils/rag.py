@@ -1,10 +1,8 @@
-import requests
-from vec_db import query_by_embedding
-from bean_utils import vec_query
+from bean_utils import http_client, vec_query
+from bean_utils.timing import span
 import conf
 
 
-_TIMEOUT = 30
 # flake8: noqa
 _PROMPT_TEMPLATE = """The user is using Beancount for bookkeeping. For simplicity, there is currently a set of accounting grammar that is converted by a program into complete transaction records. The format of the grammar is `<price> <outflow_account> [<inflow_account>] <payee> [<description>] [#<tag1> [#<tag2>] ...]`, where the inflow and outflow accounts are subject to fuzzy matching.
 
@@ -31,14 +29,23 @@ Reference records are separated by dash delimiter:
 """
 
 
-def complete_rag(args, date, accounts):
-    # Remove the numeric value at first
-    stripped_input = " ".join(args[1:])
+@span("complete_rag")
+def complete_rag(args, date, accounts, db_dir=None, match=None):
+    """
+    Complete the transaction with a LLM, referring to the matched transactions.
+
+    Args:
+        match (list): The reference transactions already queried from the vector
+            database, they are queried with the input if None.
+    """
+    if match is None:
+        # Remove the numeric value at first
+        stripped_input = " ".join(args[1:])
+        candidates = conf.config.embedding.candidates or 3
+        match = vec_query.query_txs_batch([stripped_input], db_dir, amount=candidates)[0]
 
-    candidates = conf.config.embedding.candidates or 3
     rag_config = conf.config.rag
 
-    match = query_by_embedding(vec_query.embedding([stripped_input])[0][0]["embedding"], stripped_input, candidates)
     reference_records = "\n------\n".join([x["content"] for x in match])
     prompt = _PROMPT_TEMPLATE.format(date=date, reference_records=reference_records, accounts=accounts)
     payload = {
@@ -59,7 +66,7 @@ def complete_rag(args, date, accounts):
         "Content-Type": "application/json",
         "Authorization": f"Bearer {rag_config.api_key}",
     }
-    response = requests.post(rag_config.api_url, json=payload, headers=headers, timeout=_TIMEOUT)
+    response = http_client.post(rag_config, json=payload, headers=headers)
     data = response.json()
     if "choices" in data:
         # ChatGPT-format response
@@ -0,0 +1,184 @@
+import dataclasses
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Optional
+from beancount import loader
+from beancount.parser import parser, booking
+from beancount.ops import validation
+from beancount.core import data as bean_data
+from beancount.core.data import Open, Close, Transaction
+from bean_utils import ledger_cache
+from bean_utils.account_index import AccountIndex
+from bean_utils.payee_index import PayeeIndex
+from bean_utils.cube import AccountDayCube
+import conf
+
+
+def _parse_ledger(fname):
+    """
+    Parse the ledger and its included files, without booking, plugins and validation.
+
+    Returns:
+        Tuple[List[Directive], dict]: The sorted unbooked entries and the options.
+    """
+    start = time.monotonic()
+    # Keep the same path normalization with beancount loader, which does not resolve symlinks
+    fname = os.path.normpath(os.path.abspath(fname))  # noqa: PTH100
+    # The same parsing stage as `loader.load_file`, including the resolving of includes
+    entries, _, options = loader._parse_recursive([(fname, True)], None)  # noqa: SLF001
+    entries.sort(key=bean_data.entry_sortkey)
+    conf.logger.info("Ledger %s parsed in %.3fs", fname, time.monotonic() - start)
+    return entries, options
+
+
+@dataclass(frozen=True)
+class LedgerSnapshot:
+    """
+    An immutable state of the loaded ledger.
+
+    A new snapshot is built on every reload or commit and swapped in as a whole, so
+    readers holding an older snapshot are never affected. Nothing reachable from a
+    published snapshot should be mutated.
+
+    A slim snapshot keeps only the indexes used by the bot, and the entries are None.
+    They should be loaded from the files again when needed.
+
+    An unbooked snapshot is built from the parsed directives only, without booking,
+    plugins and validation. Its entries and cube are None, and a fully loaded snapshot
+    is required for reports.
+    """
+    version: int
+    # None if the snapshot is slim
+    entries: Optional[List[bean_data.Directive]]
+    entry_count: int
+    options: dict
+    accounts: FrozenSet[str]
+    # Modification times of included files
+    mtimes: Dict[str, float]
+    # Files that contain open or close directives
+    account_files: FrozenSet[str]
+    account_index: AccountIndex
+    payee_index: PayeeIndex
+    # Daily aggregates for range reports, None if not booked
+    cube: Optional[AccountDayCube]
+    booked: bool = True
+
+    @classmethod
+    def load(cls, fname, cache_folder=None, version=0, normalize_payee=False,
+             slim=False, booked=True, workers=0) -> "LedgerSnapshot":
+        """
+        Load the beancount file and build a snapshot from it.
+
+        Args:
+            fname (str): The entrypoint of the ledger.
+            cache_folder (str): The folder of the on-disk ledger cache, disabled if None.
+            version (int): The version of the snapshot.
+            normalize_payee (bool): Whether to match payees ignoring case and whitespaces.
+            slim (bool): Whether to drop the entries once the indexes are built.
+            booked (bool): If False, the files are only parsed, and the snapshot is
+                built without booking, plugins and validation.
+            workers (int): The amount of processes to parse included files in parallel,
+                the files are parsed serially if not positive.
+        """
+        if booked:
+            entries, _, options = ledger_cache.load_file(fname, cache_folder, workers)
+        else:
+            entries, options = _parse_ledger(fname)
+        accounts = set()
+        account_files = set()
+        used_accounts = []
+        payee_index = PayeeIndex(normalize_payee)
+        for ent in entries:
+            if isinstance(ent, Open):
+                accounts.add(ent.account)
+                account_files.add(ent.meta["filename"])
+            elif isinstance(ent, Close):
+                accounts.remove(ent.account)
+                account_files.add(ent.meta["filename"])
+            elif isinstance(ent, Transaction):
+                used_accounts.extend(posting.account for posting in ent.postings)
+                payee_index.add(ent)
+
+        mtimes = {f: Path(f).stat().st_mtime for f in options["include"]}
+        return cls(
+            version=version,
+            entries=entries if booked and not slim else None,
+            entry_count=len(entries),
+            options=options,
+            accounts=frozenset(accounts),
+            mtimes=mtimes,
+            account_files=frozenset(account_files),
+            account_index=AccountIndex(accounts, used_accounts),
+            payee_index=payee_index,
+            cube=AccountDayCube(entries) if booked else None,
+            booked=booked,
+        )
+
+    def is_modified(self, accounts_only=False) -> bool:
+        """
+        Check if any of the loaded files have been modified since the snapshot is built.
+
+        Args:
+            accounts_only (bool): If True, only check the files that contains account
+                transactions. Defaults to False.
+        """
+        files_to_check = self.mtimes.keys()
+        if accounts_only:
+            files_to_check = self.account_files
+        return any(self.mtimes[fname] != Path(fname).stat().st_mtime for fname in files_to_check)
+
+    def append_block(self, block, fname, lineno) -> Optional["LedgerSnapshot"]:
+        """
+        Parse a block appended to one of the loaded files, and build a new snapshot
+        with its transactions spliced in, without reloading the whole ledger.
+
+        Args:
+            block (str): The text appended to the file.
+            fname (str): The absolute path of the file the block is appended to.
+            lineno (int): The line number of the first line of the block.
+
+        Returns:
+            LedgerSnapshot or None: The new snapshot, or None if the block cannot be
+                validated against this snapshot and a full reload is required.
+        """
+        # Plugins may transform or add entries, which are only applied by a full reload
+        if self.options.get("plugin"):
+            return None
+        new_entries, errors, _ = parser.parse_string(block, fname, report_firstline=lineno)
+        if errors or not new_entries:
+            return None
+        for entry in new_entries:
+            if not isinstance(entry, Transaction):
+                return None
+            if any(posting.account not in self.accounts for posting in entry.postings):
+                return None
+        new_entries, errors = booking.book(new_entries, self.options)
+        if errors:
+            return None
+        if validation.validate_check_transaction_balances(new_entries, self.options):
+            return None
+
+        entries = None if self.entries is None else list(self.entries)
+        payee_index = self.payee_index.copy()
+        for entry in sorted(new_entries, key=bean_data.entry_sortkey):
+            key = bean_data.entry_sortkey(entry)
+            if entries is not None:
+                # New entries are usually the latest ones, so search the position backwards
+                pos = len(entries)
+                while pos > 0 and bean_data.entry_sortkey(entries[pos-1]) > key:
+                    pos -= 1
+                entries.insert(pos, entry)
+            # Backdated transactions should not override the later ones
+            latest = payee_index.latest_sortkey(entry.payee)
+            if latest is None or latest <= key:
+                payee_index.add(entry)
+        mtimes = {**self.mtimes, fname: Path(fname).stat().st_mtime}
+        account_index = self.account_index.with_usage(
+            posting.account for entry in new_entries for posting in entry.postings)
+        cube = None if self.cube is None else self.cube.with_entries(new_entries)
+        return dataclasses.replace(self, entries=entries, mtimes=mtimes,
+                                   entry_count=self.entry_count + len(new_entries),
+                                   account_index=account_index, payee_index=payee_index,
+                                   cube=cube)
@@ -0,0 +1,96 @@
+import contextlib
+import contextvars
+import threading
+import time
+from collections import deque
+import conf
+
+
+_DEFAULT_WINDOW = 1000
+PERCENTILES = (50, 95, 99)
+
+
+class StageStats:
+    """
+    Rolling latencies of the pipeline stages, only the latest `window` samples of
+    each stage are kept.
+    """
+    def __init__(self, window=_DEFAULT_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+    def summary(self):
+        """
+        Get the percentiles of the stages.
+
+        Returns:
+            Dict[str, dict]: The `count` and the `p50`, `p95`, `p99` seconds of each stage.
+        """
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+        result = {}
+        for stage, values in samples.items():
+            result[stage] = {"count": len(values)}
+            for p in PERCENTILES:
+                # Nearest-rank percentile
+                rank = max(0, -(-p * len(values) // 100) - 1)
+                result[stage][f"p{p}"] = values[rank]
+        return result
+
+
+stage_stats = StageStats()
+# The stages of the request handled in the current thread or task
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+
+@contextlib.contextmanager
+def span(stage):
+    """
+    Time a stage, which is recorded in `stage_stats` and the current request trace.
+    It can be used as a decorator to time the whole function.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_stats.record(stage, elapsed)
+        trace_stages = _current_trace.get()
+        if trace_stages is not None:
+            trace_stages.append((stage, elapsed))
+
+
+@contextlib.contextmanager
+def trace(name):
+    """
+    Time a request as a stage, and log the breakdown of its stages if it takes longer
+    than `beancount.slow_request_threshold` seconds. Nested traces are treated as spans.
+    """
+    if _current_trace.get() is not None:
+        with span(name):
+            yield
+        return
+    stages = []
+    token = _current_trace.set(stages)
+    try:
+        with span(name):
+            yield
+    finally:
+        _current_trace.reset(token)
+        total = stages[-1][1]
+        threshold = conf.config.beancount.get("slow_request_threshold", 5.0)
+        if threshold is not None and total > threshold:
+            breakdown = ", ".join(f"{stage}={seconds:.3f}s" for stage, seconds in stages[:-1])
+            conf.logger.warning("Slow request %s took %.3fs: %s", name, total, breakdown or "no stages")
@@ -0,0 +1,67 @@
+import logging
+import time
+import pytest
+from bean_utils import bean, timing
+from bean_utils.timing import StageStats, span, trace
+from bean_utils.bean_test import mock_config
+
+
+@pytest.fixture
+def stage_stats(monkeypatch):
+    stats = StageStats(window=100)
+    monkeypatch.setattr(timing, "stage_stats", stats)
+    return stats
+
+
+def test_percentiles():
+    stats = StageStats(window=100)
+    for i in range(1, 201):
+        stats.record("embedding", i / 1000)
+    stats.record("reload", 1.0)
+    summary = stats.summary()
+    # Only the latest samples are kept
+    assert summary["embedding"] == {"count": 100, "p50": 0.15, "p95": 0.195, "p99": 0.199}
+    assert summary["reload"] == {"count": 1, "p50": 1.0, "p95": 1.0, "p99": 1.0}
+    stats.clear()
+    assert stats.summary() == {}
+
+
+def test_slow_trace(mock_config, stage_stats, caplog):
+    mock_config["beancount"] = {
+        "filename": "testdata/example.bean",
+        "currency": "USD",
+        "account_distinguation_range": [2, 3],
+        "slow_request_threshold": 0.01,
+    }
+    @span("stage_b")
+    def _stage_b():
+        time.sleep(0.02)
+
+    with caplog.at_level(logging.WARNING, logger="beanbot"), trace("request"):
+        with span("stage_a"):
+            pass
+        # Nested traces are spans of the outer one
+        with trace("inner"):
+            _stage_b()
+    assert len(caplog.records) == 1
+    message = caplog.records[0].getMessage()
+    assert message.startswith("Slow request request took ")
+    assert "stage_a=" in message
+    assert "stage_b=" in message
+    assert "inner=" in message
+    assert set(stage_stats.summary()) == {"request", "inner", "stage_a", "stage_b"}
+
+    # Fast requests are not logged
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger="beanbot"), trace("request"):
+        pass
+    assert not caplog.records
+
+
+def test_pipeline_stages(mock_config, stage_stats):
+    manager = bean.BeanManager(mock_config.beancount.filename)
+    manager.generate_trx('23.4 BofA:Checking "Kin Soy" Eating')
+    summary = stage_stats.summary()
+    assert summary["reload"]["count"] == 1
+    assert summary["generate_trx"]["count"] == 1
+    assert summary["account_matching"]["count"] == 1
@@ -1,13 +1,14 @@
-import requests
 from beancount.core.data import Transaction
 from beancount.core.compare import hash_entry
 import conf
-from vec_db import build_db, query_by_embedding
-
-
-_TIMEOUT = 30
+from bean_utils import embedding_cache, http_client
+from bean_utils.batch_executor import RETRY_STATUS_CODES, RetryableError, call_with_retry, parse_retry_after
+from bean_utils.embedding_client import EmbeddingClient, RequestRejectedError
+from bean_utils.timing import span
+from vec_db import build_db, load_embeddings, query_by_embeddings
 
 
+@span("embedding")
 def embedding(texts):
     config = conf.config.embedding
     payload = {
@@ -20,11 +21,70 @@ def embedding(texts):
         "content-type": "application/json",
         "authorization": f"Bearer {config.api_key}",
     }
-    response = requests.post(config.api_url, json=payload, headers=headers, timeout=_TIMEOUT)
+    response = http_client.post(config, json=payload, headers=headers)
+    if response.status_code in RETRY_STATUS_CODES:
+        msg = f"Embedding request failed with status {response.status_code}"
+        raise RetryableError(msg, parse_retry_after(response.headers.get("Retry-After")))
+    if response.status_code >= 400:
+        msg = f"Embedding request failed with status {response.status_code}: {response.text}"
+        raise RequestRejectedError(msg, response.status_code)
     data = response.json()
     return data["data"], data["usage"]["total_tokens"]
 
 
+# Clients by the provider, which keep the limits learned from the rejected requests
+_clients = {}
+
+
+def get_embedding_client():
+    """Get the embedding client of the configured provider and batch limits."""
+    config = conf.config.embedding
+    key = (config.get("api_url"), config.get("model"),
+           config.get("batch_max_tokens", 8192), config.get("batch_max_size", 128))
+    client = _clients.get(key)
+    if client is None:
+        # Look up `embedding` on each call, so that it can be replaced
+        client = _clients.setdefault(key, EmbeddingClient(lambda texts: embedding(texts), key[2], key[3]))
+    return client
+
+
+# Queries block the reply to the user, so they are not retried as patiently as building
+QUERY_MAX_RETRIES = 1
+QUERY_MAX_DELAY = 2.0
+
+
+def cached_embedding(texts, db_dir=None):
+    """
+    Get the embeddings of the texts, only the texts missing from the embedding cache
+    are requested, in one request. The texts are queried by a waiting user, so a rate
+    limited request is retried at most once after a short delay.
+
+    Args:
+        texts (List[str]): The texts to embed.
+        db_dir (str): The folder of the cache, `embedding.db_store_folder` if None.
+
+    Returns:
+        List[List[float]]: The embedding of each text.
+    """
+    max_retries = min(conf.config.embedding.get("max_retries", 5), QUERY_MAX_RETRIES)
+    cache = embedding_cache.get_cache(db_dir)
+    if cache is None:
+        return [e["embedding"] for e in call_with_retry(embedding, texts, max_retries=max_retries,
+                                                         max_delay=QUERY_MAX_DELAY)[0]]
+    model = conf.config.embedding.get("model")
+    keys = [embedding_cache.cache_key(model, text) for text in texts]
+    found = cache.get_many(keys)
+    # Texts of the same key are requested only once, in the normalized form
+    missing = {key: embedding_cache.normalize_text(text) for key, text in zip(keys, texts) if key not in found}
+    if missing:
+        result, _ = call_with_retry(embedding, list(missing.values()), max_retries=max_retries,
+                                    max_delay=QUERY_MAX_DELAY)
+        fetched = {key: e["embedding"] for key, e in zip(missing, result)}
+        cache.put_many(fetched)
+        found.update(fetched)
+    return [found[key] for key in keys]
+
+
 def convert_account(account):
     """
     Convert an account string to a specific segment.
@@ -84,18 +144,23 @@ def convert_to_natural_language(transaction) -> str:
     return sentence
 
 
-def build_tx_db(transactions):
+def build_tx_db(transactions, db_dir=None):
     """
     Build a transaction database from the given transactions. This function
     consolidates the latest transactions and calculates their embeddings.
     The embeddings are stored in a database for future use.
 
+    The build is incremental: the embeddings of sentences already in the database
+    (embedded by the same model) are reused, and only the new sentences are embedded.
+
     Args:
         transactions (list): A list of Transaction objects representing the
         transactions.
+        db_dir (str): The folder of the database, `embedding.db_store_folder` if None.
 
     Returns:
-        int: The total number of tokens used for embedding.
+        dict: The total number of `tokens` used for embedding, and the amount of
+            `reused` and newly `embedded` transactions.
     """
     _content_cache = {}
     def _read_lines(fname, start, end):
@@ -127,36 +192,67 @@ def build_tx_db(transactions):
         }
         if len(unique_txs) >= amount:
             break
-    # Build embedding by group
-    total_usage = 0
+    # Reuse the stored embeddings
+    model = conf.config.embedding.get("model")
+    stored = load_embeddings(model, db_dir)
     unique_txs_list = list(unique_txs.values())
+    new_txs = []
+    for tx in unique_txs_list:
+        tx["model"] = model
+        if tx["sentence"] in stored:
+            tx["embedding"] = stored[tx["sentence"]]
+        else:
+            new_txs.append(tx)
+    # Build embedding of the new sentences in batches packed by tokens, requested concurrently
+    config = conf.config.embedding
+    embed, total_usage = get_embedding_client().embed(
+        [s["sentence"] for s in new_txs],
+        max_workers=config.get("build_workers", 4),
+        requests_per_minute=config.get("requests_per_minute"),
+        max_retries=config.get("max_retries", 5))
+    for s, e in zip(new_txs, embed):
+        s["embedding"] = e["embedding"]
+
+    build_db(unique_txs_list, db_dir)
+    reused = len(unique_txs_list) - len(new_txs)
+    conf.logger.info("Total token usage: %d, reused %d embeddings, embedded %d transactions",
+                     total_usage, reused, len(new_txs))
+    return {"tokens": total_usage, "reused": reused, "embedded": len(new_txs)}
+
 
-    for i in range(0, len(unique_txs_list), 32):
-        sentence = [s['sentence'] for s in unique_txs_list[i:i+32]]
-        embed, usage = embedding(sentence)
-        for s, e in zip(unique_txs_list[i:i+32], embed):
-            s["embedding"] = e["embedding"]
-        total_usage += usage
+@span("query_txs")
+def query_txs_batch(queries, db_dir=None, amount=None):
+    """
+    Query transactions of several query strings, with one embedding request
+    and one batch of database queries.
 
-    build_db(unique_txs_list)
-    conf.logger.info("Total token usage: %d", total_usage)
-    return total_usage
+    Args:
+        queries (List[str]): The query strings to search for.
+        db_dir (str): The folder of the database, `embedding.db_store_folder` if None.
+        amount (int): The max amount of matched transactions of each query,
+            the `output_amount` configuration if None.
+
+    Returns:
+        List[list]: The matched transactions of each query.
+    """
+    if not queries:
+        return []
+    candidates = conf.config.embedding.candidates or 3
+    amount = amount or conf.config.embedding.output_amount or 1
+    matches = query_by_embeddings(cached_embedding(queries, db_dir), queries, candidates, db_dir)
+    return [(match or [])[:amount] for match in matches]
 
 
-def query_txs(query):
+def query_txs(query, db_dir=None):
     """
     Query transactions based on the given query string.
 
     Args:
         query (str): The query string to search for.
+        db_dir (str): The folder of the database, `embedding.db_store_folder` if None.
 
     Returns:
         list: A list of matched transactions. The length of the list is determined
             by the `output_amount` configuration.
     """
-    candidates = conf.config.embedding.candidates or 3
-    output_amount = conf.config.embedding.output_amount or 1
-    match = query_by_embedding(embedding([query])[0][0]["embedding"], query, candidates)
-    if match:
-        return match[:output_amount]
-    return []
+    return query_txs_batch([query], db_dir)[0]
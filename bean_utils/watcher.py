@@ -0,0 +1,80 @@
+import threading
+from pathlib import Path
+import conf
+
+try:
+    # watchfiles is backed by inotify on Linux
+    import watchfiles
+except ImportError:
+    watchfiles = None
+
+
+_POLL_INTERVAL = 1.0
+
+
+class FileWatcher:
+    """
+    Watch a set of files in a background thread, and call `on_change` when any of them
+    is modified. Native file system events are used if `watchfiles` is installed,
+    otherwise the files are polled by their mtime.
+    """
+    def __init__(self, files, on_change, force_polling=False, interval=None):
+        self.on_change = on_change
+        self.interval = interval or _POLL_INTERVAL
+        self.use_polling = force_polling or watchfiles is None
+        self._files = {str(f) for f in files}
+        self._stop_event = None
+        self._thread = None
+
+    def start(self):
+        self._stop_event = threading.Event()
+        target = self._poll if self.use_polling else self._watch
+        self._thread = threading.Thread(target=target, args=(self._files, self._stop_event),
+                                        name="beanbot-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def update_files(self, files):
+        """Restart the watcher if the set of watched files changes."""
+        files = {str(f) for f in files}
+        if files == self._files:
+            return
+        self._files = files
+        if self._thread is not None:
+            self.stop()
+            self.start()
+
+    def _watch(self, files, stop_event):
+        # Watch the parent folders, so that the files replaced by editors are still tracked
+        folders = {str(Path(f).parent) for f in files}
+        for changes in watchfiles.watch(*folders, watch_filter=lambda _, path: path in files,
+                                        debounce=50, stop_event=stop_event, recursive=False,
+                                        raise_interrupt=False):
+            for _, path in changes:
+                conf.logger.debug("File changed: %s", path)
+                self.on_change(path)
+
+    def _poll(self, files, stop_event):
+        def _mtimes():
+            result = {}
+            for f in files:
+                try:
+                    result[f] = Path(f).stat().st_mtime_ns
+                except FileNotFoundError:
+                    result[f] = None
+            return result
+
+        mtimes = _mtimes()
+        while not stop_event.wait(self.interval):
+            new_mtimes = _mtimes()
+            for f, mtime in new_mtimes.items():
+                if mtimes[f] != mtime:
+                    conf.logger.debug("File changed: %s", f)
+                    self.on_change(f)
+            mtimes = new_mtimes
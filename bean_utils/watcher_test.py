@@ -0,0 +1,70 @@
+import time
+import threading
+import pytest
+from bean_utils import watcher, bean
+from bean_utils.bean_test import mock_config, copied_bean
+
+
+def _wait_for(event, timeout=5):
+    return event.wait(timeout)
+
+
+@pytest.mark.parametrize("force_polling", [True, False])
+def test_file_watcher(tmp_path, force_polling):
+    if not force_polling and watcher.watchfiles is None:
+        pytest.skip("watchfiles is not installed")
+    watched = tmp_path / "watched.bean"
+    ignored = tmp_path / "ignored.bean"
+    watched.write_text("")
+    ignored.write_text("")
+
+    changed = []
+    event = threading.Event()
+    def _on_change(path):
+        changed.append(path)
+        event.set()
+
+    file_watcher = watcher.FileWatcher([watched], _on_change, force_polling=force_polling, interval=0.05)
+    file_watcher.start()
+    try:
+        # Give the native watcher some time to set up
+        time.sleep(0.2)
+        ignored.write_text("2023-01-01 open Assets:Ignored\n")
+        watched.write_text("2023-01-01 open Assets:Watched\n")
+        assert _wait_for(event)
+        assert set(changed) == {str(watched)}
+    finally:
+        file_watcher.stop()
+
+
+def test_manager_with_watcher(mock_config, copied_bean, monkeypatch):
+    mock_config["beancount"] = {
+        "filename": "testdata/example.bean",
+        "currency": "USD",
+        "account_distinguation_range": [2, 3],
+        "watch_files": True,
+    }
+    monkeypatch.setattr(watcher, "_POLL_INTERVAL", 0.05)
+    manager = bean.BeanManager(copied_bean)
+    try:
+        assert manager._watcher is not None
+        entry_amount = len(manager.entries)
+        # Files are not checked until the watcher reports a change
+        with monkeypatch.context() as m:
+            m.setattr(manager, "_is_modified", lambda *args: pytest.fail("Files should not be checked"))
+            assert len(manager.entries) == entry_amount
+
+        dirty = threading.Event()
+        mark_dirty = manager._mark_dirty
+        def _mark_dirty(fname):
+            mark_dirty(fname)
+            dirty.set()
+        monkeypatch.setattr(manager._watcher, "on_change", _mark_dirty)
+        time.sleep(0.2)
+        with open(copied_bean, "a") as f:
+            f.write("2023-01-01 open Assets:Watched\n")
+        assert _wait_for(dirty)
+        assert len(manager.entries) == entry_amount + 1
+        assert "Assets:Watched" in manager.accounts
+    finally:
+        manager.close()
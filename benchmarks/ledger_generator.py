@@ -0,0 +1,112 @@
+"""
+Generate synthetic ledgers in the shape of `testdata/example.bean` for benchmarks.
+
+Usage: python -m benchmarks.ledger_generator 100000 -o /tmp/ledger.bean
+"""
+import argparse
+import random
+from datetime import date, timedelta
+from pathlib import Path
+
+
+START_DATE = date(2000, 1, 1)
+# Transactions per day, so larger ledgers also span more years
+_TXS_PER_DAY = 8
+
+ASSET_ACCOUNTS = [
+    "Assets:US:BofA:Checking",
+    "Assets:US:BofA:Savings",
+    "Assets:US:Chase:Checking",
+    "Assets:CN:ICBC:Checking",
+    "Assets:Cash:Wallet",
+    "Liabilities:US:Chase:Slate",
+    "Liabilities:US:Amex:Platinum",
+]
+_EXPENSE_CATEGORIES = {
+    "Food": ["Groceries", "Restaurant", "Coffee", "Alcohol", "Snacks"],
+    "Home": ["Rent", "Electricity", "Internet", "Phone", "Water", "Furniture"],
+    "Transport": ["Tram", "Taxi", "Fuel", "Parking", "Flight"],
+    "Health": ["Medical", "Dental", "Pharmacy", "Gym"],
+    "Shopping": ["Clothing", "Books", "Electronics", "Gifts"],
+    "Fun": ["Movies", "Games", "Music", "Travel"],
+}
+EXPENSE_ACCOUNTS = [f"Expenses:{category}:{sub}"
+                    for category, subs in _EXPENSE_CATEGORIES.items() for sub in subs]
+INCOME_ACCOUNTS = ["Income:US:Babble:Salary", "Income:US:BofA:Interest"]
+
+_PAYEE_WORDS = [
+    "Onion", "Farmer", "Corner", "Good", "Metro", "River", "Golden", "Green", "Blue", "Little",
+    "Royal", "Urban", "Sunny", "Happy", "Lucky", "Silver", "Star", "Ocean", "Maple", "Cedar",
+]
+_PAYEE_KINDS = ["Market", "Deli", "Cafe", "Bistro", "Store", "Shop", "Bakery", "Pharmacy", "Cinema", "Station"]
+_NARRATIONS = ["Buying groceries", "Eating out", "Lunch", "Dinner", "Tickets", "Monthly bill", "", ""]
+_TAGS = ["#trip-new-york", "#trip-paris", "#work", "#family"]
+
+
+def payee_names(count, rng):
+    """Generate unique payee names, the amount of payees grows with the ledger."""
+    names = [f"{first} {kind}" for first in _PAYEE_WORDS for kind in _PAYEE_KINDS]
+    suffix = 2
+    while len(names) < count:
+        names.extend(f"{name} {suffix}" for name in names[:count - len(names)])
+        suffix += 1
+    rng.shuffle(names)
+    return names[:count]
+
+
+def write_ledger(fname, transactions, seed=0):
+    """
+    Write a ledger with the given amount of transactions, the result is deterministic
+    for the same arguments.
+
+    Args:
+        fname (str): The file to write.
+        transactions (int): The amount of transactions.
+        seed (int): The seed of the random generator.
+
+    Returns:
+        dict: The payees and the date range of the ledger, for the benchmarks to query.
+    """
+    rng = random.Random(seed)  # noqa: S311
+    # Each payee has a preferred expense account, so payee matching has something to find
+    payees = payee_names(max(50, transactions // 200), rng)
+    payee_accounts = {payee: rng.choice(EXPENSE_ACCOUNTS) for payee in payees}
+    with open(fname, "w") as f:
+        f.write('option "title" "Synthetic ledger"\n')
+        f.write('option "operating_currency" "USD"\n\n')
+        f.write(f"{START_DATE - timedelta(days=1)} commodity USD\n\n")
+        for account in ASSET_ACCOUNTS + EXPENSE_ACCOUNTS + INCOME_ACCOUNTS + ["Equity:Opening-Balances"]:
+            f.write(f"{START_DATE - timedelta(days=1)} open {account}\n")
+        f.write("\n")
+        for i in range(transactions):
+            day = START_DATE + timedelta(days=i // _TXS_PER_DAY)
+            if i % 500 == 0:
+                f.write(f'{day} * "Babble" "Payroll"\n'
+                        f"  Assets:US:BofA:Checking  {rng.randint(3000, 6000)}.00 USD\n"
+                        f"  Income:US:Babble:Salary\n\n")
+                continue
+            payee = rng.choice(payees)
+            narration = rng.choice(_NARRATIONS)
+            tag = f" {rng.choice(_TAGS)}" if rng.random() < 0.05 else ""
+            amount = f"{rng.randint(1, 20000) / 100:.2f}"
+            f.write(f'{day} * "{payee}" "{narration}"{tag}\n'
+                    f"  {rng.choice(ASSET_ACCOUNTS)}  -{amount} USD\n"
+                    f"  {payee_accounts[payee]}  {amount} USD\n\n")
+    return {
+        "payees": payees,
+        "start": START_DATE,
+        "end": START_DATE + timedelta(days=max(transactions - 1, 0) // _TXS_PER_DAY + 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic beancount ledger")
+    parser.add_argument("transactions", type=int, help="amount of transactions")
+    parser.add_argument("-o", "--output", type=Path, default=Path("synthetic.bean"))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_ledger(args.output, args.transactions, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Time the ledger operations on synthetic ledgers, and write the results to a JSON file
+which can be compared between runs.
+
+Usage: python -m benchmarks.run --sizes 1000 10000 -o results.json [--compare baseline.json]
+"""
+import argparse
+import hashlib
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+import yaml
+from beancount import loader
+import conf
+from bean_utils import bean, vec_query
+from benchmarks.ledger_generator import ASSET_ACCOUNTS, EXPENSE_ACCOUNTS, write_ledger
+
+
+_EMBEDDING_DIM = 64
+
+
+def fake_embedding(texts):
+    """Deterministic embeddings by the hash of texts, in the same shape as `vec_query.embedding`."""
+    result = []
+    for text in texts:
+        digest = hashlib.sha256(text.encode()).digest() * (_EMBEDDING_DIM // 32)
+        result.append({"embedding": [b / 255 for b in digest[:_EMBEDDING_DIM]]})
+    return result, len(texts)
+
+
+def _timeit(func, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+class Runner:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = []
+
+    def bench(self, name, size, func, calls=1, repeat=None):
+        """
+        Time the function and record the result.
+
+        Args:
+            calls (int): The amount of operations done by one call of `func`, the
+                recorded times are per operation.
+        """
+        durations = [d / calls for d in _timeit(func, repeat or self.repeat)]
+        result = {
+            "name": name,
+            "size": size,
+            "repeat": len(durations),
+            "calls": calls,
+            "min": min(durations),
+            "median": statistics.median(durations),
+        }
+        self.results.append(result)
+        sys.stdout.write(f"{name:<32} {size:>9}  median {result['median'] * 1000:10.3f}ms  "
+                         f"min {result['min'] * 1000:10.3f}ms\n")
+        return result
+
+
+def _write_config(folder, ledger, tx_amount):
+    config = {
+        "beancount": {
+            "filename": str(ledger),
+            "currency": "USD",
+            "account_distinguation_range": [1, 2],
+        },
+        "embedding": {
+            "enable": True,
+            "db_store_folder": str(folder),
+            "transaction_amount": tx_amount,
+            "candidates": 3,
+            "output_amount": 1,
+        },
+    }
+    config_path = folder / "config.yaml"
+    config_path.write_text(yaml.safe_dump(config))
+    conf.load_config(config_path)
+
+
+def bench_ledger(runner, size, folder):
+    ledger = folder / "main.bean"
+    info = write_ledger(ledger, size)
+    payees = info["payees"][:50]
+    _write_config(folder, ledger, min(size, 1000))
+
+    manager = bean.BeanManager(str(ledger))
+    runner.bench("load", size, manager._load, repeat=min(runner.repeat, 3))  # noqa: SLF001
+
+    account_queries = [a.split(":")[-1] for a in ASSET_ACCOUNTS + EXPENSE_ACCOUNTS] + ["Chase", "Food:"]
+    runner.bench("find_account", size, lambda: [manager.find_account(a) for a in account_queries],
+                 calls=len(account_queries))
+    runner.bench("find_account_by_payee", size, lambda: [manager.find_account_by_payee(p) for p in payees],
+                 calls=len(payees))
+    lines = [f'12.30 Checking "{p}" Lunch' for p in payees]
+    runner.bench("generate_trx", size, lambda: [manager.generate_trx(line) for line in lines], calls=len(lines))
+
+    end = info["end"]
+    month = end - timedelta(days=30)
+    queries = {
+        "run_query.bill": (f"SELECT ROOT(account, 2) as acc, cost(sum(position)) AS cost "
+                           f"WHERE date>={month} AND date<{end} GROUP BY acc ORDER BY acc;"),
+        "run_query.expense": (f"SELECT ROOT(account, 2) as acc, cost(sum(position)) AS cost "
+                              f"WHERE date>={info['start']} AND date<{end} AND ROOT(account, 1)=\"Expenses\" "
+                              f"GROUP BY acc;"),
+        "run_query.payee": f'SELECT account, sum(position) WHERE payee="{payees[0]}" GROUP BY account;',
+    }
+    for name, q in queries.items():
+        def _run_query(q=q):
+            # Measure the query itself rather than the result cache
+            manager.query_cache.clear()
+            manager.run_query(q)
+        runner.bench(name, size, _run_query)
+
+    entries = manager.entries
+    # A new folder for each full build, the following builds of the same folder are incremental
+    runner.bench("build_tx_db", size, lambda: vec_query.build_tx_db(entries, tempfile.mkdtemp(dir=folder)),
+                 repeat=min(runner.repeat, 3))
+    # Build the default folder once untimed, so that every timed build is incremental
+    vec_query.build_tx_db(entries)
+    runner.bench("build_tx_db.incremental", size, lambda: vec_query.build_tx_db(entries),
+                 repeat=min(runner.repeat, 3))
+    manager.close()
+
+
+def bench_vec_db(runner, size, folder):
+    from vec_db import json_vec_db
+    backends = {"json_vec_db": json_vec_db}
+    try:
+        from vec_db import sqlite_vec_db
+        backends["sqlite_vec_db"] = sqlite_vec_db
+    except ImportError:
+        sys.stdout.write("sqlite-vec is not installed, skip sqlite_vec_db\n")
+
+    sentences = [f'"Payee {i}" "Narration {i}" Food:Restaurant BofA:Checking' for i in range(size)]
+    embeddings, _ = fake_embedding(sentences)
+    txs = [{
+        "sentence": sentence,
+        "hash": hashlib.sha256(sentence.encode()).hexdigest(),
+        "occurance": 1,
+        "content": sentence,
+        "embedding": e["embedding"],
+    } for sentence, e in zip(sentences, embeddings)]
+    queries = sentences[:10]
+    query_embeddings = [e["embedding"] for e in embeddings[:10]]
+    for name, backend in backends.items():
+        db_dir = folder / name
+        db_dir.mkdir()
+        runner.bench(f"{name}.build", size, lambda backend=backend, db_dir=db_dir: backend.build_db(txs, db_dir),
+                     repeat=min(runner.repeat, 3))
+        runner.bench(f"{name}.query", size,
+                     lambda backend=backend, db_dir=db_dir: backend.query_by_embeddings(
+                         query_embeddings, queries, 3, db_dir),
+                     calls=len(queries))
+
+
+def compare(results, baseline):
+    """Print the ratio of the median times to the baseline."""
+    base = {(r["name"], r["size"]): r for r in baseline["results"]}
+    sys.stdout.write(f"\n{'benchmark':<32} {'size':>9}  {'baseline':>12}  {'current':>12}  ratio\n")
+    for result in results:
+        old = base.get((result["name"], result["size"]))
+        if old is None:
+            continue
+        ratio = result["median"] / old["median"] if old["median"] else float("inf")
+        sys.stdout.write(f"{result['name']:<32} {result['size']:>9}  {old['median'] * 1000:10.3f}ms  "
+                         f"{result['median'] * 1000:10.3f}ms  {ratio:.2f}x\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark beanbot on synthetic ledgers")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000],
+                        help="amount of transactions of the generated ledgers, up to 1000000")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("-o", "--output", type=Path, default=Path("benchmark_results.json"))
+    parser.add_argument("--compare", type=Path, help="results of a previous run to compare with")
+    args = parser.parse_args()
+
+    # Measure parsing the ledger instead of beancount's pickle cache
+    loader.initialize(use_cache=False)
+    vec_query.embedding = fake_embedding
+    runner = Runner(args.repeat)
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            bench_ledger(runner, size, Path(folder))
+        with tempfile.TemporaryDirectory() as folder:
+            bench_vec_db(runner, size, Path(folder))
+
+    output = {
+        "meta": {
+            "time": datetime.now().astimezone().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": args.sizes,
+            "repeat": args.repeat,
+        },
+        "results": runner.results,
+    }
+    args.output.write_text(json.dumps(output, indent=2))
+    if args.compare:
+        compare(runner.results, json.loads(args.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,14 @@
 from datetime import date
 from dataclasses import dataclass
 from conf.i18n import gettext as _
-from typing import List, Union, Any
+from typing import List, Union, Any, Hashable, Optional
+import subprocess
+from concurrent.futures import Future
 from beancount.core.inventory import Inventory
-import requests
 from bean_utils import vec_query
-from bean_utils.bean import bean_manager, NoTransactionError
+from bean_utils import embedding_cache, manager_pool, timing
+from bean_utils.batch_executor import RequestError
+from bean_utils.bean import BeanManager, bean_manager, NoTransactionError
 import conf
 
 
@@ -20,6 +23,13 @@ class ErrorMessage:
     excption: Exception
 
 
+@dataclass
+class BulkMessage:
+    # All generated transactions, which are submitted at once
+    content: str
+    errors: List[str]
+
+
 @dataclass
 class Table:
     title: str
@@ -27,12 +37,37 @@ class Table:
     rows: List[List[str]]
 
 
-def build_db() -> BaseMessage:
+def get_manager(owner: Optional[Hashable] = None) -> BeanManager:
+    """
+    Get the manager of the ledger owned by the chat or user. The default ledger is
+    used if the owner has no ledger configured in `ledgers`.
+    """
+    pool = manager_pool.manager_pool
+    if owner is not None and pool is not None and owner in pool:
+        return pool.get(owner)
+    return bean_manager
+
+
+def build_db(owner: Optional[Hashable] = None) -> BaseMessage:
     if not conf.config.embedding.get("enable", True):
         return BaseMessage(content=_("Embedding is not enabled."))
-    entries = bean_manager.entries
-    tokens = vec_query.build_tx_db(entries)
-    return BaseMessage(content=_("Token usage: {tokens}").format(tokens=tokens))
+    manager = get_manager(owner)
+    result = vec_query.build_tx_db(manager.entries, manager.db_store_folder)
+    content = "\n".join([
+        _("Token usage: {tokens}").format(tokens=result["tokens"]),
+        _("Reused embeddings: {reused}, newly embedded: {embedded}").format(
+            reused=result["reused"], embedded=result["embedded"]),
+    ])
+    return BaseMessage(content=content)
+
+
+def format_ledger(owner: Optional[Hashable] = None) -> Union[BaseMessage, ErrorMessage]:
+    try:
+        get_manager(owner).format_ledger()
+    except (OSError, subprocess.SubprocessError) as e:
+        rendered = "{}: {}".format(e.__class__.__name__, str(e))
+        return ErrorMessage(rendered, e)
+    return BaseMessage(content=_("Ledger formatted."))
 
 
 def _translate_rows(rows: List[List[Any]]) -> List[List[str]]:
@@ -46,7 +81,7 @@ def _translate_rows(rows: List[List[Any]]) -> List[List[str]]:
     return parsed_rows
 
 
-def fetch_expense(start: date, end: date, root_level: int = 2) -> Table:
+def fetch_expense(start: date, end: date, root_level: int = 2, owner: Optional[Hashable] = None) -> Table:
     if (end - start).days == 1:
         title = _("Expenditures on {start}").format(start=start)
     else:
@@ -56,11 +91,11 @@ def fetch_expense(start: date, end: date, root_level: int = 2) -> Table:
     query = (f'SELECT ROOT(account, {root_level}) as acc, cost(sum(position)) AS cost '
              f'WHERE date>={start} AND date<{end} AND ROOT(account, 1)="Expenses" GROUP BY acc;')
 
-    __, rows = bean_manager.run_query(query)
+    __, rows = get_manager(owner).run_query(query)
     return Table(title=title, headers=headers, rows=_translate_rows(rows))
 
 
-def fetch_bill(start: date, end: date, root_level: int = 2) -> Table:
+def fetch_bill(start: date, end: date, root_level: int = 2, owner: Optional[Hashable] = None) -> Table:
     if (end - start).days == 1:
         title = _("Account changes on {start}").format(start=start)
     else:
@@ -74,13 +109,13 @@ def fetch_bill(start: date, end: date, root_level: int = 2) -> Table:
     # FROM OPEN ON {start} CLOSE ON {end} GROUP BY account ORDER BY account;'
     # 等同于 BALANCES FROM OPEN ON ... CLOSE ON ...
     # 查询结果中 Asset 均为关闭时间时刻的保有量
-    __, rows = bean_manager.run_query(query)
+    __, rows = get_manager(owner).run_query(query)
     return Table(title=title, headers=headers, rows=_translate_rows(rows))
 
 
-def clone_txs(message: str) -> Union[BaseMessage, ErrorMessage]:
+def clone_txs(message: str, owner: Optional[Hashable] = None) -> Union[BaseMessage, ErrorMessage]:
     try:
-        cloned_txs = bean_manager.clone_trx(message)
+        cloned_txs = get_manager(owner).clone_trx(message)
     except ValueError as e:
         if e == NoTransactionError:
             err_msg = e.args[0]
@@ -90,10 +125,51 @@ def clone_txs(message: str) -> Union[BaseMessage, ErrorMessage]:
     return BaseMessage(content=cloned_txs)
 
 
-def render_txs(message_str: str) -> Union[List[BaseMessage], ErrorMessage]:
+@timing.trace("render_txs")
+def render_txs(message_str: str, owner: Optional[Hashable] = None) -> Union[List[BaseMessage], BulkMessage, ErrorMessage]:
+    import requests
+
+    lines = [line.strip() for line in message_str.splitlines() if line.strip()]
+    if len(lines) > 1:
+        return _render_bulk_txs(lines, owner)
     try:
-        trxs = bean_manager.generate_trx(message_str)
-    except (ValueError, requests.exceptions.RequestException) as e:
+        trxs = get_manager(owner).generate_trx(message_str)
+    except (ValueError, RequestError, requests.exceptions.RequestException) as e:
         rendered = "{}: {}".format(e.__class__.__name__, str(e))
         return ErrorMessage(rendered, e)
     return [BaseMessage(tx) for tx in trxs]
+
+
+def _render_bulk_txs(lines: List[str], owner: Optional[Hashable] = None) -> Union[BulkMessage, ErrorMessage]:
+    results = get_manager(owner).generate_trx_batch(lines)
+    trxs = []
+    errors = []
+    for lineno, result in enumerate(results, 1):
+        if isinstance(result, Exception):
+            errors.append(_("Line {lineno}: {error}").format(
+                lineno=lineno, error="{}: {}".format(result.__class__.__name__, str(result))))
+        else:
+            # Take the best candidate of each line
+            trxs.append(result[0].strip("\n"))
+    if not trxs:
+        return ErrorMessage("\n".join(errors), next(r for r in results if isinstance(r, Exception)))
+    return BulkMessage(content="\n\n".join(trxs), errors=errors)
+
+
+def fetch_stats(owner: Optional[Hashable] = None) -> Table:
+    headers = [_("Stage"), _("Count"), "p50", "p95", "p99"]
+    rows = []
+    for stage, stats in sorted(timing.stage_stats.summary().items()):
+        rows.append([stage, str(stats["count"]),
+                     *(f"{stats[f'p{p}'] * 1000:.1f}ms" for p in timing.PERCENTILES)])
+    title = _("Latency of stages")
+    if conf.config.embedding.get("enable", True):
+        cache = embedding_cache.get_cache(get_manager(owner).db_store_folder)
+        if cache is not None:
+            title += "\n" + _("Embedding cache: {memory_hits} memory hits, {disk_hits} disk hits, "
+                              "{misses} misses").format(**cache.stats())
+    return Table(title=title, headers=headers, rows=rows)
+
+
+def submit_txs(trx: str, owner: Optional[Hashable] = None) -> Future:
+    return get_manager(owner).submit_trx(trx)
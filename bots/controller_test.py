@@ -1,10 +1,14 @@
+import shutil
 import pytest
+import requests
+import textwrap
 from datetime import datetime, date
-from bean_utils import vec_query
+from beancount.parser import parser
+from bean_utils import batch_executor, vec_query, manager_pool, timing
 from conf.conf_test import load_config_from_dict, clear_config
 from bean_utils.bean import init_bean_manager
 from bots import controller
-from bean_utils.bean_test import assert_txs_equal, mock_embedding
+from bean_utils.bean_test import MockResponse, assert_txs_equal, mock_embedding
 from conf.config_data import Config
 
 
@@ -117,6 +121,102 @@ def test_render_txs(mock_env):
     assert response.content == 'ValueError: Account ICBC:Checking not found'
 
 
+def test_render_txs_rate_limited(mock_env, monkeypatch):
+    monkeypatch.setattr(mock_env, "embedding", Config.from_dict({
+        "enable": True,
+        "db_store_folder": mock_env.embedding.db_store_folder,
+        "cache": False,
+        "max_retries": 5,
+    }))
+    posts = []
+    def _mock_post(*args, **kwargs):
+        posts.append(kwargs)
+        return MockResponse({"error": "rate limited"}, status_code=429, headers={"Retry-After": "30"})
+    monkeypatch.setattr(requests.Session, "post", _mock_post)
+    sleeps = []
+    monkeypatch.setattr(batch_executor.time, "sleep", sleeps.append)
+
+    # Retried once without a long wait, and replied with the error
+    response = controller.render_txs('10.00 ICBC:Checking NotFound McDonalds "Big Mac"')
+    assert isinstance(response, controller.ErrorMessage)
+    assert response.content == "RetryableError: Embedding request failed with status 429"
+    assert len(posts) == 2
+    assert sleeps == [vec_query.QUERY_MAX_DELAY]
+    response = controller.render_txs('10.00 ICBC:Checking NotFound McDonalds "Big Mac"\n5 "unclosed')
+    assert isinstance(response, controller.ErrorMessage)
+    # Lines converted without the request are still rendered
+    response = controller.render_txs('23.4 BofA:Checking "Kin Soy" Eating\n'
+                                     '10.00 ICBC:Checking NotFound McDonalds "Big Mac"')
+    assert isinstance(response, controller.BulkMessage)
+    assert response.errors == ["Line 2: RetryableError: Embedding request failed with status 429"]
+
+
+def test_render_txs_rejected(mock_env, monkeypatch):
+    monkeypatch.setattr(mock_env, "embedding", Config.from_dict({
+        "enable": True,
+        "db_store_folder": mock_env.embedding.db_store_folder,
+        "cache": False,
+    }))
+    monkeypatch.setattr(requests.Session, "post", lambda *args, **kwargs: MockResponse(
+        {"error": "Invalid api key"}, status_code=401))
+    response = controller.render_txs('10.00 ICBC:Checking NotFound McDonalds "Big Mac"')
+    assert isinstance(response, controller.ErrorMessage)
+    assert response.content.startswith("RequestRejectedError: Embedding request failed with status 401")
+
+
+def test_render_bulk_txs(mock_env):
+    resp = controller.render_txs("""
+        23.4 BofA:Checking "Kin Soy" Eating
+        10.00 ICBC:Checking NotFound McDonalds "Big Mac"
+        5 BofA:Checking "Kin Soy" Lunch #tag1
+    """)
+    assert isinstance(resp, controller.BulkMessage)
+    assert resp.errors == ["Line 2: ValueError: Account ICBC:Checking not found"]
+    exp_trx = f"""
+    {today} * "Kin Soy" "Eating"
+        Assets:US:BofA:Checking  -23.40 USD
+        Expenses:Food:Restaurant
+
+    {today} * "Kin Soy" "Lunch" #tag1
+        Assets:US:BofA:Checking  -5.00 USD
+        Expenses:Food:Restaurant
+    """
+    # All transactions are in one block to be submitted at once
+    txs, errors, _ = parser.parse_string(resp.content)
+    exp_txs, _, _ = parser.parse_string(textwrap.dedent(exp_trx))
+    assert not errors
+    assert len(txs) == 2
+    for tx, exp_tx in zip(txs, exp_txs):
+        assert_txs_equal(tx, exp_tx)
+
+    # Nothing to submit if all lines fail
+    resp = controller.render_txs("10.00 ICBC:Checking NotFound\n5 'unclosed")
+    assert isinstance(resp, controller.ErrorMessage)
+    assert resp.content.splitlines()[0] == "Line 1: ValueError: Account ICBC:Checking not found"
+
+
+def test_fetch_stats(mock_env, monkeypatch):
+    monkeypatch.setattr(timing, "stage_stats", timing.StageStats())
+    assert controller.fetch_stats().rows == []
+
+    controller.render_txs('23.4 BofA:Checking "Kin Soy" Eating')
+    table = controller.fetch_stats()
+    assert table.title == "Latency of stages"
+    assert table.headers == ["Stage", "Count", "p50", "p95", "p99"]
+    assert [row[:2] for row in table.rows] == [
+        ["account_matching", "1"], ["generate_trx", "1"], ["render_txs", "1"],
+    ]
+    assert table.rows[0][2].endswith("ms")
+
+    # Metrics of the embedding cache
+    monkeypatch.setattr(mock_env, "embedding", Config.from_dict({
+        "enable": True,
+        "db_store_folder": mock_env.embedding.db_store_folder,
+    }))
+    table = controller.fetch_stats()
+    assert table.title == "Latency of stages\nEmbedding cache: 0 memory hits, 0 disk hits, 0 misses"
+
+
 def test_build_db(monkeypatch, mock_env):
     # Build db without embedding enabled
     response = controller.build_db()
@@ -126,6 +226,7 @@ def test_build_db(monkeypatch, mock_env):
     # Build db with embedding enabled
     monkeypatch.setattr(mock_env, "embedding", Config.from_dict({
         "enable": True,
+        "db_store_folder": mock_env.embedding.db_store_folder,
         "transaction_amount": 100,
         "candidates": 3,
         "output_amount": 2,
@@ -133,4 +234,26 @@ def test_build_db(monkeypatch, mock_env):
     monkeypatch.setattr(vec_query, "embedding", mock_embedding)
     response = controller.build_db()
     assert isinstance(response, controller.BaseMessage)
-    assert response.content == f"Token usage: {mock_env.embedding.transaction_amount}"
+    assert response.content == "Token usage: 100\nReused embeddings: 0, newly embedded: 100"
+    # Rebuild reuses the embeddings
+    response = controller.build_db()
+    assert response.content == "Token usage: 0\nReused embeddings: 100, newly embedded: 0"
+
+
+def test_owner_ledger(mock_env, tmp_path, monkeypatch):
+    fname = tmp_path / "family.bean"
+    shutil.copyfile("testdata/example.bean", fname)
+    pool = manager_pool.BeanManagerPool([{"name": "family", "filename": str(fname), "chat_id": 42}])
+    monkeypatch.setattr(manager_pool, "manager_pool", pool)
+    future = controller.submit_txs("""
+2023-06-29 * "Test Payee" "Test Narration"
+  Liabilities:US:Chase:Slate                       -10.00 USD
+  Expenses:Food:Restaurant""", owner=42)
+    future.result()
+
+    start, end = date(2023, 6, 29), date(2023, 6, 30)
+    assert controller.fetch_expense(start, end, owner=42).rows == [["Expenses:Food", "41.59 USD"]]
+    # Other owners use the default ledger
+    assert controller.fetch_expense(start, end, owner=1).rows == [["Expenses:Food", "31.59 USD"]]
+    assert controller.fetch_expense(start, end).rows == [["Expenses:Food", "31.59 USD"]]
+    pool.close()
@@ -0,0 +1,94 @@
+import re
+from datetime import date, datetime, timedelta
+from typing import Optional, Tuple
+
+
+# The same formats as `fava.util.date.parse_date`, except the fiscal years
+_RANGE_RE = re.compile(r"(.*?)(?:-|to)(?=\s*\d{4})(.*)")
+_YEAR_RE = re.compile(r"^(\d{4})$")
+_MONTH_RE = re.compile(r"^(\d{4})-(\d{2})$")
+_DAY_RE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})$")
+_WEEK_RE = re.compile(r"^(\d{4})-w(\d{2})$")
+_QUARTER_RE = re.compile(r"^(\d{4})-q([1234])$")
+_VARIABLE_RE = re.compile(r"\(?(year|quarter|month|week|day)(?:([-+])(\d+))?\)?")
+
+
+def _today() -> date:
+    return datetime.now().astimezone().date()
+
+
+def _next_month(start: date, months: int = 1) -> date:
+    year, month = divmod(start.month - 1 + months, 12)
+    return date(start.year + year, month + 1, 1)
+
+
+def substitute(string: str) -> str:
+    """
+    Replace the variables referring to today, like `month` or `day-1`, with the
+    dates they refer to.
+    """
+    today = _today()
+    for match in _VARIABLE_RE.finditer(string):
+        complete_match, interval, sign, offset = match.group(0, 1, 2, 3)
+        offset = int(offset or 0) * (-1 if sign == "-" else 1)
+        if interval == "year":
+            replacement = str(today.year + offset)
+        elif interval == "quarter":
+            quarter = (today.month - 1) // 3 + offset
+            replacement = f"{today.year + quarter // 4}-Q{quarter % 4 + 1}"
+        elif interval == "month":
+            replacement = _next_month(today, offset).strftime("%Y-%m")
+        elif interval == "week":
+            replacement = (today + timedelta(weeks=offset)).strftime("%Y-W%W")
+        else:
+            replacement = (today + timedelta(days=offset)).isoformat()
+        string = string.replace(complete_match, replacement, 1)
+    return string
+
+
+def parse_date(string: str) -> Tuple[Optional[date], Optional[date]]:
+    """
+    Parse a date or a range of dates into the inclusive start and the exclusive end.
+
+    Supported formats are `2024-08-16`, `2024-08`, `2024`, `2024-W01`, `2024-Q3`, and
+    the variables `year`, `quarter`, `month`, `week`, `day` with optional offsets like
+    `month-1`. A range is written as `{start} - {end}` or `{start} to {end}`.
+
+    Returns:
+        Tuple[date, date]: The start and end date, or `(None, None)` if the string is invalid.
+    """
+    string = string.strip().lower()
+    if not string:
+        return None, None
+    string = substitute(string).lower()
+
+    match = _RANGE_RE.match(string)
+    if match:
+        return parse_date(match.group(1))[0], parse_date(match.group(2))[1]
+
+    try:
+        match = _YEAR_RE.match(string)
+        if match:
+            start = date(int(match.group(1)), 1, 1)
+            return start, date(start.year + 1, 1, 1)
+        match = _MONTH_RE.match(string)
+        if match:
+            start = date(*map(int, match.groups()), 1)
+            return start, _next_month(start)
+        match = _DAY_RE.match(string)
+        if match:
+            start = date(*map(int, match.groups()))
+            return start, start + timedelta(days=1)
+        match = _WEEK_RE.match(string)
+        if match:
+            # Weeks start on Monday, the same as `%W` of strftime
+            start = datetime.strptime(f"{match.group(1)}-W{match.group(2)}-1", "%Y-W%W-%w").date()  # noqa: DTZ007
+            return start, start + timedelta(weeks=1)
+        match = _QUARTER_RE.match(string)
+        if match:
+            start = date(int(match.group(1)), (int(match.group(2)) - 1) * 3 + 1, 1)
+            return start, _next_month(start, 3)
+    except ValueError:
+        # Out of range, e.g. 2024-13
+        pass
+    return None, None
@@ -0,0 +1,35 @@
+from datetime import date
+import pytest
+from bots import date_parser
+from bots.date_parser import parse_date
+
+
+@pytest.fixture
+def mock_today(monkeypatch):
+    monkeypatch.setattr(date_parser, "_today", lambda: date(2024, 8, 16))
+
+
+@pytest.mark.parametrize(
+    ("string", "exp"),
+    [
+        ("2024", (date(2024, 1, 1), date(2025, 1, 1))),
+        ("2024-02", (date(2024, 2, 1), date(2024, 3, 1))),
+        ("2024-12", (date(2024, 12, 1), date(2025, 1, 1))),
+        ("2024-08-16", (date(2024, 8, 16), date(2024, 8, 17))),
+        ("2024-W01", (date(2024, 1, 1), date(2024, 1, 8))),
+        ("2023-Q4", (date(2023, 10, 1), date(2024, 1, 1))),
+        ("year", (date(2024, 1, 1), date(2025, 1, 1))),
+        ("quarter-3", (date(2023, 10, 1), date(2024, 1, 1))),
+        ("month+5", (date(2025, 1, 1), date(2025, 2, 1))),
+        ("week", (date(2024, 8, 12), date(2024, 8, 19))),
+        ("day-1", (date(2024, 8, 15), date(2024, 8, 16))),
+        ("2024-01 - 2024-03", (date(2024, 1, 1), date(2024, 4, 1))),
+        ("2024-01-01 to day", (date(2024, 1, 1), date(2024, 8, 17))),
+        ("month-2 to month", (date(2024, 6, 1), date(2024, 9, 1))),
+        ("", (None, None)),
+        ("someday", (None, None)),
+        ("2024-13", (None, None)),
+    ],
+)
+def test_parse_date(string, exp, mock_today):
+    assert parse_date(string) == exp
@@ -1,3 +1,4 @@
+import asyncio
 import click
 from datetime import datetime, timedelta
 from conf.i18n import gettext as _
@@ -6,14 +7,18 @@ from mmpy_bot import Plugin, listen_to, listen_webhook
 from mmpy_bot.plugins.base import PluginManager
 from mmpy_bot.driver import Driver
 from mmpy_bot import Message, WebHookEvent
-from fava.util.date import parse_date
 from beancount.core.inventory import Inventory
-from bean_utils.bean import bean_manager
+from bean_utils import manager_pool
 from bots import controller
+from bots.date_parser import parse_date
 import conf
 
 
 OWNER_NAME = conf.config.bot.mattermost.owner_user
+# Users who own the ledgers configured in `ledgers`
+ALLOWED_USERS = [OWNER_NAME]
+if manager_pool.manager_pool is not None:
+    ALLOWED_USERS.extend(manager_pool.manager_pool.owners("owner_user"))
 
 
 def render_table(header, rows):
@@ -60,9 +65,9 @@ class BeanBotPlugin(Plugin):
             }
         }
 
-    @listen_to(r"^-?[\d.]+ ", direct_only=True, allowed_users=[OWNER_NAME])
+    @listen_to(r"^-?[\d.]+ ", direct_only=True, allowed_users=ALLOWED_USERS)
     async def render(self, message: Message):
-        resp = controller.render_txs(message.text)
+        resp = controller.render_txs(message.text, owner=message.sender_name)
         if isinstance(resp, controller.ErrorMessage):
             self.driver.reply_to(message, "", props={
                 "attachments": [
@@ -73,6 +78,21 @@ class BeanBotPlugin(Plugin):
                 ]
             })
             return
+        if isinstance(resp, controller.BulkMessage):
+            attachments = []
+            if resp.errors:
+                attachments.append({
+                    "text": "\n".join(resp.errors),
+                    "color": "#ffc107"
+                })
+            attachments.append({
+                "actions": [
+                    self.gen_action("submit", _("Submit all"), resp.content),
+                    self.gen_action("cancel", _("Cancel"), resp.content),
+                ]
+            })
+            self.driver.reply_to(message, f"`{resp.content}`", props={"attachments": attachments})
+            return
         for tx in resp:
             tx_content = tx.content
             self.driver.reply_to(message, f"`{tx_content}`", props={
@@ -91,10 +111,15 @@ class BeanBotPlugin(Plugin):
         post_id = event.body["post_id"]
         trx = event.body["context"]["trx"]
         webhook_id = event.webhook_id
+        # The ledger is chosen by the user who clicked, rather than the context of the request
+        owner = self.driver.users.get_user(event.body["user_id"])["username"]
+        if owner not in ALLOWED_USERS:
+            conf.logger.warning("Action %s from unknown user %s", webhook_id, owner)
+            return
 
         if webhook_id == "submit":
             reaction = "white_check_mark"
-            bean_manager.commit_trx(trx.strip())
+            await asyncio.wrap_future(controller.submit_txs(trx.strip(), owner=owner))
             conf.logger.info("Commit transaction: %s\n", trx)
         else:
             reaction = "wastebasket"
@@ -110,7 +135,7 @@ class BeanBotPlugin(Plugin):
             "data": {"post": {"id": post_id}},
         }), reaction)
 
-    @listen_to("bill", direct_only=True, allowed_users=[OWNER_NAME])
+    @listen_to("bill", direct_only=True, allowed_users=ALLOWED_USERS)
     @click.command(help=_("Query account changes"))
     @click.option("-l", "--level", default=2, type=int)
     @click.argument("date", nargs=-1, type=str)
@@ -123,11 +148,11 @@ class BeanBotPlugin(Plugin):
         if start is None and end is None:
             self.driver.reply_to(message, f"Wrong args: {date}")
 
-        resp_table = controller.fetch_bill(start, end, level)
+        resp_table = controller.fetch_bill(start, end, level, owner=message.sender_name)
         result = render_table(resp_table.headers, resp_table.rows)
         self.driver.reply_to(message, f"**{resp_table.title}**\n\n{result}")
 
-    @listen_to("expense", direct_only=True, allowed_users=[OWNER_NAME])
+    @listen_to("expense", direct_only=True, allowed_users=ALLOWED_USERS)
     @click.command(help=_("Query expenses"))
     @click.option("-l", "--level", default=2, type=int)
     @click.argument("args", nargs=-1, type=str)
@@ -142,13 +167,24 @@ class BeanBotPlugin(Plugin):
             self.driver.reply_to(message, f"Wrong args: {args}")
             return
 
-        resp_table = controller.fetch_expense(start, end, level)
+        resp_table = controller.fetch_expense(start, end, level, owner=message.sender_name)
         result = render_table(resp_table.headers, resp_table.rows)
         self.driver.reply_to(message, f"**{resp_table.title}**\n\n{result}")
 
-    @listen_to("build", direct_only=True, allowed_users=[OWNER_NAME])
+    @listen_to("build", direct_only=True, allowed_users=ALLOWED_USERS)
     def build_db(self, message: Message):
-        msg = controller.build_db()
+        msg = controller.build_db(owner=message.sender_name)
+        self.driver.reply_to(message, msg.content)
+
+    @listen_to("stats", direct_only=True, allowed_users=ALLOWED_USERS)
+    def stats(self, message: Message):
+        resp_table = controller.fetch_stats(owner=message.sender_name)
+        result = render_table(resp_table.headers, resp_table.rows)
+        self.driver.reply_to(message, f"**{resp_table.title}**\n\n{result}")
+
+    @listen_to("format", direct_only=True, allowed_users=ALLOWED_USERS)
+    def format_ledger(self, message: Message):
+        msg = controller.format_ledger(owner=message.sender_name)
         self.driver.reply_to(message, msg.content)
 
 
@@ -1,4 +1,5 @@
 # coding: utf-8
+import asyncio
 import time
 from conf.i18n import gettext as _
 from datetime import timedelta, datetime
@@ -8,9 +9,9 @@ from telegram.ext import (
     Application, filters,
     MessageHandler, CommandHandler, CallbackQueryHandler
 )
-from fava.util.date import parse_date
-from bean_utils.bean import bean_manager
+from bean_utils import manager_pool
 from bots import controller
+from bots.date_parser import parse_date
 import conf
 
 
@@ -26,7 +27,8 @@ async def start(update, context):
 def owner_required(func):
     async def wrapped(update, context):
         chat_id = update.effective_chat.id
-        if chat_id != OWNER_ID:
+        pool = manager_pool.manager_pool
+        if chat_id != OWNER_ID and (pool is None or chat_id not in pool):
             return
         await func(update, context)
 
@@ -78,7 +80,7 @@ async def bill(update, context):
     if start is None and end is None:
         await update.message.reply_text(f"Wrong args: {context.args}")
         return
-    resp_table = controller.fetch_bill(start, end, root_level)
+    resp_table = controller.fetch_bill(start, end, root_level, owner=update.effective_chat.id)
     result = _render_tg_table(resp_table.headers, resp_table.rows)
     message = update.message
     if update.message is None:
@@ -93,7 +95,7 @@ async def expense(update, context):
     if start is None and end is None:
         await update.message.reply_text(f"Wrong args: {context.args}")
         return
-    resp_table = controller.fetch_expense(start, end, root_level)
+    resp_table = controller.fetch_expense(start, end, root_level, owner=update.effective_chat.id)
     result = _render_tg_table(resp_table.headers, resp_table.rows)
     message = update.message
     if update.message is None:
@@ -107,6 +109,11 @@ _button_list = [
     telegram.InlineKeyboardButton(_("Cancel"), callback_data="cancel"),
 ]
 _pending_txs_reply_markup = telegram.InlineKeyboardMarkup([_button_list])
+# All transactions of a bulk message are in one message and submitted at once
+_pending_bulk_txs_reply_markup = telegram.InlineKeyboardMarkup([[
+    telegram.InlineKeyboardButton(_("Submit all"), callback_data="submit"),
+    telegram.InlineKeyboardButton(_("Cancel"), callback_data="cancel"),
+]])
 
 
 @owner_required
@@ -115,10 +122,16 @@ async def render(update, context):
     if update.message is None:
         message = update.edited_message
 
-    resp = controller.render_txs(message.text)
+    resp = controller.render_txs(message.text, owner=update.effective_chat.id)
     if isinstance(resp, controller.ErrorMessage):
         await update.message.reply_text(resp.content, reply_to_message_id=message.message_id)
         return
+    if isinstance(resp, controller.BulkMessage):
+        if resp.errors:
+            await update.message.reply_text("\n".join(resp.errors), reply_to_message_id=message.message_id)
+        await update.message.reply_text(resp.content, reply_to_message_id=message.message_id,
+                                        reply_markup=_pending_bulk_txs_reply_markup)
+        return
 
     for tx in resp:
         await update.message.reply_text(tx.content, reply_to_message_id=message.message_id,
@@ -135,7 +148,7 @@ async def callback(update, context):
 
     if choice == "submit":
         result_msg = _("Submitted ✅")
-        bean_manager.commit_trx(trx)
+        await asyncio.wrap_future(controller.submit_txs(trx, owner=update.effective_chat.id))
         conf.logger.info("Commit transaction: %s\n", trx)
     else:
         result_msg = _("Cancelled ❌")
@@ -145,9 +158,23 @@ async def callback(update, context):
         await query.edit_message_text(text=f"{trx}\n\n{result_msg}")
 
 
+@owner_required
+async def stats(update, context):
+    resp_table = controller.fetch_stats(owner=update.effective_chat.id)
+    result = _render_tg_table(resp_table.headers, resp_table.rows)
+    await update.message.reply_text(_escape_md2(f"{resp_table.title}\n```\n{result}\n```"),
+                                    parse_mode="MarkdownV2")
+
+
 @owner_required
 async def build_db(update, context):
-    msg = controller.build_db()
+    msg = controller.build_db(owner=update.effective_chat.id)
+    await update.message.reply_text(msg.content)
+
+
+@owner_required
+async def format_ledger(update, context):
+    msg = controller.format_ledger(owner=update.effective_chat.id)
     await update.message.reply_text(msg.content)
 
 
@@ -159,7 +186,7 @@ async def clone_txs(update, context):
         await update.message.reply_text("Please specify the transaction", reply_to_message_id=message.message_id)
         return
     # Fetch original message
-    resp = controller.clone_txs(message.text)
+    resp = controller.clone_txs(message.text, owner=update.effective_chat.id)
     if isinstance(message, controller.ErrorMessage):
         await update.message.reply_text(resp.content, reply_to_message_id=message.message_id)
     else:
@@ -175,6 +202,8 @@ def run_bot():
         CommandHandler('bill', bill),
         CommandHandler('expense', expense),
         CommandHandler('build', build_db, has_args=False),
+        CommandHandler('format', format_ledger, has_args=False),
+        CommandHandler('stats', stats, has_args=False),
         CommandHandler('clone', clone_txs, filters=filters.REPLY, has_args=False),
         MessageHandler(filters.TEXT & (~filters.COMMAND), render),
         CallbackQueryHandler(callback),
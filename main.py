@@ -1,6 +1,10 @@
 import argparse
+import subprocess
+import sys
+from collections import Counter
+from pathlib import Path
 import conf
-from bean_utils import bean
+from bean_utils import bean, manager_pool
 
 
 def init_bot(config_path):
@@ -11,25 +15,110 @@ def init_bot(config_path):
     conf.init_logging()
     # Init beancount manager
     bean.init_bean_manager()
+    # Init the pool of other ledgers, which are loaded on demand
+    manager_pool.init_manager_pool()
 
 
 def parse_args():
     parser = argparse.ArgumentParser(prog='beanbot',
                                      description='Bot to translate text into beancount transaction')
+    parser.add_argument('--profile-startup', action="store_true",
+                        help="print the import time breakdown of the startup")
     subparser = parser.add_subparsers(title='sub command', required=True, dest='command')
 
     telegram_parser = subparser.add_parser("telegram")
     telegram_parser.add_argument('-c', nargs="?", type=str, default="config.yaml", help="config file path")
     mattermost_parser = subparser.add_parser("mattermost")
     mattermost_parser.add_argument('-c', nargs="?", type=str, default="config.yaml", help="config file path")
+    import_parser = subparser.add_parser("import", help="convert shorthand lines into transactions in bulk")
+    import_parser.add_argument('-c', nargs="?", type=str, default="config.yaml", help="config file path")
+    import_parser.add_argument('input', nargs="?", type=argparse.FileType("r"), default=sys.stdin,
+                               help="file of shorthand lines, one transaction per line (default: stdin)")
+    output_group = import_parser.add_mutually_exclusive_group(required=True)
+    output_group.add_argument('-o', '--output', type=argparse.FileType("w"),
+                              help="write the transactions to this file, '-' for stdout")
+    output_group.add_argument('--commit', action="store_true", help="commit the transactions to the ledger")
+    import_parser.add_argument('-w', '--workers', type=int, default=4,
+                               help="max amount of batches generated concurrently")
+    import_parser.add_argument('-b', '--batch-size', type=int, default=32,
+                               help="amount of lines of each embedding request")
 
     return parser.parse_args()
 
 
+def import_command(command):
+    """Import the modules of the sub command, which are imported before it runs."""
+    if command == "telegram":
+        import bots.telegram_bot  # noqa: F401
+    elif command == "mattermost":
+        import bots.mattermost_bot  # noqa: F401
+    elif command == "import":
+        import bean_utils.importer  # noqa: F401
+
+
+def profile_startup(command, config_path, limit=15):
+    """
+    Print the import time breakdown of the startup of the sub command, which is
+    measured by `python -X importtime` in a child process with a clean module cache.
+    The config is loaded before importing, since the bot modules read it on import.
+    """
+    config_path = str(Path(config_path).resolve())
+    code = (f"import conf; conf.load_config({config_path!r}); "
+            f"import main; main.import_command({command!r})")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],  # noqa: S603
+                          cwd=Path(__file__).parent, capture_output=True, text=True, check=False)
+    modules = []
+    for line in proc.stderr.splitlines():
+        # Lines are in the format of `import time: {self} | {cumulative} | {indented name}`
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((int(self_us), int(cumulative_us), name.strip()))
+    packages = Counter()
+    for self_us, _, name in modules:
+        packages[name.split(".")[0]] += self_us
+
+    total_ms = sum(packages.values()) / 1000
+    report = [f"Startup of {command} imports {len(modules)} modules in {total_ms:.1f}ms", "",
+              "Self time by top level package:"]
+    report.extend(f"{us / 1000:10.1f}ms  {name}" for name, us in packages.most_common(limit))
+    report.extend(["", "Slowest modules including their imports:"])
+    slowest = sorted(modules, key=lambda x: x[1], reverse=True)[:limit]
+    report.extend(f"{cumulative_us / 1000:10.1f}ms  {name}" for _, cumulative_us, name in slowest)
+    if proc.returncode != 0:
+        report.extend(["", f"Failed to import: {proc.stderr.strip().splitlines()[-1]}"])
+    sys.stderr.write("\n".join(report) + "\n")
+
+
+def run_import(args):
+    from bean_utils.importer import import_lines, read_lines
+
+    lines = read_lines(args.input)
+    result = import_lines(bean.bean_manager, lines, args.workers, args.batch_size)
+    for lineno, error in result.errors:
+        conf.logger.warning("Line %d: %s: %s", lineno, error.__class__.__name__, error)
+    if result.transactions:
+        data = "\n\n".join(result.transactions)
+        if args.commit:
+            # Committed in one write
+            bean.bean_manager.commit_trx(data)
+        else:
+            args.output.write(data + "\n")
+    bean.bean_manager.close()
+    # Always reported regardless of the logging level
+    sys.stderr.write(f"Imported {len(result.transactions)}/{result.lines} lines in {result.seconds:.3f}s "
+                     f"({result.throughput:.1f} lines/s)\n")
+    return 1 if result.errors else 0
+
+
 def main():
     args = parse_args()
+    if args.profile_startup:
+        profile_startup(args.command, args.c)
     init_bot(args.c)
 
+    if args.command == "import":
+        sys.exit(run_import(args))
     if args.command == "telegram":
         from bots.telegram_bot import run_bot
     elif args.command == "mattermost":
@@ -0,0 +1,18 @@
+import pytest
+import main
+
+
+@pytest.mark.parametrize(("command", "module", "dependency"), [
+    ("telegram", "bots.telegram_bot", "telegram"),
+    ("mattermost", "bots.mattermost_bot", "mmpy_bot"),
+    ("import", "bean_utils.importer", None),
+])
+def test_profile_startup(command, module, dependency, capsys):
+    if dependency is not None:
+        pytest.importorskip(dependency)
+    main.profile_startup(command, "config.yaml.example", limit=1000)
+    report = capsys.readouterr().err
+    assert report.startswith(f"Startup of {command} imports")
+    # The modules of the sub command are measured
+    assert f"ms  {module}\n" in report
+    assert "Failed to import" not in report
@@ -1,7 +1,36 @@
-try:
-    from .sqlite_vec_db import build_db, query_by_embedding
-except ImportError:
-    from .json_vec_db import build_db, query_by_embedding
+import importlib
+from bean_utils.timing import span
 
+# The backend (and numpy for the json one) is imported on the first use
+_backend = None
 
-__all__ = ["build_db", "query_by_embedding"]
+
+def _get_backend():
+    global _backend
+    if _backend is None:
+        try:
+            _backend = importlib.import_module(".sqlite_vec_db", __name__)
+        except ImportError:
+            _backend = importlib.import_module(".json_vec_db", __name__)
+    return _backend
+
+
+def build_db(transactions, db_dir=None):
+    return _get_backend().build_db(transactions, db_dir)
+
+
+def load_embeddings(model, db_dir=None):
+    return _get_backend().load_embeddings(model, db_dir)
+
+
+@span("query_by_embedding")
+def query_by_embedding(embedding, sentence, candidate_amount, db_dir=None):
+    return _get_backend().query_by_embedding(embedding, sentence, candidate_amount, db_dir)
+
+
+@span("query_by_embedding")
+def query_by_embeddings(embeddings, sentences, candidate_amount, db_dir=None):
+    return _get_backend().query_by_embeddings(embeddings, sentences, candidate_amount, db_dir)
+
+
+__all__ = ["build_db", "load_embeddings", "query_by_embedding", "query_by_embeddings"]
@@ -7,31 +7,62 @@ from vec_db.match import calculate_score
 import conf
 
 
-def _get_db_name():
+def _get_db_name(db_dir=None):
     DB_NAME = "tx_db.json"
-    db_dir = conf.config.embedding.get("db_store_folder", ".")
+    db_dir = db_dir or conf.config.embedding.get("db_store_folder", ".")
     return pathlib.Path(db_dir) / DB_NAME
 
 
-def build_db(transactions):
-    with open(_get_db_name(), "w") as f:
+def build_db(transactions, db_dir=None):
+    with open(_get_db_name(db_dir), "w") as f:
         json.dump(transactions, f)
 
 
-def query_by_embedding(embedding, sentence, candidate_amount):
+def load_embeddings(model, db_dir=None):
+    """
+    Get the stored embeddings to be reused by the next build.
+
+    Returns:
+        Dict[str, List[float]]: The embeddings by the sentences, only of the rows embedded by `model`.
+    """
     try:
-        with open(_get_db_name()) as f:
+        with open(_get_db_name(db_dir)) as f:
+            transactions = json.load(f)
+    except FileNotFoundError:
+        return {}
+    return {txs["sentence"]: txs["embedding"] for txs in transactions if txs.get("model") == model}
+
+
+def query_by_embeddings(embeddings, sentences, candidate_amount, db_dir=None):
+    """
+    Query the candidates of several embeddings, reading the database only once.
+
+    Returns:
+        list: The candidates of each embedding, or None for each if the database is not built.
+    """
+    try:
+        with open(_get_db_name(db_dir)) as f:
             transactions = json.load(f)
     except FileNotFoundError:
         conf.logger.warning("JSON vector database is not built")
-        return None
-    embed_query = np.array(embedding)
-    # Calculate cosine similarity
-    for txs in transactions:
-        embed_tx = np.array(txs["embedding"])
-        txs["distance"] = np.dot(embed_tx, embed_query) / (norm(embed_tx) * norm(embed_query))
-        txs["score"] = calculate_score(txs, sentence)
-    transactions.sort(key=itemgetter("distance"), reverse=True)
-    candidates = transactions[:candidate_amount]
-    candidates.sort(key=lambda x: x["distance"], reverse=True)
-    return candidates
+        return [None] * len(embeddings)
+    results = []
+    embed_txs = [np.array(txs["embedding"]) for txs in transactions]
+    for embedding, sentence in zip(embeddings, sentences):
+        embed_query = np.array(embedding)
+        candidates = []
+        # Calculate cosine similarity
+        for txs, embed_tx in zip(transactions, embed_txs):
+            txs = dict(txs)
+            txs["distance"] = np.dot(embed_tx, embed_query) / (norm(embed_tx) * norm(embed_query))
+            candidates.append(txs)
+        candidates.sort(key=itemgetter("distance"), reverse=True)
+        candidates = candidates[:candidate_amount]
+        for txs in candidates:
+            txs["score"] = calculate_score(txs, sentence)
+        results.append(candidates)
+    return results
+
+
+def query_by_embedding(embedding, sentence, candidate_amount, db_dir=None):
+    return query_by_embeddings([embedding], [sentence], candidate_amount, db_dir)[0]
@@ -67,5 +67,13 @@ def test_json_db(mock_config):
     assert len(candidates) == 2
     assert candidates[0]["hash"] == "hash-1"
     assert candidates[1]["hash"] == "hash-2"
+    # Query several embeddings at once
+    candidates = json_vec_db.query_by_embeddings(
+        [easy_embedding("content-1"), easy_embedding("another-3")], ["sentence-1", "sentence-3"], 1,
+    )
+    assert [c[0]["hash"] for c in candidates] == ["hash-1", "hash-3"]
+    # Stored embeddings by the sentences
+    assert json_vec_db.load_embeddings(None)["sentence-3"] == easy_embedding("another-3")
+    assert json_vec_db.load_embeddings("other") == {}
     # Cleanup
     db_path.unlink()
@@ -1,9 +1,11 @@
 import pathlib
+import re
 from operator import itemgetter
 import sqlite3
 import sqlite_vec
 from typing import List
 import struct
+import threading
 from vec_db.match import calculate_score
 import conf
 
@@ -13,34 +15,49 @@ def serialize_f32(vector: List[float]) -> bytes:
     return struct.pack("%sf" % len(vector), *vector)
 
 
-def _get_db_name():
+def _get_db_name(db_dir=None):
     DB_NAME = "tx_db.sqlite"
-    db_dir = conf.config.embedding.get("db_store_folder", ".")
+    db_dir = db_dir or conf.config.embedding.get("db_store_folder", ".")
     return pathlib.Path(db_dir) / DB_NAME
 
 
-_db = None
+# Connections by the database file, each thread has its own connection since
+# sqlite connections can only be used in the thread creating them
+_dbs = {}
+_dbs_lock = threading.Lock()
 
 
-def get_db():
-    global _db
-    if _db is not None:
-        return _db
+def get_db(db_dir=None):
+    db_name = _get_db_name(db_dir)
+    with _dbs_lock:
+        local = _dbs.get(db_name)
+        if local is None:
+            local = _dbs[db_name] = threading.local()
+    db = getattr(local, "db", None)
+    if db is not None:
+        return db
 
-    _db = sqlite3.connect(_get_db_name())
-    _db.enable_load_extension(True)
-    sqlite_vec.load(_db)
-    _db.enable_load_extension(False)
-    return _db
+    db = sqlite3.connect(db_name)
+    db.enable_load_extension(True)
+    sqlite_vec.load(db)
+    db.enable_load_extension(False)
+    local.db = db
+    return db
 
 
-def build_db(txs):
-    db = get_db()
+def deserialize_f32(blob: bytes) -> List[float]:
+    return list(struct.unpack("%sf" % (len(blob) // 4), blob))
+
+
+def _embedding_dimention(db):
+    row = db.execute("SELECT sql FROM sqlite_master WHERE name = 'vec_items'").fetchone()
+    if row is None:
+        return None
+    match = re.search(r"float\[(\d+)\]", row[0])
+    return int(match.group(1)) if match else None
 
-    embedding_dimention = 1
-    if txs:
-        embedding_dimention = len(txs[0]["embedding"])
 
+def _create_tables(db, embedding_dimention):
     # Drop table if exists
     db.execute("DROP TABLE IF EXISTS vec_items")
     db.execute("DROP TABLE IF EXISTS transactions")
@@ -55,20 +72,74 @@ def build_db(txs):
                hash varchar(64) unique,
                occurance integer,
                sentence text,
-               content text)""")
+               content text,
+               model text)""")
 
-    for id_, tx in enumerate(txs, 1):
+
+def build_db(txs, db_dir=None):
+    """
+    Sync the database with the transactions. Rows of the same sentence and model are
+    updated in place and keep their embeddings, new ones are inserted and the rest are
+    deleted. The tables are only recreated if the embedding dimention or the schema changes.
+    """
+    db = get_db(db_dir)
+
+    embedding_dimention = 1
+    if txs:
+        embedding_dimention = len(txs[0]["embedding"])
+    columns = [row[1] for row in db.execute("PRAGMA table_info(transactions)")]
+    if _embedding_dimention(db) != embedding_dimention or "model" not in columns:
+        _create_tables(db, embedding_dimention)
+
+    existing = {(sentence, model): id_
+                for id_, sentence, model in db.execute("SELECT id, sentence, model FROM transactions")}
+    kept = {}
+    for tx in txs:
+        key = (tx["sentence"], tx.get("model"))
+        if key in existing:
+            kept[key] = existing[key]
+    # Delete first, so that the hashes of the deleted rows can be inserted again
+    stale = [(id_,) for key, id_ in existing.items() if key not in kept]
+    db.executemany("DELETE FROM vec_items WHERE rowid = ?", stale)
+    db.executemany("DELETE FROM transactions WHERE id = ?", stale)
+
+    for tx in txs:
+        id_ = kept.get((tx["sentence"], tx.get("model")))
+        if id_ is not None:
+            db.execute("UPDATE transactions SET hash = ?, occurance = ?, content = ? WHERE id = ?",
+                       (tx["hash"], tx["occurance"], tx["content"], id_))
+            continue
+        cursor = db.execute("INSERT INTO transactions (hash, occurance, sentence, content, model) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (tx["hash"], tx["occurance"], tx["sentence"], tx["content"], tx.get("model")))
         db.execute("INSERT INTO vec_items (rowid, embedding) VALUES (?, ?)",
-                   (id_, serialize_f32(tx["embedding"])))
-        db.execute("INSERT INTO transactions (id, hash, occurance, sentence, content) VALUES (?, ?, ?, ?, ?)",
-                   (id_, tx["hash"], tx["occurance"], tx["sentence"], tx["content"]))
+                   (cursor.lastrowid, serialize_f32(tx["embedding"])))
     # flush db
     db.commit()
 
 
-def query_by_embedding(embedding, sentence, candidate_amount):
-    db = get_db()
+def load_embeddings(model, db_dir=None):
+    """
+    Get the stored embeddings to be reused by the next build.
 
+    Returns:
+        Dict[str, List[float]]: The embeddings by the sentences, only of the rows embedded by `model`.
+    """
+    db = get_db(db_dir)
+    try:
+        rows = db.execute("""
+                          SELECT transactions.sentence, vec_items.embedding
+                          FROM transactions JOIN vec_items ON vec_items.rowid = transactions.id
+                          WHERE transactions.model IS ?""", (model,)).fetchall()
+    except sqlite3.OperationalError as e:
+        # Not built yet, or built before the model was stored
+        if "no such" in e.args[0]:
+            return {}
+        raise
+    return {sentence: deserialize_f32(blob) for sentence, blob in rows}
+
+
+def _query_one(db, embedding, sentence, candidate_amount):
     try:
         # 1 - vec_distance_cosine(embedding, ?) is cosine similarity
         rows = db.execute(
@@ -106,3 +177,19 @@ def query_by_embedding(embedding, sentence, candidate_amount):
 
     candidates.sort(key=itemgetter("score"), reverse=True)
     return candidates
+
+
+def query_by_embeddings(embeddings, sentences, candidate_amount, db_dir=None):
+    """
+    Query the candidates of several embeddings with the same connection.
+
+    Returns:
+        list: The candidates of each embedding.
+    """
+    db = get_db(db_dir)
+    return [_query_one(db, embedding, sentence, candidate_amount)
+            for embedding, sentence in zip(embeddings, sentences)]
+
+
+def query_by_embedding(embedding, sentence, candidate_amount, db_dir=None):
+    return query_by_embeddings([embedding], [sentence], candidate_amount, db_dir)[0]
@@ -1,4 +1,5 @@
 import pytest
+from concurrent.futures import ThreadPoolExecutor
 from vec_db.json_vec_db_test import easy_embedding, mock_config
 
 try:
@@ -10,7 +11,7 @@ else:
 
 
 def test_sqlite_db(tmp_path, mock_config, monkeypatch):    
-    monkeypatch.setattr(sqlite_vec_db, "_db", None)
+    monkeypatch.setattr(sqlite_vec_db, "_dbs", {})
     # Build DB
     txs = [
         {
@@ -57,5 +58,35 @@ def test_sqlite_db(tmp_path, mock_config, monkeypatch):
     assert len(candidates) == 2
     assert candidates[0]["content"] == "content-1"
     assert candidates[1]["content"] == "content-2"
+    # Rebuild in place, the stored embeddings are kept
+    txs[1]["occurance"] = 2
+    sqlite_vec_db.build_db(txs[1:])
+    embeddings = sqlite_vec_db.load_embeddings(None)
+    assert sorted(embeddings) == ["sentence-2", "sentence-3"]
+    assert embeddings["sentence-2"] == easy_embedding("content-2")
+    candidates = sqlite_vec_db.query_by_embedding(
+        easy_embedding("content-1"), "sentence-1", 2,
+    )
+    assert {c["content"]: c["occurance"] for c in candidates} == {"content-2": 2, "another-3": 1}
+    assert sqlite_vec_db.load_embeddings("other") == {}
     # Cleanup
     db_path.unlink()
+
+
+def test_sqlite_db_threads(mock_config, monkeypatch):
+    monkeypatch.setattr(sqlite_vec_db, "_dbs", {})
+    txs = [{
+        "hash": f"hash-{i}",
+        "occurance": 1,
+        "sentence": f"sentence-{i}",
+        "content": f"content-{i}",
+        "embedding": easy_embedding(f"content-{i}"),
+    } for i in range(4)]
+    sqlite_vec_db.build_db(txs)
+    # Connections are not shared by the threads
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(
+            lambda i: sqlite_vec_db.query_by_embedding(easy_embedding(f"content-{i}"), f"sentence-{i}", 1),
+            range(4)))
+    assert [r[0]["content"] for r in results] == [f"content-{i}" for i in range(4)]
+    sqlite_vec_db._get_db_name().unlink()